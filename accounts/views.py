@@ -92,23 +92,20 @@ def profile_view(request, username=None):
     # Get or create profile (in case it doesn't exist)
     profile, created = UserProfile.objects.get_or_create(user=profile_user)
     
-    # Calculate additional stats
-    from tracker.models import StudySession
-    from django.db.models import Sum
-    from datetime import date, timedelta
+    # Calculate additional stats from the daily rollups
+    from tracker.rollup import totals
+    from django.utils import timezone
+    from datetime import timedelta
     
-    # Get study sessions for this user
-    sessions = StudySession.objects.filter(user=profile_user)
+    all_time = totals(profile_user)
     
     # Calculate stats
-    total_sessions = sessions.count()
-    avg_session_length = sessions.aggregate(avg=Sum('minutes'))['avg'] or 0
+    total_sessions = all_time['sessions']
+    avg_session_length = all_time['focus_minutes'] + all_time['break_minutes']
     
     # Last 7 days activity
-    seven_days_ago = date.today() - timedelta(days=7)
-    recent_minutes = sessions.filter(
-        created_at__date__gte=seven_days_ago
-    ).aggregate(total=Sum('minutes'))['total'] or 0
+    recent = totals(profile_user, timezone.localdate() - timedelta(days=7))
+    recent_minutes = recent['focus_minutes'] + recent['break_minutes']
     
     # Get user's rooms
     from rooms.models import Room
@@ -0,0 +1,121 @@
+"""
+Debounced room activity tracking.
+Room.update_activity() costs a member COUNT and an UPDATE per call, and the
+join path used to call it several times per page view. Instead, callers mark
+a room as active here, and every few seconds all marked rooms get their
+last_activity / expires_at written in one UPDATE (and passed on to the
+expiry scheduler).
+"""
+import atexit
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from .expiry import expiry_scheduler
+
+logger = logging.getLogger(__name__)
+
+# How long an empty room lives before it expires
+EMPTY_ROOM_LIFETIME = timedelta(minutes=15)
+
+
+class ActivityTracker:
+    """
+    Rooms marked active since the last flush, written in one bulk UPDATE.
+
+    A room is treated as occupied (no expiry) if it has active memberships,
+    or if it was marked with occupied=True (someone is opening it right now
+    and will show up in presence in a moment). Otherwise it expires
+    EMPTY_ROOM_LIFETIME after the flush. The GLOBAL room never expires.
+
+    Thread-safe: views, signals and the presence sweep all mark rooms.
+    """
+
+    def __init__(self, interval=None):
+        self._interval = interval
+        self.lock = threading.Lock()
+        self.dirty = {}  # room id -> occupied hint
+        self.timer = None
+        self.flush_count = 0
+
+    @property
+    def interval(self):
+        if self._interval is not None:
+            return self._interval
+        return getattr(settings, 'ROOM_ACTIVITY_FLUSH_SECONDS', 5)
+
+    def touch(self, room_id, occupied=False):
+        """
+        Mark a room as active. The write happens at the next flush.
+        """
+        with self.lock:
+            self.dirty[room_id] = self.dirty.get(room_id, False) or occupied
+            if self.timer is None:
+                self.timer = threading.Timer(self.interval, self._flush_from_timer)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _flush_from_timer(self):
+        # Each timer is a new thread with its own database connection, which
+        # nothing else would close
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+    def flush(self):
+        """
+        Write last_activity / expires_at for all marked rooms.
+        One SELECT for which rooms have members, one UPDATE for all rooms.
+        """
+        from .models import Room, RoomMembership
+
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not dirty:
+            return 0
+
+        try:
+            occupied = {room_id for room_id, hint in dirty.items() if hint}
+            occupied.update(
+                RoomMembership.objects.filter(
+                    room_id__in=[room_id for room_id in dirty if room_id not in occupied],
+                    is_active=True,
+                ).values_list('room_id', flat=True).distinct()
+            )
+
+            now = timezone.now()
+            never_expire = [When(room_code='GLOBAL', then=Value(None))]
+            if occupied:
+                never_expire.append(When(id__in=list(occupied), then=Value(None)))
+            Room.objects.filter(id__in=list(dirty)).update(
+                last_activity=now,
+                expires_at=Case(*never_expire, default=Value(now + EMPTY_ROOM_LIFETIME)),
+            )
+            self.flush_count += 1
+
+            # Keep the expiry scheduler in step if it runs in this process
+            # (it skips GLOBAL itself)
+            expiry_scheduler.cancel(occupied)
+            expiry_scheduler.schedule(
+                [room_id for room_id in dirty if room_id not in occupied],
+                now + EMPTY_ROOM_LIFETIME,
+            )
+        except Exception as e:
+            logger.error(f"Failed to write room activity: {str(e)}")
+        return len(dirty)
+
+
+# Shared tracker for this process
+activity_tracker = ActivityTracker()
+
+# Don't lose the last few seconds of activity on shutdown
+atexit.register(activity_tracker.flush)
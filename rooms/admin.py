@@ -1,9 +1,9 @@
 """
 Admin configuration for rooms app.
-Register Room and RoomMembership models in Django admin panel.
+Register Room, RoomMembership and ChatMessage models in Django admin panel.
 """
 from django.contrib import admin
-from .models import Room, RoomMembership
+from .models import Room, RoomMembership, ChatMessage
 
 
 @admin.register(Room)
@@ -15,7 +15,17 @@ class RoomAdmin(admin.ModelAdmin):
     search_fields = ['name', 'room_code', 'created_by__username', 'description']
     readonly_fields = ['room_code', 'created_at']
     
-    fields = ('name', 'description', 'created_by', 'room_code', 'created_at')
+    fields = ('name', 'description', 'created_by', 'max_members', 'room_code', 'created_at')
+    
+    def delete_model(self, request, obj):
+        """
+        Tombstone instead of deleting; rooms.purge removes the data in batches.
+        """
+        obj.tombstone()
+    
+    def delete_queryset(self, request, queryset):
+        for room in queryset:
+            room.tombstone()
 
 
 @admin.register(RoomMembership)
@@ -27,3 +37,14 @@ class RoomMembershipAdmin(admin.ModelAdmin):
     list_filter = ['is_active', 'joined_at']
     search_fields = ['user__username', 'room__name']
 
+
+
+@admin.register(ChatMessage)
+class ChatMessageAdmin(admin.ModelAdmin):
+    """
+    Admin interface for ChatMessage model.
+    """
+    list_display = ['user', 'room', 'shard', 'message', 'created_at']
+    list_filter = ['created_at']
+    search_fields = ['user__username', 'room__name', 'message']
+    raw_id_fields = ['user', 'room']
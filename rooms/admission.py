@@ -0,0 +1,150 @@
+"""
+Room admission control.
+Rooms with max_members set hold at most that many users (a user with
+several tabs counts once). Connections beyond that wait in a FIFO queue
+and are let in over their WebSocket as soon as a seat frees up.
+
+Seats are the users in rooms.presence, so a seat is taken by
+presence.connect(). Checking for a free seat and taking it happen with no
+await in between, so concurrent joins on the event loop can't both get the
+last seat. Like presence, the queue lives in the process that serves the
+room's WebSockets.
+"""
+import logging
+from collections import OrderedDict
+
+from channels.layers import get_channel_layer
+
+from .presence import presence
+from .room_events import broadcast_to_room
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionControl:
+    """
+    Waiting queues of the capped rooms in this process:
+    room_code -> OrderedDict(channel_name -> entry), oldest first, where
+    entry holds what presence.connect() needs once a seat frees up.
+    """
+
+    def __init__(self):
+        self.queues = {}
+        self.capacity = {}  # room_code -> max_members last seen for the room
+
+    def queue_length(self, room_code):
+        return len(self.queues.get(room_code, ()))
+
+    def position(self, room_code, user_id):
+        """
+        Returns the 1-based queue position of `user_id`'s earliest waiting
+        connection, or None if none of their connections is waiting.
+        """
+        for position, entry in enumerate(self.queues.get(room_code, {}).values(), start=1):
+            if entry['user_id'] == user_id:
+                return position
+        return None
+
+    def is_full(self, room_code, user_id, capacity):
+        """
+        Would `user_id` have to wait to get into a room of `capacity`
+        (max_members) right now?
+        """
+        if capacity is None or presence.is_present(room_code, user_id):
+            return False
+        return self.queue_length(room_code) > 0 or presence.count(room_code) >= capacity
+
+    async def join(self, room_code, room_id, capacity, channel_name, user_id, username, avatar=None):
+        """
+        Take a seat for a new connection, or queue it.
+        Returns the 1-based queue position, or None if it was admitted.
+        """
+        if capacity is None:
+            self.capacity.pop(room_code, None)
+        else:
+            self.capacity[room_code] = capacity
+
+        # The capacity may have gone up since others started waiting
+        admitted = self.admit_waiting(room_code)
+
+        waiting = self.is_full(room_code, user_id, capacity)
+        if waiting:
+            queue = self.queues.setdefault(room_code, OrderedDict())
+            queue[channel_name] = {
+                'room_id': room_id,
+                'user_id': user_id,
+                'username': username,
+                'avatar': avatar,
+            }
+            position = len(queue)
+        else:
+            join_frame = presence.connect(room_code, room_id, channel_name, user_id, username, avatar)
+            if join_frame:
+                await broadcast_to_room(room_code, join_frame, coalesce_key=f'presence:{username}')
+
+        await self.notify_admitted(room_code, admitted)
+        return position if waiting else None
+
+    def admit_waiting(self, room_code):
+        """
+        Give free seats to the connections at the head of the queue.
+        Returns [(channel_name, username, join_frame)] for the admitted ones.
+        """
+        queue = self.queues.get(room_code)
+        capacity = self.capacity.get(room_code)
+        admitted = []
+        while queue:
+            channel_name, entry = next(iter(queue.items()))
+            if (capacity is not None and presence.count(room_code) >= capacity
+                    and not presence.is_present(room_code, entry['user_id'])):
+                break
+            del queue[channel_name]
+            join_frame = presence.connect(
+                room_code, entry['room_id'], channel_name,
+                entry['user_id'], entry['username'], entry['avatar'],
+            )
+            admitted.append((channel_name, entry['username'], join_frame))
+        if not queue:
+            self.queues.pop(room_code, None)
+        return admitted
+
+    async def release(self, room_code):
+        """
+        Call when a seat may have freed up (a user left the room).
+        """
+        await self.notify_admitted(room_code, self.admit_waiting(room_code))
+
+    async def leave(self, room_code, channel_name):
+        """
+        Drop a connection from the queue (it closed while waiting).
+        """
+        queue = self.queues.get(room_code)
+        if queue is None or queue.pop(channel_name, None) is None:
+            return
+        if not queue:
+            self.queues.pop(room_code, None)
+        await self.send_positions(room_code)
+
+    async def notify_admitted(self, room_code, admitted):
+        """
+        Announce newly admitted users to the room and tell their consumers
+        to enter; everyone still waiting moves up.
+        """
+        if not admitted:
+            return
+        channel_layer = get_channel_layer()
+        for channel_name, username, join_frame in admitted:
+            logger.info(f"Admitted {username} to room {room_code} from the waiting queue")
+            if join_frame:
+                await broadcast_to_room(room_code, join_frame, coalesce_key=f'presence:{username}')
+            await channel_layer.send(channel_name, {'type': 'admission_granted'})
+        await self.send_positions(room_code)
+
+    async def send_positions(self, room_code):
+        channel_layer = get_channel_layer()
+        for position, channel_name in enumerate(list(self.queues.get(room_code, ())), start=1):
+            await channel_layer.send(channel_name, {'type': 'admission_position', 'position': position})
+
+
+# Shared admission control for all consumers and views in this process
+admission = AdmissionControl()
@@ -7,10 +7,12 @@ class RoomsConfig(AppConfig):
     
     def ready(self):
         """
-        Import signals when app is ready and start background cleanup scheduler
+        Import signals when app is ready.
+        Background cleanup runs in its own process: python manage.py run_worker
         """
         import rooms.signals
         
-        # Start the room cleanup scheduler
-        from rooms.scheduler import start_scheduler
-        start_scheduler()
+        # Migrations that rebuild the room table on SQLite drop the search triggers
+        from django.db.models.signals import post_migrate
+        from rooms.search import ensure_sqlite_triggers
+        post_migrate.connect(ensure_sqlite_triggers, sender=self)
@@ -0,0 +1,145 @@
+"""
+Write-behind buffer for chat messages.
+Collects ChatMessage rows in memory and inserts them with bulk_create,
+so a busy room costs one database round trip per batch instead of per message.
+"""
+import asyncio
+import atexit
+import logging
+from itertools import groupby
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+
+class ChatWriteBuffer:
+    """
+    In-process buffer that flushes pending chat messages to the database.
+
+    A flush happens when either:
+    1. max_messages messages are waiting, or
+    2. interval_ms milliseconds have passed since the first pending message.
+
+    The buffer lives on the event loop of the ASGI server, so all methods
+    must be called from async code (e.g. a WebSocket consumer).
+    """
+
+    def __init__(self, max_messages=None, interval_ms=None):
+        # Limits default to settings, read lazily so this module can be
+        # imported before Django is configured (see virtualcafe/asgi.py)
+        self._max_messages = max_messages
+        self._interval_ms = interval_ms
+        self.pending = []
+        self.flush_count = 0  # Number of bulk inserts done (useful for benchmarks)
+        self._timer = None
+        self._flush_tasks = set()
+
+    @property
+    def max_messages(self):
+        return self._max_messages or getattr(settings, 'CHAT_WRITE_BUFFER_SIZE', 100)
+
+    @property
+    def interval_ms(self):
+        return self._interval_ms or getattr(settings, 'CHAT_WRITE_BUFFER_INTERVAL_MS', 250)
+
+    async def add(self, chat_message):
+        """
+        Queue an unsaved ChatMessage for writing.
+        Starts the flush timer on the first pending message and flushes
+        straight away once the buffer is full.
+        """
+        self.pending.append(chat_message)
+
+        if len(self.pending) >= self.max_messages:
+            self._start_flush()
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.interval_ms / 1000, self._start_flush)
+
+    async def flush(self):
+        """
+        Write all pending messages now and wait for in-flight flushes.
+        Call this before reading history so recent messages are visible.
+        """
+        self._start_flush()
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+    def _start_flush(self):
+        """
+        Take the pending batch and write it in the background.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if not self.pending:
+            return
+
+        batch = self.pending
+        self.pending = []
+
+        task = asyncio.ensure_future(self._write(batch))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _write(self, batch):
+        """
+        Insert one batch of messages. Errors are logged and the batch is dropped
+        so a database hiccup cannot grow the buffer without limit.
+        """
+        try:
+            await database_sync_to_async(self._save)(batch)
+            self.flush_count += 1
+        except Exception as e:
+            logger.error(f"Failed to save {len(batch)} chat message(s): {str(e)}")
+
+    def flush_sync(self):
+        """
+        Write pending messages from outside the event loop (at exit, when
+        the loop has already stopped).
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            self._save(batch)
+            self.flush_count += 1
+        except Exception as e:
+            logger.error(f"Failed to save {len(batch)} chat message(s) at exit: {str(e)}")
+
+    @classmethod
+    def _save(cls, batch):
+        """
+        Insert a batch in one bulk_create. If a row breaks a constraint
+        (usually its room was deleted while the message was buffered), insert
+        each room's messages on its own so only that room's are lost.
+        """
+        try:
+            cls._bulk_insert(batch)
+        except IntegrityError:
+            by_room = sorted(batch, key=lambda message: message.room_id)
+            for room_id, messages in groupby(by_room, key=lambda message: message.room_id):
+                messages = list(messages)
+                try:
+                    cls._bulk_insert(messages)
+                except IntegrityError as e:
+                    logger.warning(f"Dropped {len(messages)} chat message(s) for room {room_id}: {str(e)}")
+
+    @staticmethod
+    def _bulk_insert(batch):
+        from rooms.models import ChatMessage
+        ChatMessage.objects.bulk_create(batch)
+
+
+# Shared buffer used by all consumers in this process
+chat_buffer = ChatWriteBuffer()
+
+# Messages still waiting for their batch when the server stops
+atexit.register(chat_buffer.flush_sync)
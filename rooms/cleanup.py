@@ -1,98 +1,150 @@
 """
 Auto-cleanup service for inactive rooms.
-Removes rooms that are empty and older than 30 minutes.
+Removes rooms that are empty and older than 30 minutes, and rooms past
+their expires_at. Used by the cleanup_rooms and cleanup_expired_rooms
+commands and the background scheduler job.
+
+Candidates are found with one query each, then tombstoned in bounded
+chunks, one UPDATE per chunk. Their memberships and chat history are left
+for the background purger (rooms.purge), which removes them in small
+batches, so SQLite is never locked for long.
 """
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
 from django.utils import timezone
 from datetime import timedelta
-from rooms.models import Room
+from rooms.activity import EMPTY_ROOM_LIFETIME
+from rooms.models import Room, RoomMembership
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+# Rooms empty for this long (since creation and last activity) are removed
+INACTIVE_AFTER = timedelta(minutes=30)
+
+
+def has_active_members():
+    """
+    Subquery annotation: does the room have any active membership?
+    """
+    return Exists(RoomMembership.objects.filter(room=OuterRef('pk'), is_active=True))
+
+
+def inactive_rooms(now=None):
+    """
+    Rooms that are empty and created and last active over 30 minutes ago.
+    The global room is never included.
+    """
+    cutoff = (now or timezone.now()) - INACTIVE_AFTER
+    return Room.objects.filter(
+        Q(last_activity__lt=cutoff) | Q(last_activity__isnull=True),
+        created_at__lt=cutoff,
+    ).exclude(room_code='GLOBAL').alias(occupied=has_active_members()).filter(occupied=False)
+
+
+def expired_rooms(now=None):
+    """
+    Rooms whose expires_at has passed. The global room is never included.
+    """
+    return Room.objects.filter(
+        expires_at__lte=now or timezone.now(),
+    ).exclude(room_code='GLOBAL')
+
+
+def tombstone_rooms(candidates, chunk_size=None):
+    """
+    Tombstone the rooms matched by a queryset, chunk by chunk.
+
+    Candidate ids are read with one query. Each chunk is then tombstoned
+    with one UPDATE; the queryset's filter is applied again, so a room that
+    became active in the meantime survives. Related rows are not touched:
+    rooms.purge removes them later, a batch at a time.
+
+    Returns stats: rooms tombstoned, seconds, rooms per second.
+    """
+    from rooms.expiry import expiry_scheduler
+
+    chunk_size = chunk_size or getattr(settings, 'ROOM_CLEANUP_CHUNK_SIZE', 500)
+    start = time.perf_counter()
+
+    room_ids = list(candidates.values_list('id', flat=True))
+    rooms_deleted = 0
+    for offset in range(0, len(room_ids), chunk_size):
+        chunk = room_ids[offset:offset + chunk_size]
+        rooms_deleted += candidates.filter(id__in=chunk).update(
+            deleted_at=timezone.now(), expires_at=None,
+        )
+        # Rooms that survived the re-check get their expiry back at the
+        # scheduler's next reload
+        expiry_scheduler.cancel(chunk)
+
+    seconds = time.perf_counter() - start
+    return {
+        'rooms': rooms_deleted,
+        'seconds': seconds,
+        'rooms_per_second': rooms_deleted / seconds if seconds else 0,
+    }
 
-def cleanup_inactive_rooms():
+
+def set_expiry_for_empty_rooms(now=None):
+    """
+    Give empty rooms without an expiry one, 15 minutes from now.
+    One UPDATE; the global room never expires.
+    """
+    now = now or timezone.now()
+    return Room.objects.filter(expires_at__isnull=True).exclude(room_code='GLOBAL').alias(
+        occupied=has_active_members()
+    ).filter(occupied=False).update(last_activity=now, expires_at=now + EMPTY_ROOM_LIFETIME)
+
+
+def cleanup_inactive_rooms(chunk_size=None):
     """
     Remove rooms that are:
     1. Empty (no active members)
     2. Older than 30 minutes from creation or last activity
-    
+
     This function is designed to be run periodically (every 5 minutes recommended)
+    Returns stats as tombstone_rooms() does.
     """
-    try:
-        # Calculate the cutoff time (30 minutes ago)
-        cutoff_time = timezone.now() - timedelta(minutes=30)
-        
-        # Find rooms that are old and empty
-        old_rooms = Room.objects.filter(
-            created_at__lt=cutoff_time  # Created more than 30 minutes ago
-        )
-        
-        rooms_to_delete = []
-        
-        for room in old_rooms:
-            # Check if room is empty (no active members)
-            if room.is_empty():
-                # Also check last_activity if it exists
-                if room.last_activity and room.last_activity < cutoff_time:
-                    rooms_to_delete.append(room)
-                elif not room.last_activity:
-                    # If no last_activity, use created_at
-                    rooms_to_delete.append(room)
-        
-        # Delete the identified rooms
-        if rooms_to_delete:
-            deleted_count = len(rooms_to_delete)
-            room_codes = [room.room_code for room in rooms_to_delete]
-            
-            for room in rooms_to_delete:
-                room.delete()
-            
-            logger.info(f"Auto-cleanup: Deleted {deleted_count} inactive rooms: {', '.join(room_codes)}")
-            return deleted_count
-        else:
-            logger.debug("Auto-cleanup: No inactive rooms to delete")
-            return 0
-            
-    except Exception as e:
-        logger.error(f"Error during room cleanup: {str(e)}")
-        return 0
+    stats = tombstone_rooms(inactive_rooms(), chunk_size)
+    if stats['rooms']:
+        logger.info(f"Auto-cleanup: Deleted {stats['rooms']} inactive rooms "
+                    f"({stats['rooms_per_second']:.0f} rooms/s)")
+    else:
+        logger.debug("Auto-cleanup: No inactive rooms to delete")
+    return stats
 
 
-def cleanup_expired_rooms():
+def cleanup_expired_rooms(chunk_size=None):
     """
     Additional cleanup for rooms with explicit expiration times.
     This removes rooms that have an expires_at time in the past.
+    Returns stats as tombstone_rooms() does.
     """
-    try:
-        expired_rooms = Room.objects.filter(
-            expires_at__lte=timezone.now(),
-            expires_at__isnull=False
-        )
-        
-        deleted_count = expired_rooms.count()
-        if deleted_count > 0:
-            room_codes = list(expired_rooms.values_list('room_code', flat=True))
-            expired_rooms.delete()
-            logger.info(f"Expired rooms cleanup: Deleted {deleted_count} rooms: {', '.join(room_codes)}")
-            return deleted_count
-        return 0
-        
-    except Exception as e:
-        logger.error(f"Error during expired rooms cleanup: {str(e)}")
-        return 0
+    stats = tombstone_rooms(expired_rooms(), chunk_size)
+    if stats['rooms']:
+        logger.info(f"Expired rooms cleanup: Deleted {stats['rooms']} rooms "
+                    f"({stats['rooms_per_second']:.0f} rooms/s)")
+    return stats
 
 
 def run_all_cleanup():
     """
     Run all cleanup tasks.
     This is the main function to be scheduled.
+    Returns the number of rooms deleted.
     """
-    inactive_deleted = cleanup_inactive_rooms()
-    expired_deleted = cleanup_expired_rooms()
-    
-    total_deleted = inactive_deleted + expired_deleted
-    
+    try:
+        inactive = cleanup_inactive_rooms()
+        expired = cleanup_expired_rooms()
+    except Exception as e:
+        logger.error(f"Error during room cleanup: {str(e)}")
+        return 0
+
+    total_deleted = inactive['rooms'] + expired['rooms']
+
     if total_deleted > 0:
         logger.info(f"Total rooms cleaned up: {total_deleted}")
-    
+
     return total_deleted
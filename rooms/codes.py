@@ -0,0 +1,136 @@
+"""
+Room code allocation.
+Codes are 7 characters from an alphabet without look-alikes (no 0/O, 1/I/L),
+so they are easy to read out and type. Each code is a keyed permutation of
+a counter: counter values are unique, and a bijection maps them to codes
+that look random, so every code is unique without checking the table.
+
+Legacy codes are 6 hex characters and "GLOBAL" contains an L, so neither
+can clash with an allocated code.
+"""
+import hashlib
+import hmac
+import secrets
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+ALPHABET = '23456789ABCDEFGHJKMNPQRSTUVWXYZ'
+CODE_LENGTH = 7
+
+# The permutation works on a number split into two parts, 3 and 4 digits
+# (base 31), which are mixed into each other in turns
+LOW_SIZE = len(ALPHABET) ** 3
+HIGH_SIZE = len(ALPHABET) ** 4
+CODE_SPACE = LOW_SIZE * HIGH_SIZE  # 31^7, about 27.5 billion codes
+ROUNDS = 8
+
+
+class CodePermutation:
+    """
+    A keyed bijection on range(CODE_SPACE).
+
+    Each round adds a keyed hash of one part to the other part (modulo its
+    size). Every round can be undone by subtracting the same hash, so the
+    whole thing is a permutation: distinct inputs give distinct outputs.
+    """
+
+    def __init__(self, key):
+        self.key = key.encode() if isinstance(key, str) else key
+
+    def _round(self, i, value, modulus):
+        digest = hmac.new(self.key, f'{i}:{value}'.encode(), hashlib.sha256).digest()
+        return int.from_bytes(digest[:8], 'big') % modulus
+
+    def permute(self, n):
+        low, high = divmod(n, HIGH_SIZE)
+        for i in range(ROUNDS):
+            if i % 2 == 0:
+                high = (high + self._round(i, low, HIGH_SIZE)) % HIGH_SIZE
+            else:
+                low = (low + self._round(i, high, LOW_SIZE)) % LOW_SIZE
+        return low * HIGH_SIZE + high
+
+    def invert(self, n):
+        low, high = divmod(n, HIGH_SIZE)
+        for i in reversed(range(ROUNDS)):
+            if i % 2 == 0:
+                high = (high - self._round(i, low, HIGH_SIZE)) % HIGH_SIZE
+            else:
+                low = (low - self._round(i, high, LOW_SIZE)) % LOW_SIZE
+        return low * HIGH_SIZE + high
+
+
+def encode(n):
+    """
+    Write a number below CODE_SPACE as a CODE_LENGTH-character code.
+    """
+    chars = []
+    for _ in range(CODE_LENGTH):
+        n, digit = divmod(n, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+class RoomCodeAllocator:
+    """
+    Hands out room codes from the shared RoomCodeSequence.
+
+    Counter values are reserved from the database in blocks (one UPDATE per
+    ROOM_CODE_BLOCK_SIZE codes) and used up in memory, so allocating a code
+    is normally just a permutation. Values left in a block when the process
+    exits are never used; the code space is large enough not to matter.
+
+    Inside a transaction (e.g. the admin's changeform) a cached block isn't
+    safe: if the transaction rolls back, so does the counter, and another
+    process would be handed the same values. There the allocator reserves
+    just the one value it needs, which rolls back with the room using it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_value = 0
+        self.block_end = 0
+        self.permutation = None
+
+    @property
+    def block_size(self):
+        return getattr(settings, 'ROOM_CODE_BLOCK_SIZE', 100)
+
+    def reserve_block(self, size):
+        """
+        Reserve `size` counter values; returns (first value, permutation key).
+        The UPDATE comes first so concurrent processes queue on its row lock.
+        """
+        from .models import RoomCodeSequence
+
+        RoomCodeSequence.objects.get_or_create(id=1, defaults={'key': secrets.token_hex(32)})
+        with transaction.atomic():
+            RoomCodeSequence.objects.filter(id=1).update(next_value=F('next_value') + size)
+            sequence = RoomCodeSequence.objects.get(id=1)
+        start = sequence.next_value - size
+        if sequence.next_value > CODE_SPACE:
+            raise RuntimeError('Room code space exhausted')
+        return start, sequence.key
+
+    def allocate(self):
+        """
+        Returns a new room code, unique among all codes ever allocated.
+        """
+        with self.lock:
+            if connection.in_atomic_block:
+                value, key = self.reserve_block(1)
+                return encode(CodePermutation(key).permute(value))
+            if self.next_value >= self.block_end:
+                start, key = self.reserve_block(self.block_size)
+                self.next_value, self.block_end = start, start + self.block_size
+                self.permutation = CodePermutation(key)
+            value = self.next_value
+            self.next_value += 1
+            return encode(self.permutation.permute(value))
+
+
+# Shared allocator for this process
+room_codes = RoomCodeAllocator()
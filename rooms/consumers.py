@@ -2,10 +2,61 @@
 WebSocket consumers for real-time chat functionality.
 Handles WebSocket connections for the chat rooms.
 """
+import asyncio
 import json
+import logging
+from urllib.parse import parse_qs
+from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
+from .admission import admission
+from .chat_buffer import chat_buffer
+from .peers import peer_registry
+from .presence import presence
+from .room_timer import room_timers
+from .room_events import room_events, broadcast_to_room
+from .shards import GLOBAL_ROOM_CODE, broadcast_to_all_shards, message_shard, shard_code, shard_router
+from .outbound import OutboundQueue, outbound_stats, CLOSE_CODE_RESYNC
+
+logger = logging.getLogger(__name__)
+
+# WebRTC signaling frames relayed between peers, with the field each carries
+SIGNAL_FIELDS = {
+    'webrtc_offer': 'offer',
+    'webrtc_answer': 'answer',
+    'webrtc_ice': 'candidate',
+}
+
+
+class RoomSockets:
+    """
+    Open WebSocket connections per room code in this process: signed in or
+    anonymous, seated or still waiting for a seat. A room's timer and event
+    log are kept while any of them remain.
+    """
+
+    def __init__(self):
+        self.rooms = {}
+
+    def open(self, room_code, channel_name):
+        self.rooms.setdefault(room_code, set()).add(channel_name)
+
+    def close(self, room_code, channel_name):
+        """
+        Forget a connection. Returns True if the room has none left.
+        """
+        sockets = self.rooms.get(room_code)
+        if sockets is not None:
+            sockets.discard(channel_name)
+            if sockets:
+                return False
+            del self.rooms[room_code]
+        return True
+
+
+# Open connections of all rooms in this process
+room_sockets = RoomSockets()
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
@@ -20,117 +71,540 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.room_code = self.scope['url_route']['kwargs']['room_code']
         self.room_group_name = f'chat_{self.room_code}'
         
-        # Join room group
+        # Look up the room once so messages don't need a query each
+        self.room_id, self.max_members = await self.get_room()
+        
+        # Set once the connection has a seat in the room (see enter_room())
+        self.admitted = False
+        
+        # Table of the global room this connection is at (see rooms.shards)
+        self.shard = None
+        
+        # Pending ICE candidates per target peer, sent in small batches
+        self.ice_batches = {}
+        self.ice_timers = {}
+        
+        # Frames to this client go through a bounded queue (see send())
+        self.outbound = OutboundQueue(self.write_frame)
+        
+        user = self.scope['user']
+        if not user.is_authenticated and self.room_code == GLOBAL_ROOM_CODE:
+            # Tables are sized by seats in presence, which anonymous
+            # connections don't take, so they would make fan-out unbounded
+            await self.close()
+            return
+        
+        await self.accept()
+        self.outbound.start()
+        
+        if not user.is_authenticated:
+            room_sockets.open(self.room_code, self.channel_name)
+            await self.enter_room()
+            return
+        
+        # Take a seat, or wait for one if the room is full. Only the user's
+        # first connection is announced (other tabs are silent); the join
+        # frame is a member-list delta for everyone else.
+        avatar = await self.get_avatar_url(user)
+        if self.room_code == GLOBAL_ROOM_CODE:
+            # No await between picking the table and joining it
+            self.join_shard(shard_router.place(user.id))
+        room_sockets.open(self.room_code, self.channel_name)
+        position = await admission.join(
+            self.room_code, self.room_id, self.max_members,
+            self.channel_name, user.id, user.username, avatar,
+        )
+        self.admitted = position is None
+        if self.admitted:
+            await self.enter_room()
+        else:
+            await self.send_waiting(position)
+    
+    def join_shard(self, number):
+        """
+        Use a table of the global room in place of the whole room.
+        """
+        self.shard = number
+        self.room_code = shard_code(number)
+        self.room_group_name = f'chat_{self.room_code}'
+    
+    async def enter_room(self):
+        """
+        Start receiving the room: join the group, get the room state and
+        become a WebRTC peer. Called once the connection has a seat.
+        """
+        self.admitted = True
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
         
-        await self.accept()
+        # A reconnecting client passes the last event it saw (?epoch=..&seq=..)
+        # and gets just the gap; otherwise send a full snapshot
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        resumed = await self.resume_from(
+            query.get('epoch', [None])[0],
+            query.get('seq', [None])[0],
+        )
+        if not resumed:
+            await self.send_snapshot()
+        
+        if self.shard is not None:
+            await self.send(text_data=json.dumps({
+                'type': 'shard',
+                'table': self.shard,
+                'tables': len(shard_router.shards()),
+            }))
         
-        # Send join notification to room
+        # Register as a WebRTC peer so others can address us directly
         user = self.scope['user']
         if user.is_authenticated:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_join',
-                    'username': user.username,
-                }
-            )
+            peer_registry.add(self.room_code, self.channel_name, user.username)
+    
+    async def send_waiting(self, position):
+        await self.send(text_data=json.dumps({
+            'type': 'waiting',
+            'position': position,
+            'max_members': self.max_members,
+        }))
+    
+    async def admission_granted(self, event):
+        """
+        Called by admission control when a seat freed up for this waiting
+        connection (the seat is already taken and the join announced).
+        """
+        await self.send(text_data=json.dumps({'type': 'admitted'}))
+        await self.enter_room()
+    
+    async def admission_position(self, event):
+        """
+        Called when this connection moved up in the waiting queue.
+        """
+        if not self.admitted:
+            await self.send_waiting(event['position'])
     
     async def disconnect(self, close_code):
         """
         Called when the websocket closes.
         """
+        self.outbound.stop()
+        
+        # Stop relaying signaling to or from this connection
+        peer_registry.remove(self.room_code, self.channel_name)
+        for timer in self.ice_timers.values():
+            timer.cancel()
+        self.ice_timers.clear()
+        self.ice_batches.clear()
+        
         # Leave room group
         user = self.scope['user']
         if user.is_authenticated:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_leave',
-                    'username': user.username,
-                }
-            )
+            await admission.leave(self.room_code, self.channel_name)
+            leave_frame = presence.disconnect(self.room_code, self.channel_name, user.id)
+            if leave_frame:
+                await self.group_broadcast(leave_frame, coalesce_key=f'presence:{user.username}')
+                # A seat is free for whoever is waiting
+                await admission.release(self.room_code)
         
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        
+        # Nobody left to see the room timer or replay events. Anonymous and
+        # waiting connections aren't peers, so count every open socket
+        if room_sockets.close(self.room_code, self.channel_name):
+            room_timers.discard(self.room_code)
+            room_events.discard(self.room_code)
     
     async def receive(self, text_data):
         """
         Called when a message is received from WebSocket.
         """
+        user = self.scope['user']
+        if user.is_authenticated:
+            # Any frame shows the connection is alive
+            presence.touch(self.room_code, self.channel_name, user.id)
+        
         try:
             data = json.loads(text_data)
             message_type = data.get('type', 'chat')
             
-            if message_type == 'chat':
+            if message_type == 'heartbeat':
+                return
+            
+            if message_type == 'ack':
+                # How far the client has read, for the outbound backlog
+                seq = data.get('seq')
+                if isinstance(seq, int):
+                    self.outbound.ack(seq)
+                return
+            
+            if not self.admitted:
+                return  # Still waiting for a seat
+            
+            elif message_type == 'chat':
                 message = data.get('message', '').strip()
                 if not message:
                     return
                 
-                user = self.scope['user']
                 if not user.is_authenticated:
                     return
                 
-                # Save message to database
-                await self.save_message(user, message)
+                # Queue message for the batched database write
+                chat_message = await self.save_message(user, message)
                 
                 # Send message to room group
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'chat_message',
-                        'message': message,
-                        'username': user.username,
-                        'user_id': user.id,
-                    }
-                )
+                await self.group_broadcast({
+                    'type': 'chat',
+                    'message': message,
+                    'username': user.username,
+                    'user_id': user.id,
+                    'timestamp': chat_message.created_at.isoformat(),
+                })
+            
+            elif message_type == 'announcement':
+                await self.announce(user, data.get('message', '').strip())
+            
+            elif message_type == 'history_before':
+                # Page backward through history from the client's cursor
+                cursor = data.get('cursor')
+                if cursor:
+                    await self.send_history(before=cursor, limit=data.get('limit'))
+            
+            elif message_type in SIGNAL_FIELDS:
+                await self.relay_signal(message_type, data)
+            
+            elif message_type == 'timer':
+                await self.control_timer(data)
+            
+            elif message_type == 'resume':
+                # Client noticed a gap in sequence numbers
+                if not await self.resume_from(data.get('epoch'), data.get('seq')):
+                    await self.send_snapshot()
         except json.JSONDecodeError:
             pass
     
-    async def chat_message(self, event):
+    async def announce(self, user, message):
         """
-        Called when a chat message is received from the room group.
+        Post a staff announcement to every table of the global room.
+        It is stored like a chat message at every table, so it also shows
+        in each table's history.
         """
-        await self.send(text_data=json.dumps({
-            'type': 'chat',
-            'message': event['message'],
-            'username': event['username'],
-            'user_id': event['user_id'],
-        }))
+        if not message or self.shard is None or not user.is_authenticated or not user.is_staff:
+            return
+        
+        for number in shard_router.shards():
+            chat_message = await self.save_message(user, message, table=number)
+        await broadcast_to_all_shards({
+            'type': 'announcement',
+            'message': message,
+            'username': user.username,
+            'user_id': user.id,
+            'timestamp': chat_message.created_at.isoformat(),
+        })
     
-    async def user_join(self, event):
+    async def group_broadcast(self, frame, coalesce_key=None):
         """
-        Called when a user joins the room.
+        Send a frame to everyone in the room group.
+        The frame gets the room's next sequence number and is serialized to
+        JSON once; every member just forwards the same text.
+        """
+        await broadcast_to_room(self.room_code, frame, coalesce_key=coalesce_key)
+    
+    async def broadcast(self, event):
+        """
+        Called for every frame broadcast to the room group.
+        """
+        await self.enqueue(event['text'], event.get('coalesce_key'), event.get('seq'))
+    
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        """
+        Queue a text frame for this client instead of writing it inline,
+        so a slow reader can't hold up this consumer.
+        """
+        if text_data is None or close:
+            return await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+        await self.enqueue(text_data)
+    
+    async def enqueue(self, text, coalesce_key=None, seq=None):
+        """
+        Add a frame to the outbound queue, dropping the client if it has
+        stayed over the queue limit for too long.
+        """
+        if not self.outbound.put(text, coalesce_key, seq):
+            await self.drop_slow_client()
+    
+    async def write_frame(self, text):
         """
+        Actually write a frame to the socket (called by the outbound queue).
+        """
+        await super().send(text_data=text)
+    
+    async def presence_timeout(self, event):
+        """
+        Called by the presence sweep when nothing was received from this
+        client for too long; the connection is probably dead.
+        """
+        await self.close()
+    
+    async def drop_slow_client(self):
+        """
+        Disconnect a client that can't keep up. The resync close code tells
+        it to reconnect and fetch a full snapshot.
+        """
+        outbound_stats['dropped'] += 1
+        logger.warning(f"Dropping slow WebSocket client in room {self.room_code} "
+                       f"({self.outbound.backlog} frames behind)")
+        self.outbound.stop()
+        await self.close(code=CLOSE_CODE_RESYNC)
+    
+    async def resume_from(self, epoch, seq):
+        """
+        Send the room events after `seq` as one 'replay' frame.
+        Returns False if the client needs a full snapshot instead
+        (no position given, different epoch, or gap older than the buffer).
+        """
+        if not epoch or seq is None:
+            return False
+        try:
+            seq = int(seq)
+        except (TypeError, ValueError):
+            return False
+        
+        replay = room_events.get_replay(self.room_code, epoch, seq)
+        if replay is None:
+            return False
+        
+        await self.send(text_data=replay)
+        return True
+    
+    async def send_snapshot(self):
+        """
+        Send the full room state: recent chat history, the member list and
+        the timer. After this the client only gets member deltas.
+        """
+        # Take the position first: events after it are also delivered live,
+        # so a client may see one twice but never misses one
+        epoch, seq = room_events.get_position(self.room_code)
+        
+        # Backfill recent messages so a (re)connecting client isn't empty
+        await self.send_history(position={'epoch': epoch, 'seq': seq})
+        
+        # Who is here, with the version later join/leave deltas build on
+        await self.send(text_data=json.dumps(presence.snapshot(self.room_code)))
+        
+        # Current state of the shared room timer
         await self.send(text_data=json.dumps({
-            'type': 'user_join',
-            'username': event['username'],
+            'type': 'timer',
+            'action': 'state',
+            **room_timers.get_snapshot(self.room_code),
         }))
     
-    async def user_leave(self, event):
+    async def control_timer(self, data):
         """
-        Called when a user leaves the room.
+        Start, pause, resume or reset the room's shared Pomodoro timer.
+        The new state is broadcast once; clients count down locally.
+        """
+        user = self.scope['user']
+        if not user.is_authenticated:
+            return
+        
+        try:
+            focus_minutes = self.parse_minutes(data.get('minutes'))
+            break_minutes = self.parse_minutes(data.get('break_minutes'))
+        except (TypeError, ValueError):
+            return
+        
+        state = room_timers.apply(
+            self.room_code,
+            data.get('action'),
+            focus_minutes=focus_minutes,
+            break_minutes=break_minutes,
+        )
+        if state is None:
+            return
+        
+        await self.group_broadcast({
+            'type': 'timer',
+            'action': data.get('action'),
+            'username': user.username,
+            **state,
+        })
+    
+    @staticmethod
+    def parse_minutes(value):
+        """
+        Validate a timer length from the client (1-120 minutes, or None).
+        """
+        if value in (None, ''):
+            return None
+        minutes = int(value)
+        if not 1 <= minutes <= 120:
+            raise ValueError('Timer minutes must be between 1 and 120')
+        return minutes
+    
+    async def webrtc_signal(self, event):
+        """
+        Called when another peer addresses a WebRTC signaling frame to us.
+        """
+        await self.send(text_data=json.dumps(event['payload']))
+    
+    async def relay_signal(self, message_type, data):
+        """
+        Relay a WebRTC offer, answer or ICE candidate to the peer it is for.
+        
+        Frames carry a 'target' peer id (the sender id from an earlier frame)
+        and are sent only to that peer's channel. An offer without a target
+        starts a call and goes to every other peer in the room.
+        ICE candidates are coalesced per target into short batches.
         """
+        user = self.scope['user']
+        if not user.is_authenticated or not peer_registry.is_peer(self.room_code, self.channel_name):
+            return
+        
+        field = SIGNAL_FIELDS[message_type]
+        value = data.get(field)
+        if value is None:
+            return
+        
+        target = data.get('target')
+        if target is None:
+            if message_type != 'webrtc_offer':
+                return  # Answers and candidates always go to one peer
+            targets = peer_registry.get_peers(self.room_code, exclude=self.channel_name)
+        elif target != self.channel_name and peer_registry.is_peer(self.room_code, target):
+            targets = [target]
+        else:
+            return  # Unknown peer, or not in this room
+        
+        if message_type == 'webrtc_ice':
+            self.queue_ice_candidate(target, value)
+            return
+        
+        payload = {
+            'type': message_type,
+            field: value,
+            'sender': self.channel_name,
+            'username': user.username,
+        }
+        for target in targets:
+            await self.channel_layer.send(target, {
+                'type': 'webrtc_signal',
+                'payload': payload,
+            })
+    
+    def queue_ice_candidate(self, target, candidate):
+        """
+        Add an ICE candidate to the pending batch for a peer.
+        The first candidate starts a short timer; the batch is sent when it fires.
+        """
+        batch = self.ice_batches.setdefault(target, [])
+        batch.append(candidate)
+        
+        if target not in self.ice_timers:
+            delay = getattr(settings, 'WEBRTC_ICE_BATCH_MS', 50) / 1000
+            loop = asyncio.get_running_loop()
+            self.ice_timers[target] = loop.call_later(
+                delay, lambda: asyncio.ensure_future(self.flush_ice_candidates(target))
+            )
+    
+    async def flush_ice_candidates(self, target):
+        """
+        Send all pending ICE candidates for a peer as one frame.
+        """
+        self.ice_timers.pop(target, None)
+        candidates = self.ice_batches.pop(target, None)
+        if not candidates or not peer_registry.is_peer(self.room_code, target):
+            return
+        
+        await self.channel_layer.send(target, {
+            'type': 'webrtc_signal',
+            'payload': {
+                'type': 'webrtc_ice',
+                'candidates': candidates,
+                'sender': self.channel_name,
+                'username': self.scope['user'].username,
+            },
+        })
+    
+    async def save_message(self, user, message, table=None):
+        """
+        Queue chat message for saving to database, at this connection's
+        table of the global room unless another `table` is given.
+        Messages are written in batches by the shared chat buffer.
+        Returns the (not yet saved) ChatMessage.
+        """
+        from .models import ChatMessage
+        chat_message = ChatMessage(
+            room_id=self.room_id,
+            user_id=user.id,
+            message=message,
+            shard=message_shard(self.shard if table is None else table),
+        )
+        
+        if self.room_id is not None:
+            await chat_buffer.add(chat_message)
+        return chat_message
+    
+    async def send_history(self, before=None, limit=None, position=None):
+        """
+        Send one page of chat history to this client as a single frame.
+        On connect this is the latest page ('history'); with a cursor it is
+        the page just older than the cursor ('history_before').
+        `position` is the event log epoch and seq the snapshot corresponds to.
+        """
+        max_limit = getattr(settings, 'CHAT_HISTORY_MAX_PAGE_SIZE', 100)
+        try:
+            limit = int(limit or getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50))
+            limit = max(1, min(limit, max_limit))
+        except (TypeError, ValueError):
+            return
+        
+        messages, cursor = [], None
+        if self.room_id is not None:
+            # Make sure messages still waiting in the write buffer are included
+            await chat_buffer.flush()
+            
+            try:
+                messages, cursor = await self.get_history(limit, before)
+            except ValueError:
+                return  # Malformed cursor
+        
         await self.send(text_data=json.dumps({
-            'type': 'user_leave',
-            'username': event['username'],
+            'type': 'history_before' if before else 'history',
+            'messages': messages,
+            'cursor': cursor,
+            'has_more': cursor is not None,
+            **(position or {}),
         }))
     
     @database_sync_to_async
-    def save_message(self, user, message):
+    def get_history(self, limit, before):
+        """
+        Load a page of chat history from the database.
+        """
+        from .models import ChatMessage
+        messages, cursor = ChatMessage.get_history(
+            self.room_id, limit, before=before, shard=message_shard(self.shard)
+        )
+        return [message.to_dict() for message in messages], cursor
+    
+    @database_sync_to_async
+    def get_avatar_url(self, user):
         """
-        Save chat message to database.
+        Get the user's avatar URL, sent with their member-list entry.
+        """
+        from accounts.models import UserProfile
+        profile = UserProfile.objects.filter(user=user).select_related('user').first()
+        return profile.get_avatar_url() if profile else None
+    
+    @database_sync_to_async
+    def get_room(self):
+        """
+        Get the database id and member limit of this consumer's room,
+        or (None, None) if it doesn't exist.
         """
         from .models import Room
-        try:
-            room = Room.objects.get(room_code=self.room_code)
-            # You can create a ChatMessage model if you want to persist messages
-            # For now, messages are only stored in real-time
-            return True
-        except Room.DoesNotExist:
-            return False
+        room = Room.objects.filter(room_code=self.room_code).values_list('id', 'max_members').first()
+        return room or (None, None)
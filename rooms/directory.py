@@ -0,0 +1,92 @@
+"""
+Public room directory.
+Lists public rooms most active first or largest first, a page at a time.
+Pages are found by keyset (the sort value and id of the last room on the
+previous page) rather than by offset, so every page is one range scan of a
+directory index (see Room.Meta.indexes) however deep it is. Member counts
+come from Room.active_member_count, which is updated with F() whenever
+memberships become active or inactive, not counted per request.
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Room, RoomMembership
+
+# sort name -> room field pages are ordered by (descending, then by id)
+SORT_FIELDS = {
+    'activity': 'last_activity',
+    'members': 'active_member_count',
+}
+
+ROOM_FIELDS = ['id', 'room_code', 'name', 'description', 'active_member_count', 'last_activity',
+               'created_by__username']
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(sort, room):
+    value = room[SORT_FIELDS[sort]]
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([value, room['id']]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(sort, cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, room_id = json.loads(base64.urlsafe_b64decode(padded))
+        if sort == 'activity':
+            value = datetime.fromisoformat(value)
+        return value, int(room_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {str(e)}")
+
+
+def directory_page(sort='activity', cursor=None, limit=20):
+    """
+    Returns (rooms, next_cursor): up to `limit` public rooms as dicts, and
+    the cursor of the following page (None on the last page).
+    Raises InvalidCursor for a malformed cursor.
+    """
+    field = SORT_FIELDS[sort]
+    rooms = Room.objects.filter(is_public=True)
+    if cursor:
+        value, room_id = decode_cursor(sort, cursor)
+        # (field, id) < (value, room_id), written so the first condition is
+        # a plain range on the index
+        rooms = rooms.filter(**{f'{field}__lte': value}).filter(
+            Q(**{f'{field}__lt': value}) | Q(id__lt=room_id)
+        )
+
+    page = list(rooms.order_by(f'-{field}', '-id').values(*ROOM_FIELDS)[:limit + 1])
+    next_cursor = encode_cursor(sort, page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
+
+
+def adjust_member_count(room_id, change):
+    """
+    Add `change` (may be negative) to a room's active_member_count atomically,
+    never going below zero.
+    """
+    if room_id is not None and change:
+        Room.objects.filter(id=room_id).update(
+            active_member_count=Greatest(F('active_member_count') + change, 0)
+        )
+
+
+def recount_members():
+    """
+    Set every room's active_member_count from its memberships, in one UPDATE.
+    Repairs any drift (e.g. is_active edited in the admin).
+    """
+    active = RoomMembership.objects.filter(room=OuterRef('pk'), is_active=True).order_by().values('room')
+    return Room.objects.update(active_member_count=Coalesce(
+        Subquery(active.annotate(count=Count('id')).values('count'), output_field=IntegerField()), 0
+    ))
@@ -0,0 +1,200 @@
+"""
+Room expiry scheduler.
+Keeps a min-heap of room expiry times, loaded from Room.expires_at. A
+background thread in the job runner (manage.py run_worker) sleeps until the
+earliest deadline and tombstones the rooms due then, in batches, instead of
+polling for expired rooms every few minutes. Expiries set by web processes
+are picked up by reloading from the database every ROOM_EXPIRY_RELOAD_SECONDS,
+well within the 15 minutes an empty room lives; expiries changed in the
+runner's own process are scheduled directly.
+"""
+import heapq
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryScheduler:
+    """
+    Deletes (tombstones) rooms at their expires_at; rooms.purge removes
+    their data afterwards.
+
+    The heap holds (deadline, room_id) pairs. Rescheduling or cancelling a
+    room doesn't search the heap: `deadlines` holds each room's current
+    deadline and outdated heap entries are skipped when they come up.
+    Before deleting, expires_at is checked again in the database, so a room
+    whose expiry was moved by another process is left alone.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.deadlines = {}  # room_id -> current deadline (epoch seconds)
+        self.cond = threading.Condition()
+        self.thread = None
+        self.stopped = False
+        self.expired_count = 0
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'ROOM_EXPIRY_BATCH_SIZE', 500)
+
+    @property
+    def reload_interval(self):
+        return getattr(settings, 'ROOM_EXPIRY_RELOAD_SECONDS', 30)
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive() and not self.stopped
+
+    def start(self):
+        """
+        Start the background thread (it loads pending expiries first).
+        """
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name='room-expiry', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+
+    def schedule(self, room_ids, expires_at):
+        """
+        Set the expiry of some rooms (expires_at is an aware datetime),
+        replacing any earlier one. Does nothing unless the scheduler runs in
+        this process; otherwise the next reload picks it up.
+        """
+        if not self.running:
+            return
+        deadline = expires_at.timestamp()
+        with self.cond:
+            for room_id in room_ids:
+                self.deadlines[room_id] = deadline
+                heapq.heappush(self.heap, (deadline, room_id))
+            # Rooms that keep being rescheduled leave outdated entries behind
+            if len(self.heap) > 2 * len(self.deadlines) + 1024:
+                self.heap = [(d, room_id) for room_id, d in self.deadlines.items()]
+                heapq.heapify(self.heap)
+            # Wake the thread in case this is now the earliest deadline
+            self.cond.notify()
+
+    def cancel(self, room_ids):
+        """
+        Forget the expiry of some rooms (they have members again).
+        """
+        if not self.running:
+            return
+        with self.cond:
+            for room_id in room_ids:
+                self.deadlines.pop(room_id, None)
+
+    def load(self):
+        """
+        Replace the schedule with every expiry currently in the database.
+        """
+        from .models import Room
+
+        deadlines = {
+            room_id: expires_at.timestamp()
+            for room_id, expires_at in Room.objects.filter(expires_at__isnull=False).exclude(
+                room_code='GLOBAL'
+            ).values_list('id', 'expires_at')
+        }
+        with self.cond:
+            self.deadlines = deadlines
+            self.heap = [(deadline, room_id) for room_id, deadline in deadlines.items()]
+            heapq.heapify(self.heap)
+            self.cond.notify()
+        logger.debug(f"Room expiry scheduler loaded {len(deadlines)} pending expiries")
+
+    def pop_due(self, timeout=None):
+        """
+        Wait until at least one room is due, then return all due room ids.
+        Returns an empty list if nothing was due within `timeout` seconds,
+        and None once stopped.
+        """
+        give_up = time.time() + timeout if timeout is not None else None
+        with self.cond:
+            while not self.stopped:
+                # Drop entries that were rescheduled or cancelled
+                while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+                    heapq.heappop(self.heap)
+
+                now = time.time()
+                if give_up is not None and now >= give_up:
+                    return []
+
+                delay = self.heap[0][0] - now if self.heap else None
+                if delay is None or delay > 0:
+                    if give_up is not None:
+                        delay = give_up - now if delay is None else min(delay, give_up - now)
+                    self.cond.wait(delay)
+                    continue
+
+                now = time.time()
+                due = []
+                while self.heap and self.heap[0][0] <= now:
+                    deadline, room_id = heapq.heappop(self.heap)
+                    if self.deadlines.get(room_id) == deadline:
+                        del self.deadlines[room_id]
+                        due.append(room_id)
+                if due:
+                    return due
+            return None
+
+    def expire(self, room_ids):
+        """
+        Tombstone the given rooms that are still expired, in batches
+        (with the same chunked UPDATE as rooms.cleanup).
+        Returns the number of rooms deleted.
+        """
+        from .cleanup import expired_rooms, tombstone_rooms
+
+        deleted = 0
+        for start in range(0, len(room_ids), self.batch_size):
+            batch = room_ids[start:start + self.batch_size]
+            stats = tombstone_rooms(expired_rooms().filter(id__in=batch), self.batch_size)
+            if stats['rooms']:
+                logger.info(f"Expired {stats['rooms']} empty room(s)")
+            deleted += stats['rooms']
+        self.expired_count += deleted
+        return deleted
+
+    def _run(self):
+        from django.db import close_old_connections
+
+        next_load = 0
+        while True:
+            if time.time() >= next_load:
+                try:
+                    self.load()
+                except Exception as e:
+                    logger.error(f"Failed to load room expiries: {str(e)}")
+                finally:
+                    close_old_connections()
+                next_load = time.time() + self.reload_interval
+
+            due = self.pop_due(timeout=next_load - time.time())
+            if due is None:
+                return
+            if not due:
+                continue
+            try:
+                self.expire(due)
+            except Exception as e:
+                logger.error(f"Failed to expire rooms: {str(e)}")
+            finally:
+                close_old_connections()
+
+
+# Shared scheduler for this process (started by run_worker)
+expiry_scheduler = ExpiryScheduler()
@@ -0,0 +1,105 @@
+"""
+Leader election for the background worker.
+Several `manage.py run_worker` processes may be started (one per host, or a
+spare for failover); only the one holding the lock runs jobs, the others
+wait to take over. On PostgreSQL the lock is a session advisory lock, so it
+covers every host using the database; otherwise it is an flock() on a local
+file. Both are released by the OS / database if the leader dies.
+"""
+import fcntl
+import logging
+import os
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+logger = logging.getLogger(__name__)
+
+# Advisory lock key for PostgreSQL (any constant shared by all workers)
+ADVISORY_LOCK_KEY = 0x56434146  # "VCAF"
+
+
+class LeaderLock:
+    """
+    Non-blocking, process-wide leadership lock.
+    acquire() returns True if this process is now the leader.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, 'WORKER_LOCK_FILE', os.path.join(settings.BASE_DIR, 'run_worker.lock'))
+        self.file = None
+        self.held = False
+
+    @property
+    def uses_database(self):
+        return connection.vendor == 'postgresql'
+
+    @property
+    def description(self):
+        if self.uses_database:
+            return f'PostgreSQL advisory lock {ADVISORY_LOCK_KEY}'
+        return f'file lock {self.path}'
+
+    def acquire(self):
+        if self.held:
+            return True
+        if self.uses_database:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_try_advisory_lock(%s)', [ADVISORY_LOCK_KEY])
+                    self.held = cursor.fetchone()[0]
+            except DatabaseError as e:
+                # Database down or connection dropped: start from a fresh
+                # connection and try again at the next tick
+                logger.error(f"Failed to take worker lock: {str(e)}")
+                connection.close()
+                return False
+        else:
+            self.file = self.file or open(self.path, 'a+')
+            try:
+                fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            # Note who holds it, for anyone looking at the file
+            self.file.seek(0)
+            self.file.truncate()
+            self.file.write(f'{os.getpid()}\n')
+            self.file.flush()
+            self.held = True
+        return self.held
+
+    def still_held(self):
+        """
+        Check the lock wasn't lost (an advisory lock goes with its
+        database connection). A file lock lasts as long as the process.
+        """
+        if not self.held or not self.uses_database:
+            return self.held
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND objid = %s "
+                    "AND pid = pg_backend_pid() AND granted",
+                    [ADVISORY_LOCK_KEY],
+                )
+                self.held = cursor.fetchone() is not None
+        except Exception as e:
+            logger.error(f"Failed to check worker lock: {str(e)}")
+            connection.close()  # The lock, if any, went with it
+            self.held = False
+        return self.held
+
+    def release(self):
+        if not self.held:
+            return
+        try:
+            if self.uses_database:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_unlock(%s)', [ADVISORY_LOCK_KEY])
+            else:
+                fcntl.flock(self.file, fcntl.LOCK_UN)
+                self.file.close()
+                self.file = None
+        except Exception as e:
+            logger.error(f"Failed to release worker lock: {str(e)}")
+        self.held = False
@@ -0,0 +1,84 @@
+"""
+Microbenchmark for room broadcasts.
+Measures CPU time per group broadcast against group size, comparing
+per-recipient json.dumps with serializing the frame once at group_send time.
+Usage: python manage.py bench_broadcast --sizes 10 100 500 1000
+"""
+import asyncio
+import json
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Benchmark CPU per room broadcast: json.dumps per recipient vs serialize once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500, 1000],
+                            help='Group sizes to test')
+        parser.add_argument('--broadcasts', type=int, default=50,
+                            help='Broadcasts to send per group size')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'members':>8} {'per-recipient':>15} {'serialize-once':>15} {'speedup':>8}")
+
+        for size in options['sizes']:
+            old = asyncio.run(self.measure(size, options['broadcasts'], serialize_once=False))
+            new = asyncio.run(self.measure(size, options['broadcasts'], serialize_once=True))
+            self.stdout.write(
+                f"{size:>8} {old * 1000:>13.2f}ms {new * 1000:>13.2f}ms {old / new:>7.1f}x"
+            )
+
+        self.stdout.write(self.style.SUCCESS('CPU time is per broadcast, including delivery to every member'))
+
+    async def measure(self, size, broadcasts, serialize_once):
+        """
+        Send `broadcasts` chat frames to a group of `size` channels and have
+        every member produce the text it would write to its WebSocket.
+        Returns CPU seconds per broadcast.
+        """
+        layer = InMemoryChannelLayer(capacity=broadcasts + 1)
+        channels = [await layer.new_channel() for _ in range(size)]
+        for channel in channels:
+            await layer.group_add('chat_BENCH', channel)
+
+        frame = {
+            'type': 'chat',
+            'message': 'Anyone up for a 50 minute focus session before lunch?',
+            'username': 'benchmark_user',
+            'user_id': 42,
+            'timestamp': '2026-01-01T12:00:00+00:00',
+        }
+
+        # Time group_send (where the layer copies the event per member) and
+        # the handler work each member does before self.send(). Pulling events
+        # off the in-memory queues is layer bookkeeping and isn't counted.
+        elapsed = 0.0
+        for _ in range(broadcasts):
+            start = time.process_time()
+            if serialize_once:
+                await layer.group_send('chat_BENCH', {'type': 'broadcast', 'text': json.dumps(frame)})
+            else:
+                await layer.group_send('chat_BENCH', {'type': 'chat_message', **frame})
+            elapsed += time.process_time() - start
+
+            events = [await layer.receive(channel) for channel in channels]
+
+            start = time.process_time()
+            for event in events:
+                if serialize_once:
+                    text = event['text']
+                else:
+                    text = json.dumps({
+                        'type': 'chat',
+                        'message': event['message'],
+                        'username': event['username'],
+                        'user_id': event['user_id'],
+                        'timestamp': event['timestamp'],
+                    })
+            elapsed += time.process_time() - start
+
+        await layer.flush()
+        return elapsed / broadcasts
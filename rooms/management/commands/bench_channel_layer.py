@@ -0,0 +1,107 @@
+"""
+Benchmark for channel layers.
+Compares InMemoryChannelLayer with SocketChannelLayer (two worker instances
+talking through a broker) on point-to-point latency and group fan-out.
+Usage: python manage.py bench_channel_layer --messages 2000 --group-size 100
+"""
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from rooms.socket_layer import SocketChannelLayer, SocketLayerBroker
+
+
+class Command(BaseCommand):
+    help = 'Benchmark InMemoryChannelLayer against the Unix socket channel layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000,
+                            help='Point-to-point messages to send')
+        parser.add_argument('--group-size', type=int, default=100,
+                            help='Members in the fan-out group (split across two workers)')
+        parser.add_argument('--broadcasts', type=int, default=200,
+                            help='Group sends for the fan-out test')
+
+    def handle(self, *args, **options):
+        results = asyncio.run(self.run_all(options))
+
+        self.stdout.write(
+            f"{'layer':>10} {'p50':>9} {'p99':>9} {'msgs/s':>9} {'fan-out/s':>10}"
+        )
+        for name, (p50, p99, rate, fanout) in results.items():
+            self.stdout.write(
+                f"{name:>10} {p50 * 1e6:>7.0f}us {p99 * 1e6:>7.0f}us {rate:>9.0f} {fanout:>10.0f}"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'Latency is send -> receive between two channels; '
+            'for the socket layer they belong to different workers'
+        ))
+
+    async def run_all(self, options):
+        results = {}
+
+        memory = InMemoryChannelLayer(capacity=options['messages'] + 1)
+        results['in-memory'] = await self.measure(memory, memory, options)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            broker = SocketLayerBroker(os.path.join(tmp, 'broker.sock'))
+            await broker.start()
+            config = {'path': broker.path, 'capacity': options['messages'] + 1}
+            sender, receiver = SocketChannelLayer(**config), SocketChannelLayer(**config)
+            try:
+                results['socket'] = await self.measure(sender, receiver, options)
+            finally:
+                await sender.flush()
+                await receiver.flush()
+                await broker.close()
+
+        return results
+
+    async def measure(self, sender, receiver, options):
+        """
+        Returns (p50 latency, p99 latency, messages/s, deliveries/s).
+        """
+        # Point-to-point: one message in flight at a time for latency
+        target = await receiver.new_channel()
+        latencies = []
+        for i in range(options['messages']):
+            start = time.perf_counter()
+            await sender.send(target, {'type': 'bench', 'n': i})
+            await receiver.receive(target)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        p50 = statistics.median(latencies)
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+
+        # Throughput: send everything, then drain
+        start = time.perf_counter()
+        for i in range(options['messages']):
+            await sender.send(target, {'type': 'bench', 'n': i})
+        for _ in range(options['messages']):
+            await receiver.receive(target)
+        rate = options['messages'] / (time.perf_counter() - start)
+
+        # Fan-out: members split between the two layers (workers)
+        members = []
+        for i in range(options['group_size']):
+            layer = sender if i % 2 else receiver
+            channel = await layer.new_channel()
+            await layer.group_add('chat_BENCH', channel)
+            members.append((layer, channel))
+        await asyncio.sleep(0.1)  # Let the broker apply the group_adds sent by both workers
+
+        start = time.perf_counter()
+        for i in range(options['broadcasts']):
+            await sender.group_send('chat_BENCH', {'type': 'broadcast', 'text': 'hello', 'seq': i})
+            for layer, channel in members:
+                await layer.receive(channel)
+        fanout = options['broadcasts'] * len(members) / (time.perf_counter() - start)
+
+        for layer, channel in members:
+            await layer.group_discard('chat_BENCH', channel)
+        return p50, p99, rate, fanout
@@ -0,0 +1,126 @@
+"""
+Benchmark chat message persistence.
+Compares one INSERT per message with the batched write-behind buffer.
+Usage: python manage.py bench_chat_writes --rate 1000 --seconds 5
+"""
+import asyncio
+import time
+import uuid
+
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from rooms.chat_buffer import ChatWriteBuffer
+from rooms.models import Room, ChatMessage
+
+
+class Command(BaseCommand):
+    help = 'Benchmark per-message chat inserts against batched (write-behind) inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rate', type=int, default=1000, help='Messages per second to send')
+        parser.add_argument('--seconds', type=float, default=5, help='How long to send for')
+        parser.add_argument('--batch-size', type=int, default=100, help='Buffer flush size')
+        parser.add_argument('--interval-ms', type=int, default=250, help='Buffer flush interval')
+
+    def handle(self, *args, **options):
+        rate = options['rate']
+        total = int(rate * options['seconds'])
+
+        # Throwaway user and room, removed again at the end
+        user = User.objects.create_user(username=f'bench_{uuid.uuid4().hex[:8]}')
+        room = Room.objects.create(name='Chat write benchmark', created_by=user, is_public=False)
+
+        try:
+            self.stdout.write(f'Sending {total} messages at {rate} msgs/s\n')
+
+            per_message = asyncio.run(self.run_per_message(room, user, rate, total))
+            self.report('Per-message INSERT', per_message, total)
+            ChatMessage.objects.filter(room=room).delete()
+
+            buffer = ChatWriteBuffer(
+                max_messages=options['batch_size'],
+                interval_ms=options['interval_ms'],
+            )
+            batched = asyncio.run(self.run_batched(room, user, rate, total, buffer))
+            self.report(
+                f'Batched bulk_create (size={buffer.max_messages}, interval={buffer.interval_ms}ms)',
+                batched, total
+            )
+
+            speedup = per_message['db_round_trips'] / max(1, batched['db_round_trips'])
+            self.stdout.write(self.style.SUCCESS(f'Batching used {speedup:.0f}x fewer database round trips'))
+        finally:
+            user.delete()  # Cascades to the room and its messages
+
+    async def run_per_message(self, room, user, rate, total):
+        """
+        Old consumer behaviour: one database call per message.
+        """
+        def insert(i):
+            ChatMessage.objects.create(room=room, user=user, message=f'message {i}')
+
+        save = database_sync_to_async(insert)
+        stats = await self.drive(rate, total, save)
+        stats['db_round_trips'] = total
+        stats['persisted'] = await database_sync_to_async(self.count_messages)(room)
+        return stats
+
+    async def run_batched(self, room, user, rate, total, buffer):
+        """
+        New consumer behaviour: messages go through the write-behind buffer.
+        """
+        async def save(i):
+            await buffer.add(ChatMessage(room_id=room.id, user_id=user.id, message=f'message {i}'))
+
+        stats = await self.drive(rate, total, save)
+
+        # Include the final flush so both modes are measured to "all rows saved"
+        start = time.perf_counter()
+        await buffer.flush()
+        stats['elapsed'] += time.perf_counter() - start
+        stats['db_round_trips'] = buffer.flush_count
+        stats['persisted'] = await database_sync_to_async(self.count_messages)(room)
+        return stats
+
+    async def drive(self, rate, total, save):
+        """
+        Call save() for each message on a fixed schedule of `rate` per second.
+        Records how far the sender falls behind that schedule.
+        """
+        start = time.perf_counter()
+        max_lag = 0.0
+        save_time = 0.0
+
+        for i in range(total):
+            due = start + i / rate
+            now = time.perf_counter()
+            if due > now:
+                await asyncio.sleep(due - now)
+            else:
+                max_lag = max(max_lag, now - due)
+
+            t0 = time.perf_counter()
+            await save(i)
+            save_time += time.perf_counter() - t0
+
+        return {
+            'elapsed': time.perf_counter() - start,
+            'max_lag': max_lag,
+            'save_time': save_time,
+        }
+
+    @staticmethod
+    def count_messages(room):
+        return ChatMessage.objects.filter(room=room).count()
+
+    def report(self, label, stats, total):
+        self.stdout.write(self.style.WARNING(label))
+        self.stdout.write(f"  elapsed:          {stats['elapsed']:.2f}s")
+        self.stdout.write(f"  achieved rate:    {total / stats['elapsed']:.0f} msgs/s")
+        self.stdout.write(f"  time in save():   {stats['save_time'] * 1000:.0f}ms "
+                          f"({stats['save_time'] * 1e6 / total:.1f}us per message)")
+        self.stdout.write(f"  max sender lag:   {stats['max_lag'] * 1000:.1f}ms")
+        self.stdout.write(f"  DB round trips:   {stats['db_round_trips']}")
+        self.stdout.write(f"  rows persisted:   {stats['persisted']}/{total}\n")
@@ -0,0 +1,102 @@
+"""
+Benchmark room cleanup on a large number of stale rooms.
+Creates N empty rooms older than the inactivity cutoff (each with a few
+memberships and chat messages), then times the cleanup engine (tombstoning)
+and the purge of the tombstoned rooms. With
+--legacy N it first times the old per-room loop (COUNT + delete per room)
+on N of them for comparison.
+Usage: python manage.py bench_cleanup --rooms 100000 --legacy 2000
+"""
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rooms.cleanup import cleanup_inactive_rooms, inactive_rooms
+from rooms.purge import purge_room
+from rooms.models import ChatMessage, Room, RoomMembership
+
+
+class Command(BaseCommand):
+    help = 'Time cleanup of many stale rooms: chunked engine vs the old per-room loop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=100000, help='Stale rooms to create')
+        parser.add_argument('--legacy', type=int, default=0,
+                            help='Also time the old per-room loop on this many rooms')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Rooms per transaction')
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        owner = User.objects.create_user(username=f'cleanbench_{run_id}')
+        try:
+            self.create_stale_rooms(owner, options['rooms'])
+
+            if options['legacy']:
+                self.run_legacy(owner, options['legacy'])
+
+            stats = cleanup_inactive_rooms(chunk_size=options['chunk_size'])
+            self.stdout.write(self.style.WARNING('Chunked cleanup engine (tombstone)'))
+            self.stdout.write(f"  rooms deleted:  {stats['rooms']}")
+            self.stdout.write(f"  time:           {stats['seconds']:.2f}s")
+            self.stdout.write(self.style.SUCCESS(f"  rooms/s:        {stats['rooms_per_second']:.0f}"))
+
+            # Only this run's rooms, not whatever else is waiting to be purged
+            start = time.perf_counter()
+            rows = max_lock_ms = 0
+            purged = Room.all_objects.filter(created_by=owner, deleted_at__isnull=False)
+            for room_id in list(purged.values_list('id', flat=True)):
+                metrics = purge_room(room_id)
+                rows += metrics['total_rows']
+                max_lock_ms = max(max_lock_ms, metrics['max_lock_ms'])
+            seconds = time.perf_counter() - start
+            self.stdout.write(self.style.WARNING('Purge of the tombstoned rooms'))
+            self.stdout.write(f'  rows deleted:   {rows}')
+            self.stdout.write(f'  time:           {seconds:.2f}s')
+            self.stdout.write(f'  longest lock:   {max_lock_ms:.1f}ms')
+            self.stdout.write(self.style.SUCCESS(f'  rows/s:         {rows / seconds if seconds else 0:.0f}'))
+        finally:
+            owner.delete()  # Cascades to anything left over
+
+    def create_stale_rooms(self, owner, count):
+        """
+        Bulk-create empty rooms that are past the inactivity cutoff,
+        each with two inactive memberships and three chat messages.
+        """
+        start = time.perf_counter()
+        old = timezone.now() - timedelta(hours=2)
+        for offset in range(0, count, 5000):
+            rooms = Room.objects.bulk_create([
+                Room(name=f'Stale {i}', created_by=owner, is_public=False,
+                     room_code=uuid.uuid4().hex[:10].upper(), last_activity=old)
+                for i in range(offset, min(count, offset + 5000))
+            ])
+            RoomMembership.objects.bulk_create([
+                RoomMembership(room=room, user=owner, is_active=False) for room in rooms
+            ])
+            ChatMessage.objects.bulk_create([
+                ChatMessage(room=room, user=owner, message=f'message {n}', created_at=old)
+                for room in rooms for n in range(3)
+            ])
+        # created_at is auto_now_add, so age the rooms afterwards
+        Room.objects.filter(created_by=owner).update(created_at=old)
+        self.stdout.write(f'Created {count} stale rooms in {time.perf_counter() - start:.1f}s')
+
+    def run_legacy(self, owner, count):
+        """
+        The old cleanup: load rooms, one COUNT per room, one delete per room.
+        """
+        rooms = list(inactive_rooms().filter(created_by=owner)[:count])
+        start = time.perf_counter()
+        rows = 0
+        for room in rooms:
+            if room.get_member_count() == 0:
+                rows += room.delete()[0]
+        seconds = time.perf_counter() - start
+        self.stdout.write(self.style.WARNING(f'Old per-room loop ({len(rooms)} rooms)'))
+        self.stdout.write(f'  rows deleted:   {rows}')
+        self.stdout.write(f'  time:           {seconds:.2f}s')
+        self.stdout.write(f'  rows/s:         {rows / seconds:.0f}')
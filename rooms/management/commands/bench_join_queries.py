@@ -0,0 +1,92 @@
+"""
+Benchmark the database work of joining a room.
+Counts queries for N users opening a room page, and compares the room
+activity writes of the old path (Room.update_activity() from the membership
+signal and again from the view) with the batched activity tracker.
+Usage: python manage.py bench_join_queries --joins 50
+"""
+import uuid
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rooms.activity import activity_tracker
+from rooms.models import Room
+
+
+def query_kinds(queries):
+    """
+    Count queries by statement type (SELECT, INSERT, UPDATE, ...).
+    """
+    return Counter(query['sql'].split(None, 1)[0].upper() for query in queries)
+
+
+class Command(BaseCommand):
+    help = 'Count the queries of the room join path, before and after batched activity writes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--joins', type=int, default=50, help='Users joining the room')
+
+    def handle(self, *args, **options):
+        joins = options['joins']
+        run_id = uuid.uuid4().hex[:8]
+
+        owner = User.objects.create_user(username=f'joinbench_{run_id}_owner')
+        users = [User.objects.create_user(username=f'joinbench_{run_id}_{i}') for i in range(joins)]
+        room = Room.objects.create(name='Join benchmark', created_by=owner, is_public=False)
+
+        try:
+            # Old path: update_activity() from the post_save signal and again
+            # from the view, on every join
+            with CaptureQueriesContext(connection) as old:
+                for _ in range(joins):
+                    room.update_activity()
+                    room.update_activity()
+
+            # New path: both calls just mark the room, one flush writes it
+            activity_tracker.flush()
+            with CaptureQueriesContext(connection) as new:
+                for _ in range(joins):
+                    activity_tracker.touch(room.id)
+                    activity_tracker.touch(room.id, occupied=True)
+                activity_tracker.flush()
+
+            self.report_activity(joins, old.captured_queries, new.captured_queries)
+
+            # The whole page request, as it is now
+            client = Client()
+            url = reverse('room_detail', args=[room.room_code])
+            request_queries = []
+            for user in users:
+                client.force_login(user)
+                with CaptureQueriesContext(connection) as request:
+                    response = client.get(url)
+                if response.status_code != 200:
+                    self.stderr.write(f'Unexpected status {response.status_code} for {url}')
+                    return
+                request_queries.append(len(request.captured_queries))
+            activity_tracker.flush()
+
+            self.stdout.write(self.style.WARNING('First join of a room page (GET room_detail)'))
+            self.stdout.write(f'  queries per request: min {min(request_queries)}, '
+                              f'max {max(request_queries)}, '
+                              f'avg {sum(request_queries) / len(request_queries):.1f}')
+        finally:
+            # Deleting the users cascades to the room and its memberships
+            User.objects.filter(username__startswith=f'joinbench_{run_id}_').delete()
+
+    def report_activity(self, joins, old_queries, new_queries):
+        old_kinds, new_kinds = query_kinds(old_queries), query_kinds(new_queries)
+        self.stdout.write(self.style.WARNING(f'Room activity writes for {joins} joins'))
+        self.stdout.write(f"  update_activity() x2 per join: {len(old_queries):>4} queries "
+                          f"({old_kinds['SELECT']} SELECT, {old_kinds['UPDATE']} UPDATE)")
+        self.stdout.write(f"  activity tracker:              {len(new_queries):>4} queries "
+                          f"({new_kinds['SELECT']} SELECT, {new_kinds['UPDATE']} UPDATE)")
+        self.stdout.write(self.style.SUCCESS(
+            f'Activity queries per join: {len(old_queries) / joins:.1f} -> {len(new_queries) / joins:.2f}'
+        ))
@@ -0,0 +1,84 @@
+"""
+Benchmark room search: substring scan vs the full-text index.
+Creates N public rooms with generated names and descriptions, then times
+the old icontains filter and rooms.search for a few queries (first page of
+results, and the total match count).
+Usage: python manage.py bench_room_search --rooms 1000000
+"""
+import random
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from rooms.codes import room_codes
+from rooms.models import Room
+from rooms.search import search_rooms
+
+SUBJECTS = ['maths', 'physics', 'chemistry', 'biology', 'history', 'geography', 'economics',
+            'python', 'django', 'algorithms', 'calculus', 'statistics', 'literature', 'french',
+            'spanish', 'music', 'philosophy', 'psychology', 'medicine', 'law']
+WORDS = ['study', 'group', 'focus', 'session', 'exam', 'revision', 'quiet', 'pomodoro', 'night',
+         'morning', 'weekend', 'homework', 'project', 'reading', 'practice', 'notes', 'team', 'club']
+
+QUERIES = ['maths', 'pomodoro quiet', 'calc', 'philosophy exam', 'zzyzx']
+
+
+class Command(BaseCommand):
+    help = 'Time room search with icontains vs the full-text index over many rooms'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=1000000, help='Rooms to create')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query (best is reported)')
+
+    def handle(self, *args, **options):
+        owner = User.objects.create_user(username=f'searchbench_{uuid.uuid4().hex[:8]}')
+        try:
+            self.create_rooms(owner, options['rooms'])
+            rooms = Room.objects.filter(is_public=True)
+
+            self.stdout.write(f"{'query':<18}{'matches':>9}{'icontains page':>16}{'fts page':>10}"
+                              f"{'icontains count':>17}{'fts count':>11}")
+            for query in QUERIES:
+                words = query.split()
+                scan = rooms
+                for word in words:
+                    scan = scan.filter(Q(name__icontains=word) | Q(description__icontains=word))
+                indexed = search_rooms(rooms, query)
+
+                scan_page = self.best(lambda: list(scan[:20]), options['repeat'])
+                fts_page = self.best(lambda: list(indexed[:20]), options['repeat'])
+                scan_count = self.best(lambda: scan.count(), options['repeat'])
+                fts_count = self.best(lambda: indexed.count(), options['repeat'])
+                self.stdout.write(
+                    f'{query:<18}{indexed.count():>9}{scan_page:>14.1f}ms{fts_page:>8.1f}ms'
+                    f'{scan_count:>15.1f}ms{fts_count:>9.1f}ms'
+                )
+        finally:
+            # The bench rooms have no memberships or messages to purge first
+            Room.all_objects.filter(created_by=owner).delete()
+            owner.delete()
+
+    def best(self, run, repeat):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append((time.perf_counter() - start) * 1000)
+        return min(times)
+
+    def create_rooms(self, owner, count):
+        start = time.perf_counter()
+        rng = random.Random(42)
+        for offset in range(0, count, 5000):
+            Room.objects.bulk_create([
+                Room(
+                    name=f'{rng.choice(SUBJECTS).title()} {rng.choice(WORDS)} {i}',
+                    description=' '.join(rng.choice(SUBJECTS + WORDS) for _ in range(8)),
+                    created_by=owner, is_public=True, room_code=room_codes.allocate(),
+                )
+                for i in range(offset, min(count, offset + 5000))
+            ])
+        self.stdout.write(f'Created {count} rooms (indexed by trigger) in {time.perf_counter() - start:.1f}s')
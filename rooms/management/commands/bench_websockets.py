@@ -0,0 +1,254 @@
+"""
+WebSocket load generator.
+Connects N simulated clients spread over M rooms to virtualcafe.asgi.application
+(through WebsocketCommunicator, so no server or network is involved) and
+drives chat at a fixed rate. Reports delivery latency, messages sent per
+second, deliveries per second (one message reaches every client in its room)
+and memory, and writes the results to a JSON file.
+
+Usage: python manage.py bench_websockets --clients 200 --rooms 10 --rate 50 --seconds 10
+       python manage.py bench_websockets --baseline ws_bench_old.json   # fail on regressions
+"""
+import asyncio
+import json
+import random
+import resource
+import time
+import uuid
+
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from rooms.chat_buffer import chat_buffer
+from rooms.models import Room
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+
+def current_rss_mb():
+    """
+    Returns this process's resident memory in MB (Linux), else the peak RSS.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 1024 / 1024
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = 'Load test room WebSockets: N clients across M rooms, report latency, messages/s, deliveries/s and RSS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100, help='Simulated clients')
+        parser.add_argument('--rooms', type=int, default=10, help='Rooms to spread clients over')
+        parser.add_argument('--rate', type=float, default=50,
+                            help='Chat messages per second sent in total')
+        parser.add_argument('--seconds', type=float, default=10, help='How long to send for')
+        parser.add_argument('--output', default=None,
+                            help='JSON results file (default: ws_bench_<timestamp>.json)')
+        parser.add_argument('--baseline', default=None,
+                            help='Earlier results file; fail if p95 latency or deliveries/s regress')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed regression against the baseline (0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1 or options['rooms'] < 1:
+            raise CommandError('--clients and --rooms must be at least 1')
+
+        from virtualcafe.asgi import application
+
+        run_id = uuid.uuid4().hex[:8]
+        users, rooms = self.create_fixtures(run_id, options['clients'], options['rooms'])
+        try:
+            results = asyncio.run(self.run(application, users, rooms, options))
+        finally:
+            # Deleting the users cascades to their rooms, memberships and messages
+            User.objects.filter(username__startswith=f'wsbench_{run_id}_').delete()
+
+        report = {
+            'timestamp': timezone.now().isoformat(),
+            'config': {
+                'clients': options['clients'],
+                'rooms': options['rooms'],
+                'rate': options['rate'],
+                'seconds': options['seconds'],
+                'channel_layer': settings.CHANNEL_LAYERS['default']['BACKEND'],
+            },
+            'results': results,
+        }
+
+        self.report(results)
+        output = options['output'] or f"ws_bench_{timezone.now():%Y%m%d_%H%M%S}.json"
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f'Results written to {output}')
+
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def create_fixtures(self, run_id, client_count, room_count):
+        """
+        Create throwaway users and rooms for this run.
+        """
+        User.objects.bulk_create([
+            User(username=f'wsbench_{run_id}_{i}') for i in range(client_count)
+        ])
+        users = list(User.objects.filter(username__startswith=f'wsbench_{run_id}_').order_by('id'))
+        rooms = [
+            Room.objects.create(name=f'Load test {i}', created_by=users[0], is_public=False)
+            for i in range(room_count)
+        ]
+        return users, rooms
+
+    async def run(self, application, users, rooms, options):
+        rss_start = current_rss_mb()
+
+        # Connect clients round-robin over the rooms
+        start = time.perf_counter()
+        clients = []
+        for i, user in enumerate(users):
+            room = rooms[i % len(rooms)]
+            communicator = WebsocketCommunicator(application, f'/ws/rooms/{room.room_code}/')
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise CommandError(f'Client {i} could not connect to room {room.room_code}')
+            clients.append((communicator, room.room_code))
+        connect_seconds = time.perf_counter() - start
+        rss_connected = current_rss_mb()
+
+        # Every client reads its socket continuously and records chat latency
+        latencies = []
+        readers = [
+            asyncio.ensure_future(self.read_frames(communicator, latencies))
+            for communicator, _ in clients
+        ]
+        await asyncio.sleep(0.5)  # Let join snapshots and presence settle
+
+        members = {}
+        for _, room_code in clients:
+            members[room_code] = members.get(room_code, 0) + 1
+
+        # Send chat from random clients on a fixed schedule
+        total = int(options['rate'] * options['seconds'])
+        expected = 0
+        max_lag = 0.0
+        start = time.perf_counter()
+        for i in range(total):
+            due = start + i / options['rate']
+            now = time.perf_counter()
+            if due > now:
+                await asyncio.sleep(due - now)
+            else:
+                max_lag = max(max_lag, now - due)
+
+            communicator, room_code = random.choice(clients)
+            await communicator.send_to(text_data=json.dumps({
+                'type': 'chat',
+                'message': f'bench {time.perf_counter()!r}',
+            }))
+            expected += members[room_code]
+
+        # Wait (up to 10s) for the remaining deliveries
+        deadline = time.perf_counter() + 10
+        while len(latencies) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - start
+
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        for communicator, _ in clients:
+            await communicator.disconnect()
+        await chat_buffer.flush()
+
+        latencies.sort()
+        return {
+            'connect_seconds': round(connect_seconds, 3),
+            'messages_sent': total,
+            'deliveries_expected': expected,
+            'messages_per_second': round(total / elapsed, 1),
+            'deliveries': len(latencies),
+            'deliveries_per_second': round(len(latencies) / elapsed, 1),
+            'max_sender_lag_ms': round(max_lag * 1000, 2),
+            'latency_ms': {
+                name: round(percentile(latencies, pct) * 1000, 3) if latencies else None
+                for name, pct in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))
+            },
+            'rss_mb': {
+                'start': round(rss_start, 1),
+                'connected': round(rss_connected, 1),
+                'per_client_kb': round((rss_connected - rss_start) * 1024 / len(clients), 1),
+                'peak': round(peak_rss_mb(), 1),
+            },
+        }
+
+    async def read_frames(self, communicator, latencies):
+        """
+        Read a client's frames until cancelled, timing chat deliveries.
+        """
+        while True:
+            output = await communicator.receive_output(timeout=3600)
+            text = output.get('text')
+            if not text or '"chat"' not in text:
+                continue
+            frame = json.loads(text)
+            if frame.get('type') == 'chat' and frame['message'].startswith('bench '):
+                latencies.append(time.perf_counter() - float(frame['message'][6:]))
+
+    def report(self, results):
+        latency = results['latency_ms']
+        rss = results['rss_mb']
+        self.stdout.write(self.style.WARNING('WebSocket load test'))
+        self.stdout.write(f"  connect time:     {results['connect_seconds']:.2f}s")
+        self.stdout.write(f"  messages sent:    {results['messages_sent']}")
+        self.stdout.write(f"  messages/s:       {results['messages_per_second']:.0f}")
+        self.stdout.write(f"  deliveries:       {results['deliveries']}/{results['deliveries_expected']}")
+        self.stdout.write(f"  deliveries/s:     {results['deliveries_per_second']:.0f}")
+        self.stdout.write(f"  max sender lag:   {results['max_sender_lag_ms']:.1f}ms")
+        self.stdout.write(f"  latency p50/p95/p99/max: {latency['p50']} / {latency['p95']} / "
+                          f"{latency['p99']} / {latency['max']} ms")
+        self.stdout.write(f"  RSS:              {rss['start']} -> {rss['connected']} MB "
+                          f"({rss['per_client_kb']} KB per client), peak {rss['peak']} MB")
+
+    def compare(self, results, baseline_path, tolerance):
+        """
+        Raise CommandError if p95 latency or deliveries/s regressed against a baseline.
+        Deliveries/s is the throughput compared: it counts fan-out, which is
+        where the work is; messages/s only follows --rate.
+        """
+        with open(baseline_path) as f:
+            baseline = json.load(f)['results']
+
+        problems = []
+        old_p95, new_p95 = baseline['latency_ms']['p95'], results['latency_ms']['p95']
+        if old_p95 and new_p95 and new_p95 > old_p95 * (1 + tolerance):
+            problems.append(f'p95 latency {old_p95}ms -> {new_p95}ms')
+
+        old_rate, new_rate = baseline['deliveries_per_second'], results['deliveries_per_second']
+        if new_rate < old_rate * (1 - tolerance):
+            problems.append(f'deliveries/s {old_rate} -> {new_rate}')
+
+        if results['deliveries'] < results['deliveries_expected']:
+            problems.append(f"lost {results['deliveries_expected'] - results['deliveries']} deliveries")
+
+        if problems:
+            raise CommandError('Regression against baseline: ' + '; '.join(problems))
+        self.stdout.write(self.style.SUCCESS(
+            f'No regression in p95 latency or deliveries/s against {baseline_path}'
+        ))
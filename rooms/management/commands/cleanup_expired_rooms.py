@@ -3,31 +3,24 @@ Management command to clean up expired rooms.
 Run this periodically (e.g., via cron job) to remove empty rooms that have expired.
 """
 from django.core.management.base import BaseCommand
-from django.utils import timezone
-from rooms.models import Room
+from rooms.cleanup import cleanup_expired_rooms, set_expiry_for_empty_rooms
 
 
 class Command(BaseCommand):
     help = 'Removes rooms that have been empty for more than 15 minutes'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='Rooms deleted per UPDATE (default: ROOM_CLEANUP_CHUNK_SIZE)')
+
     def handle(self, *args, **options):
-        # Find expired rooms
-        expired_rooms = Room.objects.filter(
-            expires_at__lte=timezone.now()
-        )
-        
-        count = expired_rooms.count()
+        stats = cleanup_expired_rooms(chunk_size=options['chunk_size'])
         
-        if count > 0:
-            # Get room names for logging
-            room_names = list(expired_rooms.values_list('name', flat=True))
-            
-            # Delete expired rooms
-            expired_rooms.delete()
-            
+        if stats['rooms'] > 0:
             self.stdout.write(
                 self.style.SUCCESS(
-                    f'Successfully deleted {count} expired room(s): {", ".join(room_names)}'
+                    f"Successfully deleted {stats['rooms']} expired room(s) "
+                    f"({stats['rooms_per_second']:.0f} rooms/s)"
                 )
             )
         else:
@@ -36,15 +29,7 @@ class Command(BaseCommand):
             )
         
         # Update expiration for empty rooms that don't have expiration set
-        empty_rooms_without_expiration = Room.objects.filter(
-            expires_at__isnull=True
-        )
-        
-        updated_count = 0
-        for room in empty_rooms_without_expiration:
-            if room.is_empty():
-                room.update_activity()
-                updated_count += 1
+        updated_count = set_expiry_for_empty_rooms()
         
         if updated_count > 0:
             self.stdout.write(
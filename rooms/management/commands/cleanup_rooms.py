@@ -1,18 +1,29 @@
 """
 Django management command to clean up inactive rooms.
-Usage: python manage.py cleanup_rooms
+Usage: python manage.py cleanup_rooms [--chunk-size 500]
 """
 from django.core.management.base import BaseCommand
-from rooms.cleanup import run_all_cleanup
+from rooms.cleanup import cleanup_inactive_rooms, cleanup_expired_rooms
 
 
 class Command(BaseCommand):
     help = 'Clean up inactive and expired rooms older than 30 minutes'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='Rooms deleted per UPDATE (default: ROOM_CLEANUP_CHUNK_SIZE)')
+
     def handle(self, *args, **options):
         self.stdout.write(self.style.WARNING('Starting room cleanup...'))
         
-        deleted_count = run_all_cleanup()
+        deleted_count = 0
+        for label, cleanup in (('inactive', cleanup_inactive_rooms), ('expired', cleanup_expired_rooms)):
+            stats = cleanup(chunk_size=options['chunk_size'])
+            deleted_count += stats['rooms']
+            self.stdout.write(
+                f"  {label}: {stats['rooms']} room(s) in "
+                f"{stats['seconds']:.2f}s ({stats['rooms_per_second']:.0f} rooms/s)"
+            )
         
         if deleted_count > 0:
             self.stdout.write(
@@ -0,0 +1,42 @@
+"""
+Django management command to purge deleted (tombstoned) rooms now,
+instead of waiting for the worker's purge job.
+Usage: python manage.py purge_rooms [--batch-size 1000] [--room CODE]
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from rooms.models import Room
+from rooms.purge import purge_tombstoned_rooms
+
+
+class Command(BaseCommand):
+    help = 'Remove tombstoned rooms and their history in small batches, with lock/throughput metrics'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Rows per transaction (default: ROOM_PURGE_BATCH_SIZE)')
+        parser.add_argument('--limit', type=int, default=None, help='Purge at most this many rooms')
+        parser.add_argument('--room', default=None, help='Delete (tombstone) this room code first')
+
+    def handle(self, *args, **options):
+        if options['room']:
+            room = Room.objects.filter(room_code=options['room'].upper()).first()
+            if room is None:
+                raise CommandError(f"Room {options['room']} not found")
+            room.tombstone()
+            self.stdout.write(f'Tombstoned {room}')
+
+        results = purge_tombstoned_rooms(batch_size=options['batch_size'], limit=options['limit'])
+        if not results:
+            self.stdout.write(self.style.SUCCESS('No deleted rooms to purge'))
+            return
+
+        for metrics in results:
+            detail = ', '.join(f'{count} {name}' for name, count in metrics['rows'].items())
+            self.stdout.write(
+                f"  room {metrics['room_id']}: {detail}\n"
+                f"    {metrics['total_rows']} rows in {metrics['batches']} transactions, "
+                f"{metrics['seconds']:.2f}s ({metrics['rows_per_second']:.0f} rows/s), "
+                f"lock max {metrics['max_lock_ms']:.1f}ms avg {metrics['avg_lock_ms']:.1f}ms"
+            )
+        self.stdout.write(self.style.SUCCESS(f'Purged {len(results)} room(s)'))
@@ -0,0 +1,27 @@
+"""
+Django management command to run the channel broker for SocketChannelLayer.
+Start it before the workers, which need CHANNEL_LAYER=socket.
+Usage: python manage.py run_channel_broker [--socket /path/to/broker.sock]
+"""
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rooms.socket_layer import SocketLayerBroker
+
+
+class Command(BaseCommand):
+    help = 'Run the Unix socket broker that connects worker processes (no Redis needed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.CHANNEL_BROKER_SOCKET,
+                            help='Path of the Unix socket to listen on')
+
+    def handle(self, *args, **options):
+        broker = SocketLayerBroker(options['socket'])
+        self.stdout.write(self.style.SUCCESS(f"Channel broker listening on {options['socket']}"))
+        try:
+            asyncio.run(broker.serve_forever())
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Channel broker stopped'))
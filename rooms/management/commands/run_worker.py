@@ -0,0 +1,58 @@
+"""
+Django management command to run background jobs: the room cleanup job and
+the room expiry scheduler. Web processes don't run them any more; start one
+of these per deployment (more are fine, they wait as standbys).
+Usage: python manage.py run_worker [--lock-file /path/to/run_worker.lock]
+"""
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from rooms.leader import LeaderLock
+from rooms.scheduler import start_scheduler, stop_scheduler
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs (room cleanup and expiry) in the single leader process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lock-file', default=None,
+                            help='Lock file used for leader election when not on PostgreSQL '
+                                 '(default: settings.WORKER_LOCK_FILE)')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds between attempts to become leader, and between lock checks')
+
+    def handle(self, *args, **options):
+        lock = LeaderLock(options['lock_file'])
+        interval = options['interval']
+        stopping = threading.Event()
+
+        def shutdown(signum, frame):
+            stopping.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        waiting_logged = False
+        try:
+            while not stopping.is_set():
+                if not lock.acquire():
+                    if not waiting_logged:
+                        self.stdout.write(f'Another worker holds the {lock.description}; standing by')
+                        waiting_logged = True
+                    stopping.wait(interval)
+                    continue
+
+                self.stdout.write(self.style.SUCCESS(f'Leader ({lock.description}), starting background jobs'))
+                start_scheduler()
+                while not stopping.wait(interval):
+                    if not lock.still_held():
+                        self.stderr.write('Lost the worker lock, stopping background jobs')
+                        break
+                stop_scheduler()
+                waiting_logged = False
+        finally:
+            stop_scheduler()
+            lock.release()
+        self.stdout.write(self.style.WARNING('Worker stopped'))
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0004_chatmessage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['room', 'created_at', 'id'], name='chatmsg_room_created_id_idx'),
+        ),
+    ]
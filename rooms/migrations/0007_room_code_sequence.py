@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-17 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0006_room_deleted_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomCodeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_value', models.BigIntegerField(default=0)),
+                ('key', models.CharField(max_length=64)),
+            ],
+        ),
+    ]
@@ -0,0 +1,77 @@
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE rooms_room_fts USING fts5(
+        name, description,
+        content='rooms_room', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    # Rank by bm25 with name matches weighted 10x the description
+    "INSERT INTO rooms_room_fts(rooms_room_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+    """
+    CREATE TRIGGER rooms_room_fts_insert AFTER INSERT ON rooms_room BEGIN
+        INSERT INTO rooms_room_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER rooms_room_fts_delete AFTER DELETE ON rooms_room BEGIN
+        INSERT INTO rooms_room_fts(rooms_room_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER rooms_room_fts_update AFTER UPDATE OF name, description ON rooms_room BEGIN
+        INSERT INTO rooms_room_fts(rooms_room_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO rooms_room_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    "INSERT INTO rooms_room_fts(rooms_room_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS rooms_room_fts_update",
+    "DROP TRIGGER IF EXISTS rooms_room_fts_delete",
+    "DROP TRIGGER IF EXISTS rooms_room_fts_insert",
+    "DROP TABLE IF EXISTS rooms_room_fts",
+]
+
+# Must match rooms.search.PG_DOCUMENT
+POSTGRES_FORWARD = [
+    """
+    CREATE INDEX rooms_room_search_idx ON rooms_room USING GIN (
+        (setweight(to_tsvector('simple', coalesce(rooms_room.name, '')), 'A') ||
+         setweight(to_tsvector('simple', coalesce(rooms_room.description, '')), 'B'))
+    )
+    """,
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS rooms_room_search_idx",
+]
+
+
+def run(statements_by_vendor):
+    def apply(apps, schema_editor):
+        statements = statements_by_vendor.get(schema_editor.connection.vendor, [])
+        for sql in statements:
+            schema_editor.execute(sql)
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0007_room_code_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            run({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7 on 2026-10-17 15:52
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_active_members(apps, schema_editor):
+    Room = apps.get_model('rooms', 'Room')
+    RoomMembership = apps.get_model('rooms', 'RoomMembership')
+    active = RoomMembership.objects.filter(room=OuterRef('pk'), is_active=True).order_by().values('room')
+    Room.objects.update(active_member_count=Coalesce(
+        Subquery(active.annotate(count=Count('id')).values('count'), output_field=IntegerField()), 0
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0008_room_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='active_member_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_active_members, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='room',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='room_tombstone_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True), ('is_public', True)), fields=['-last_activity', '-id'], name='room_directory_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True), ('is_public', True)), fields=['-active_member_count', '-id'], name='room_directory_members_idx'),
+        ),
+    ]
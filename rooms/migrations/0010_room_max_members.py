@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-17 15:57
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0009_room_active_member_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='max_members',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-17 17:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0010_room_max_members'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PresenceWorker',
+            fields=[
+                ('worker_id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('last_seen', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='roommembership',
+            name='presence_worker',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-17 17:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0011_presence_worker'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='chatmessage',
+            name='chatmsg_room_created_id_idx',
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='shard',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['room', 'shard', 'created_at', 'id'], name='chatmsg_room_shard_created_idx'),
+        ),
+    ]
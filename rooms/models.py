@@ -1,17 +1,28 @@
 """
 Rooms app models.
-Defines Room and RoomMembership models for study rooms.
+Defines Room, RoomMembership and ChatMessage models for study rooms.
 """
-from django.db import models
+from django.core.validators import MinValueValidator
+from django.db import connections, models
 from django.contrib.auth.models import User
 from django.utils import timezone
-from datetime import timedelta
-import uuid
+from datetime import datetime, timedelta
+
+
+class RoomManager(models.Manager):
+    """
+    Default manager: rooms that haven't been deleted (tombstoned).
+    Room.all_objects includes tombstoned rooms still waiting to be purged.
+    """
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
 
 
 class Room(models.Model):
     """
     Represents a study room where users can join, chat, and video call.
+    Deleting a room with tombstone() hides it at once; rooms.purge then
+    removes its history in small batches and finally the row itself.
     """
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
@@ -21,15 +32,23 @@ class Room(models.Model):
     last_activity = models.DateTimeField(default=timezone.now)  # Track last activity in room
     expires_at = models.DateTimeField(null=True, blank=True)  # When room will expire if empty
     is_public = models.BooleanField(default=True)  # Whether room is visible in public listing
+    deleted_at = models.DateTimeField(null=True, blank=True)  # Tombstone, set when deleted
+    active_member_count = models.PositiveIntegerField(default=0)  # Kept in step with RoomMembership.is_active
+    max_members = models.PositiveSmallIntegerField(
+        null=True, blank=True, validators=[MinValueValidator(1)]
+    )  # Users allowed in at once; more wait in a queue (see rooms.admission)
+    
+    objects = RoomManager()
+    all_objects = models.Manager()
     
     def save(self, *args, **kwargs):
         """
         Override save to generate a unique room code if not exists.
-        Room code is a 6-character unique identifier.
+        Room code is a 7-character unique identifier (see rooms.codes).
         """
         if not self.room_code:
-            # Generate a unique 6-character room code
-            self.room_code = str(uuid.uuid4())[:6].upper()
+            from .codes import room_codes
+            self.room_code = room_codes.allocate()
         super().save(*args, **kwargs)
     
     def __str__(self):
@@ -38,6 +57,7 @@ class Room(models.Model):
     def get_member_count(self):
         """
         Returns the count of active members in this room
+        (counted now; active_member_count is the stored copy)
         """
         return self.memberships.filter(is_active=True).count()
     
@@ -45,7 +65,7 @@ class Room(models.Model):
         """
         Check if room has no active members
         """
-        return self.get_member_count() == 0
+        return not self.memberships.filter(is_active=True).exists()
     
     def is_expired(self):
         """
@@ -55,10 +75,24 @@ class Room(models.Model):
             return False
         return timezone.now() >= self.expires_at
     
+    def tombstone(self):
+        """
+        Delete the room: it disappears from listings and lookups now, and
+        the background purger (rooms.purge) removes its data in batches.
+        """
+        self.deleted_at = timezone.now()
+        self.expires_at = None
+        Room.all_objects.filter(id=self.id).update(deleted_at=self.deleted_at, expires_at=None)
+        
+        from .expiry import expiry_scheduler
+        expiry_scheduler.cancel([self.id])
+    
     def update_activity(self):
         """
         Update last activity time and clear expiration if room has members.
         Global room (room_code='GLOBAL') never expires.
+        This writes immediately; request and WebSocket paths use
+        rooms.activity.activity_tracker, which batches the writes.
         """
         self.last_activity = timezone.now()
         
@@ -71,9 +105,69 @@ class Room(models.Model):
             # Set expiration for 15 minutes from now if room is empty
             self.expires_at = timezone.now() + timedelta(minutes=15)
         self.save(update_fields=['last_activity', 'expires_at'])
+        
+        # Delete the room at exactly that time (see rooms.expiry; outside the
+        # worker process this does nothing and the worker reads it from the DB)
+        from .expiry import expiry_scheduler
+        if self.expires_at and self.room_code != 'GLOBAL':
+            expiry_scheduler.schedule([self.id], self.expires_at)
+        else:
+            expiry_scheduler.cancel([self.id])
     
     class Meta:
         ordering = ['-created_at']  # Newest rooms first
+        indexes = [
+            # Tombstoned rooms waiting for the purger (only those, so the
+            # planner never prefers it for live-room queries)
+            models.Index(
+                fields=['deleted_at'], name='room_tombstone_idx',
+                condition=models.Q(deleted_at__isnull=False),
+            ),
+            # Public room directory pages (see rooms.directory)
+            models.Index(
+                fields=['-last_activity', '-id'], name='room_directory_activity_idx',
+                condition=models.Q(is_public=True, deleted_at__isnull=True),
+            ),
+            models.Index(
+                fields=['-active_member_count', '-id'], name='room_directory_members_idx',
+                condition=models.Q(is_public=True, deleted_at__isnull=True),
+            ),
+        ]
+
+
+class RoomCodeSequence(models.Model):
+    """
+    Single row holding the room code counter and the key of the permutation
+    that turns counter values into codes (see rooms.codes). The key is made
+    once, with the row, and must never change.
+    """
+    next_value = models.BigIntegerField(default=0)
+    key = models.CharField(max_length=64)
+    
+    def __str__(self):
+        return f"Room code sequence at {self.next_value}"
+
+
+class RoomMembershipManager(models.Manager):
+    def ensure(self, user, room):
+        """
+        Make sure `user` is a member of `room` with a single
+        INSERT ... ON CONFLICT DO NOTHING (atomic on its own, no SELECT first).
+        Returns True if the membership was created. New memberships start
+        inactive (presence activates them), so no signals are needed.
+        """
+        connection = connections[self.db]
+        if not connection.features.can_return_columns_from_insert:
+            return self.get_or_create(user=user, room=room, defaults={'is_active': False})[1]
+        
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {quote(self.model._meta.db_table)} (user_id, room_id, joined_at, is_active) "
+                f"VALUES (%s, %s, %s, %s) ON CONFLICT (user_id, room_id) DO NOTHING RETURNING id",
+                [user.id, room.id, connection.ops.adapt_datetimefield_value(timezone.now()), False],
+            )
+            return cursor.fetchone() is not None
 
 
 class RoomMembership(models.Model):
@@ -85,6 +179,9 @@ class RoomMembership(models.Model):
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='memberships')
     joined_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)  # Whether user is currently in the room
+    presence_worker = models.CharField(max_length=32, null=True, blank=True)  # Process whose presence set is_active
+    
+    objects = RoomMembershipManager()
     
     def __str__(self):
         return f"{self.user.username} in {self.room.name}"
@@ -94,3 +191,100 @@ class RoomMembership(models.Model):
         unique_together = ['user', 'room']
         ordering = ['-joined_at']
 
+
+class PresenceWorker(models.Model):
+    """
+    Heartbeat of a process tracking WebSocket presence, written at every
+    presence sweep. Memberships kept active by a process that stops
+    beating are cleared by the background worker (see rooms.presence).
+    """
+    worker_id = models.CharField(max_length=32, primary_key=True)
+    last_seen = models.DateTimeField()
+    
+    def __str__(self):
+        return f"Presence worker {self.worker_id}"
+
+
+class ChatMessage(models.Model):
+    """
+    A chat message sent in a room over the WebSocket.
+    Messages are written in batches by rooms.chat_buffer, so created_at is
+    stamped when the message is received rather than when the row is inserted.
+    """
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='messages')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_messages')
+    message = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+    shard = models.PositiveSmallIntegerField(null=True, blank=True)  # Global room table (see rooms.shards)
+    
+    def __str__(self):
+        return f"{self.user.username} in {self.room.name}: {self.message[:50]}"
+    
+    def to_dict(self):
+        """
+        Returns the message in the same shape as a live 'chat' WebSocket frame.
+        """
+        return {
+            'id': self.id,
+            'message': self.message,
+            'username': self.user.username,
+            'user_id': self.user_id,
+            'timestamp': self.created_at.isoformat(),
+        }
+    
+    def get_cursor(self):
+        """
+        Returns an opaque keyset cursor pointing at this message.
+        """
+        return f"{self.created_at.isoformat()}|{self.id}"
+    
+    @classmethod
+    def get_history(cls, room_id, limit, before=None, shard=None):
+        """
+        Get up to `limit` messages of a room, oldest first. For a table of
+        the global room, pass its `shard` (see rooms.shards.message_shard).
+        
+        Pages backward with a keyset cursor on (created_at, id) instead of
+        OFFSET, so every page is one range scan of the
+        (room, shard, created_at, id) index no matter how long the room's
+        history is.
+        
+        Returns (messages, cursor) where cursor points at the oldest message
+        returned, or is None if there is nothing older.
+        """
+        messages = cls.objects.filter(room_id=room_id, shard=shard)
+        
+        if before:
+            created_at, message_id = cls.parse_cursor(before)
+            messages = messages.filter(
+                created_at__lte=created_at
+            ).exclude(
+                created_at=created_at, id__gte=message_id
+            )
+        
+        # Fetch one extra row to know if there is an older page
+        page = list(
+            messages.select_related('user').order_by('-created_at', '-id')[:limit + 1]
+        )
+        has_more = len(page) > limit
+        page = page[:limit]
+        page.reverse()
+        
+        cursor = page[0].get_cursor() if has_more else None
+        return page, cursor
+    
+    @staticmethod
+    def parse_cursor(cursor):
+        """
+        Turn a cursor from get_cursor() back into (created_at, id).
+        Raises ValueError if the cursor is malformed.
+        """
+        created_at, message_id = str(cursor).rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(message_id)
+    
+    class Meta:
+        ordering = ['created_at']  # Oldest messages first, like a chat log
+        indexes = [
+            # Serves history backfill and keyset paging per room (and table)
+            models.Index(fields=['room', 'shard', 'created_at', 'id'], name='chatmsg_room_shard_created_idx'),
+        ]
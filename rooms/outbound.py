@@ -0,0 +1,146 @@
+"""
+Bounded outbound queue for WebSocket clients.
+Frames for a client are queued and written by a separate task, so a slow
+reader never holds up the consumer.
+
+How far behind a client is can't be read from the write alone: Daphne
+(Twisted) accepts every write at once and buffers it without limit. So
+clients acknowledge the room event sequence numbers they have handled
+('ack' frames, see static/js/chat.js), and the backlog is the frames still
+queued plus the sequenced frames written but not yet acknowledged. A client
+that has never acknowledged anything (an older script) is only bounded by
+the queue, which under Daphne means not at all.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# How often each slow-consumer policy fired, for all clients in this process
+outbound_stats = Counter()
+
+# Close code telling the client it was dropped and must do a full resync
+CLOSE_CODE_RESYNC = 4000
+
+
+class OutboundQueue:
+    """
+    Per-connection queue of frames waiting to be written to the socket.
+
+    Policies:
+    - Frames with a coalesce key (presence, join/leave) keep only the latest
+      state per key: an older queued frame for the same key is replaced by a
+      tiny 'skip' marker, so sequence numbers stay contiguous for the client.
+    - Once the backlog reaches max_size the client is over the limit. If it
+      is still over after grace_ms, or the backlog doubles, put() returns
+      False and the caller should drop the client.
+    """
+
+    def __init__(self, write, max_size=None, grace_ms=None):
+        self.write = write  # Coroutine function that sends one text frame
+        self.max_size = max_size or getattr(settings, 'OUTBOUND_QUEUE_SIZE', 100)
+        self.grace_ms = grace_ms or getattr(settings, 'OUTBOUND_QUEUE_GRACE_MS', 2000)
+        self.entries = deque()  # [text, coalesce_key, seq] lists, oldest first
+        self.latest = {}  # coalesce_key -> queued entry holding its latest state
+        self.unacked = deque()  # Sequence numbers written but not acknowledged, oldest first
+        self.acking = False  # Set by the client's first ack
+        self.overflow_since = None
+        self.ready = asyncio.Event()
+        self.task = None
+        self.closed = False
+
+    def start(self):
+        """
+        Start the task that writes queued frames.
+        """
+        self.task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        """
+        Stop writing and forget anything still queued.
+        """
+        self.closed = True
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.entries.clear()
+        self.latest.clear()
+        self.unacked.clear()
+
+    @property
+    def backlog(self):
+        """
+        Frames the client hasn't handled yet, as far as we can tell.
+        """
+        return len(self.entries) + len(self.unacked)
+
+    def ack(self, seq):
+        """
+        The client has handled every room event up to `seq`.
+        """
+        self.acking = True
+        while self.unacked and self.unacked[0] <= seq:
+            self.unacked.popleft()
+        if self.backlog < self.max_size:
+            self.overflow_since = None
+
+    def put(self, text, coalesce_key=None, seq=None):
+        """
+        Queue a frame for the client.
+        Returns False if the client has stayed over the limit and must be dropped.
+        """
+        if self.closed:
+            return True  # Connection is going away; nothing more to send
+
+        if coalesce_key is not None:
+            previous = self.latest.get(coalesce_key)
+            if previous is not None:
+                previous[0] = f'{{"type": "skip", "seq": {previous[2]}}}'
+                previous[1] = None
+                outbound_stats['coalesced'] += 1
+
+        backlog = self.backlog
+        if backlog >= self.max_size:
+            now = time.monotonic()
+            if self.overflow_since is None:
+                self.overflow_since = now
+                outbound_stats['over_limit'] += 1
+            elif (now - self.overflow_since) * 1000 > self.grace_ms or backlog >= 2 * self.max_size:
+                return False
+
+        entry = [text, coalesce_key, seq]
+        self.entries.append(entry)
+        if coalesce_key is not None:
+            self.latest[coalesce_key] = entry
+        self.ready.set()
+        return True
+
+    async def _run(self):
+        while True:
+            if not self.entries:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+
+            text, coalesce_key, seq = entry = self.entries.popleft()
+            if coalesce_key is not None and self.latest.get(coalesce_key) is entry:
+                del self.latest[coalesce_key]
+
+            if seq is not None and self.acking:
+                if self.unacked and seq <= self.unacked[-1]:
+                    self.unacked.clear()  # The room's event log started over
+                self.unacked.append(seq)
+
+            if self.backlog < self.max_size:
+                self.overflow_since = None
+
+            try:
+                await self.write(text)
+            except Exception as e:
+                logger.error(f"Failed to write WebSocket frame: {str(e)}")
+                return
+            outbound_stats['sent'] += 1
@@ -0,0 +1,51 @@
+"""
+Per-room registry of connected WebRTC peers.
+Lets the chat consumer address signaling frames to one peer's channel
+instead of broadcasting them to the whole room group.
+"""
+
+
+class PeerRegistry:
+    """
+    Maps room code -> {channel_name: username} for open WebSocket connections.
+    The channel name doubles as the peer id clients use to address each other.
+    """
+
+    def __init__(self):
+        self.rooms = {}
+
+    def add(self, room_code, channel_name, username):
+        """
+        Register a connection as a peer in a room.
+        """
+        self.rooms.setdefault(room_code, {})[channel_name] = username
+
+    def remove(self, room_code, channel_name):
+        """
+        Forget a connection. Empty rooms are dropped so the registry doesn't grow.
+        """
+        peers = self.rooms.get(room_code)
+        if peers is None:
+            return
+        peers.pop(channel_name, None)
+        if not peers:
+            del self.rooms[room_code]
+
+    def is_peer(self, room_code, channel_name):
+        """
+        Check if a channel belongs to a peer in this room.
+        """
+        return channel_name in self.rooms.get(room_code, {})
+
+    def get_peers(self, room_code, exclude=None):
+        """
+        Returns the channel names of all peers in a room, except `exclude`.
+        """
+        return [
+            channel_name for channel_name in self.rooms.get(room_code, {})
+            if channel_name != exclude
+        ]
+
+
+# Shared registry used by all consumers in this process
+peer_registry = PeerRegistry()
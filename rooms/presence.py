@@ -0,0 +1,325 @@
+"""
+In-memory room presence.
+Tracks who is connected to each room from the WebSocket connections
+themselves, so member counts and lists need no database query.
+Clients get the member list once on connect and then only versioned
+user_join / user_leave deltas. RoomMembership.is_active is brought in line
+with it in periodic bulk updates.
+
+Several processes may serve the same room, so each one only changes the
+memberships it activated itself (RoomMembership.presence_worker) and
+records a heartbeat at every sweep. Memberships of a process that stopped,
+or of a previous run, are cleared by clear_stale_presence() in the
+background worker.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+
+from .activity import activity_tracker
+from .room_events import broadcast_to_room
+
+logger = logging.getLogger(__name__)
+
+
+class RoomPresence:
+    """
+    Who is in one room: user id -> {'username', 'avatar', 'connections'},
+    where connections maps channel name -> time of last activity. A user with
+    several tabs open counts once and leaves when the last tab closes.
+    `version` goes up with every join or leave, so clients can tell which
+    deltas are newer than the member list they have.
+    """
+
+    def __init__(self, room_id):
+        self.room_id = room_id
+        self.users = {}
+        self.version = 0
+
+
+class PresenceRegistry:
+    """
+    Presence of every room with open connections in this process.
+
+    Connections are added on connect, removed on disconnect, and expired when
+    nothing has been received from them for PRESENCE_TIMEOUT_SECONDS (clients
+    send a heartbeat). A background sweep handles the expiry and writes the
+    changed rooms' is_active flags every PRESENCE_SWEEP_SECONDS, under this
+    process's worker_id.
+    """
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.rooms = {}
+        self.dirty = {}  # room_id -> room_code of rooms changed since the last sweep
+        self.registered = False  # Heartbeat written at least once
+        self.task = None
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'PRESENCE_TIMEOUT_SECONDS', 60)
+
+    @property
+    def sweep_interval(self):
+        return getattr(settings, 'PRESENCE_SWEEP_SECONDS', 10)
+
+    def connect(self, room_code, room_id, channel_name, user_id, username, avatar=None):
+        """
+        Add a connection. Returns the user_join frame to broadcast if the
+        user wasn't in the room before, else None.
+        """
+        room = self.rooms.get(room_code)
+        if room is None:
+            room = self.rooms[room_code] = RoomPresence(room_id)
+
+        entry = room.users.get(user_id)
+        frame = None
+        if entry is None:
+            entry = room.users[user_id] = {'username': username, 'avatar': avatar, 'connections': {}}
+            room.version += 1
+            self.dirty[room_id] = room_code
+            frame = {
+                'type': 'user_join',
+                'user_id': user_id,
+                'username': username,
+                'avatar': avatar,
+                'version': room.version,
+            }
+        entry['connections'][channel_name] = time.monotonic()
+
+        self.start_sweeper()
+        return frame
+
+    def disconnect(self, room_code, channel_name, user_id):
+        """
+        Remove a connection. Returns the user_leave frame to broadcast if it
+        was the user's last connection in the room, else None.
+        """
+        room = self.rooms.get(room_code)
+        entry = room.users.get(user_id) if room else None
+        if entry is None or entry['connections'].pop(channel_name, None) is None:
+            return None
+        if entry['connections']:
+            return None
+
+        del room.users[user_id]
+        room.version += 1
+        self.dirty[room.room_id] = room_code
+        if not room.users:
+            del self.rooms[room_code]
+        return {
+            'type': 'user_leave',
+            'user_id': user_id,
+            'username': entry['username'],
+            'version': room.version,
+        }
+
+    def touch(self, room_code, channel_name, user_id):
+        """
+        Record activity (any frame, including heartbeats) on a connection.
+        """
+        room = self.rooms.get(room_code)
+        entry = room.users.get(user_id) if room else None
+        if entry is not None and channel_name in entry['connections']:
+            entry['connections'][channel_name] = time.monotonic()
+
+    def count(self, room_code):
+        """
+        Returns the number of users in a room.
+        """
+        room = self.rooms.get(room_code)
+        return len(room.users) if room else 0
+
+    def members(self, room_code):
+        """
+        Returns {user_id: username} for everyone in a room.
+        """
+        room = self.rooms.get(room_code)
+        if room is None:
+            return {}
+        return {user_id: entry['username'] for user_id, entry in room.users.items()}
+
+    def snapshot(self, room_code):
+        """
+        Returns the full member list frame sent to a client on connect.
+        """
+        room = self.rooms.get(room_code)
+        if room is None:
+            return {'type': 'members', 'version': 0, 'members': []}
+        return {
+            'type': 'members',
+            'version': room.version,
+            'members': [
+                {'user_id': user_id, 'username': entry['username'], 'avatar': entry['avatar']}
+                for user_id, entry in room.users.items()
+            ],
+        }
+
+    def is_present(self, room_code, user_id):
+        room = self.rooms.get(room_code)
+        return room is not None and user_id in room.users
+
+    def expire(self):
+        """
+        Remove connections silent for longer than the timeout.
+        Returns (room_code, channel_name, username, leave_frame) for each,
+        where leave_frame is None unless it was the user's last connection.
+        """
+        cutoff = time.monotonic() - self.timeout
+        expired = []
+        for room_code, room in list(self.rooms.items()):
+            for user_id, entry in list(room.users.items()):
+                for channel_name, last_seen in list(entry['connections'].items()):
+                    if last_seen < cutoff:
+                        frame = self.disconnect(room_code, channel_name, user_id)
+                        expired.append((room_code, channel_name, entry['username'], frame))
+        return expired
+
+    def present_users(self, room_ids):
+        """
+        Returns {room_id: [user ids present]} for the given rooms. One Room
+        can be split over several room codes (the tables of the global room,
+        see rooms.shards). Runs on the event loop, which is the only place
+        self.rooms changes.
+        """
+        present_by_room = {room_id: set() for room_id in room_ids if room_id is not None}
+        for room in self.rooms.values():
+            if room.room_id in present_by_room:
+                present_by_room[room.room_id].update(room.users)
+        return {room_id: list(users) for room_id, users in present_by_room.items()}
+
+    @staticmethod
+    def reconcile(worker_id, present_by_room):
+        """
+        Record this process's heartbeat, then set RoomMembership.is_active
+        for every room in `present_by_room`: the users listed become active
+        and owned by `worker_id`; memberships owned by `worker_id` for users
+        no longer listed become inactive. Other processes' memberships are
+        left alone. Adjusts the rooms' stored member counts by the
+        difference; their last_activity / expires_at follow in the activity
+        tracker's next flush.
+
+        Returns True if the heartbeat had to be created, i.e. this process
+        was unknown or had been given up for gone. Runs in a worker thread,
+        so it only gets plain data, never the live registry.
+        """
+        from .directory import adjust_member_count
+        from .models import PresenceWorker, RoomMembership
+
+        _, created = PresenceWorker.objects.update_or_create(
+            worker_id=worker_id, defaults={'last_seen': timezone.now()}
+        )
+
+        for room_id, present in present_by_room.items():
+            left = RoomMembership.objects.filter(
+                room_id=room_id, is_active=True, presence_worker=worker_id
+            ).exclude(user_id__in=present).update(is_active=False)
+            joined = 0
+            if present:
+                joined = RoomMembership.objects.filter(
+                    room_id=room_id, user_id__in=present, is_active=False
+                ).update(is_active=True, presence_worker=worker_id)
+                # Users also connected to another process: take the rows
+                # over, so that process leaving doesn't deactivate them
+                RoomMembership.objects.filter(
+                    room_id=room_id, user_id__in=present, is_active=True
+                ).exclude(presence_worker=worker_id).update(presence_worker=worker_id)
+            adjust_member_count(room_id, joined - left)
+            activity_tracker.touch(room_id, occupied=bool(present))
+        return created
+
+    def start_sweeper(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        # Runs while there is presence to watch or write; restarted on connect
+        while self.rooms or self.dirty:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Presence sweep failed: {str(e)}")
+
+    async def sweep(self):
+        """
+        Expire silent connections, tell their consumers to close, announce
+        users who left that way, and write changed rooms and this process's
+        heartbeat to the database.
+        """
+        from .admission import admission
+
+        channel_layer = get_channel_layer()
+        freed = []  # Rooms where a user's last connection timed out
+        for room_code, channel_name, username, frame in self.expire():
+            logger.info(f"Presence timeout for {username} in room {room_code}")
+            await channel_layer.send(channel_name, {'type': 'presence_timeout'})
+            # frame is None for a timed-out tab of a user still in the room,
+            # which frees no seat
+            if frame is not None:
+                await broadcast_to_room(room_code, frame, coalesce_key=f'presence:{username}')
+                if room_code not in freed:
+                    freed.append(room_code)
+        for room_code in freed:
+            await admission.release(room_code)
+
+        dirty, self.dirty = self.dirty, {}
+        try:
+            created = await database_sync_to_async(self.reconcile)(
+                self.worker_id, self.present_users(set(dirty))
+            )
+        except Exception:
+            # Write these rooms again at the next sweep
+            for room_id, room_code in dirty.items():
+                self.dirty.setdefault(room_id, room_code)
+            raise
+        if created and self.registered:
+            # Our memberships may have been cleared as stale: write them all again
+            for room_code, room in self.rooms.items():
+                self.dirty.setdefault(room.room_id, room_code)
+        self.registered = True
+
+
+def clear_stale_presence():
+    """
+    Deactivate memberships left active by processes that stopped sending
+    presence heartbeats (crashed, or a previous run of the server), and
+    memberships activated by no process at all. Run periodically by the
+    background worker; never by a web process, which can't tell another
+    process's rooms from stale ones.
+    """
+    from .directory import adjust_member_count
+    from .models import PresenceWorker, RoomMembership
+
+    cutoff = timezone.now() - timedelta(seconds=3 * presence.timeout)
+    PresenceWorker.objects.filter(last_seen__lt=cutoff).delete()
+
+    live = PresenceWorker.objects.values('worker_id')
+    stale = list(
+        RoomMembership.objects.filter(is_active=True)
+        .exclude(presence_worker__in=live)
+        .values_list('id', 'room_id')
+    )
+    if not stale:
+        return 0
+
+    logger.info(f"Clearing {len(stale)} stale room membership(s)")
+    RoomMembership.objects.filter(id__in=[row_id for row_id, _ in stale], is_active=True).update(
+        is_active=False, presence_worker=None
+    )
+    for room_id, count in Counter(room_id for _, room_id in stale).items():
+        adjust_member_count(room_id, -count)
+        activity_tracker.touch(room_id)
+    return len(stale)
+
+
+# Shared presence for all consumers and views in this process
+presence = PresenceRegistry()
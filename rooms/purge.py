@@ -0,0 +1,112 @@
+"""
+Background purge of deleted (tombstoned) rooms.
+Deleting a room row directly cascades to all its memberships and chat
+history and unlinks its study sessions in one transaction, which keeps
+SQLite write-locked for as long as a big room takes. Instead, rooms are
+tombstoned (Room.tombstone(), and in bulk by rooms.cleanup and
+rooms.expiry) and this purger removes their data a batch
+at a time, each batch in its own short transaction, and the row last.
+Runs from the worker's scheduler and `manage.py purge_rooms`.
+"""
+from django.conf import settings
+from django.db import transaction
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def purge_steps(room_id):
+    """
+    Querysets to empty before a room row can go, in order: study sessions
+    are unlinked (SET_NULL), everything else is deleted. Memberships are
+    deleted without signals: the room is gone, so there is no member count
+    or activity left to update.
+    """
+    from accounts.models import UserProfile
+    from tracker.models import StudySession
+    from .models import ChatMessage, RoomMembership
+
+    return [
+        ('sessions', StudySession.objects.filter(room_id=room_id), 'detach'),
+        ('favorites', UserProfile.favorite_rooms.through.objects.filter(room_id=room_id), 'delete'),
+        ('memberships', RoomMembership.objects.filter(room_id=room_id), 'raw_delete'),
+        ('messages', ChatMessage.objects.filter(room_id=room_id), 'delete'),
+    ]
+
+
+def purge_room(room_id, batch_size=None):
+    """
+    Remove one tombstoned room: its related rows batch by batch, then the room.
+
+    Returns metrics: rows per step, total rows, batches, seconds, rows per
+    second, and the longest and average time spent inside a write
+    transaction (how long other writers could have been blocked).
+    """
+    from .models import Room
+
+    batch_size = batch_size or getattr(settings, 'ROOM_PURGE_BATCH_SIZE', 1000)
+    start = time.perf_counter()
+    lock_times = []
+    rows = {}
+
+    for name, queryset, action in purge_steps(room_id):
+        rows[name] = 0
+        while True:
+            ids = list(queryset.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            began = time.perf_counter()
+            with transaction.atomic():
+                batch = queryset.model.objects.filter(id__in=ids)
+                if action == 'detach':
+                    count = batch.update(room=None)
+                elif action == 'raw_delete':
+                    count = batch._raw_delete(batch.db)
+                else:
+                    count = batch.delete()[0]
+            lock_times.append(time.perf_counter() - began)
+            rows[name] += count
+
+    # Nothing points at the room any more, so this is a single-row delete
+    began = time.perf_counter()
+    with transaction.atomic():
+        rows['room'] = Room.all_objects.filter(id=room_id, deleted_at__isnull=False).delete()[0]
+    lock_times.append(time.perf_counter() - began)
+
+    seconds = time.perf_counter() - start
+    total = sum(rows.values())
+    return {
+        'room_id': room_id,
+        'rows': rows,
+        'total_rows': total,
+        'batches': len(lock_times),
+        'seconds': seconds,
+        'rows_per_second': total / seconds if seconds else 0,
+        'max_lock_ms': max(lock_times) * 1000,
+        'avg_lock_ms': sum(lock_times) / len(lock_times) * 1000,
+    }
+
+
+def purge_tombstoned_rooms(batch_size=None, limit=None):
+    """
+    Purge every tombstoned room (oldest deletion first).
+    Returns the metrics of each purged room.
+    """
+    from .models import Room
+
+    room_ids = Room.all_objects.filter(deleted_at__isnull=False).order_by('deleted_at').values_list('id', flat=True)
+    if limit:
+        room_ids = room_ids[:limit]
+
+    results = []
+    for room_id in list(room_ids):
+        try:
+            metrics = purge_room(room_id, batch_size)
+        except Exception as e:
+            logger.error(f"Failed to purge room {room_id}: {str(e)}")
+            continue
+        logger.info(f"Purged room {room_id}: {metrics['total_rows']} rows in {metrics['batches']} batches, "
+                    f"{metrics['rows_per_second']:.0f} rows/s, longest lock {metrics['max_lock_ms']:.1f}ms")
+        results.append(metrics)
+    return results
@@ -0,0 +1,118 @@
+"""
+Sequenced room event log.
+Every frame broadcast to a room gets a per-room sequence number and is kept
+in a bounded ring buffer, so a reconnecting client can ask for just the
+events it missed instead of reloading everything.
+"""
+import json
+import uuid
+from collections import deque
+from itertools import islice
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+
+class RoomEventLog:
+    """
+    Sequence counter and ring buffer of recent events for one room.
+    The epoch changes whenever the log is recreated (e.g. after a restart),
+    which tells clients their old sequence numbers no longer apply.
+    """
+
+    def __init__(self, size):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.events = deque(maxlen=size)  # (seq, text) pairs, oldest first
+
+    def record(self, frame):
+        """
+        Give a frame the next sequence number and serialize it.
+        Returns the JSON text to send.
+        """
+        self.seq += 1
+        text = json.dumps({**frame, 'seq': self.seq})
+        self.events.append((self.seq, text))
+        return text
+
+    def since(self, seq):
+        """
+        Returns the texts of all events after `seq`, or None if some of them
+        have already dropped out of the buffer.
+        """
+        if seq == self.seq:
+            return []
+        if seq > self.seq or not self.events or self.events[0][0] > seq + 1:
+            return None
+        start = seq + 1 - self.events[0][0]
+        return [text for _, text in islice(self.events, start, None)]
+
+
+class RoomEventRegistry:
+    """
+    Event logs of every active room in this process.
+    """
+
+    def __init__(self):
+        self.logs = {}
+
+    def get_log(self, room_code):
+        log = self.logs.get(room_code)
+        if log is None:
+            log = RoomEventLog(getattr(settings, 'ROOM_EVENT_BUFFER_SIZE', 200))
+            self.logs[room_code] = log
+        return log
+
+    def get_position(self, room_code):
+        """
+        Returns (epoch, seq) of the latest event, to include in snapshots.
+        """
+        log = self.get_log(room_code)
+        return log.epoch, log.seq
+
+    def get_replay(self, room_code, epoch, seq):
+        """
+        Returns one 'replay' frame holding the events after `seq`,
+        or None if the client needs a full snapshot instead.
+        """
+        log = self.logs.get(room_code)
+        if log is None or log.epoch != epoch:
+            return None
+
+        texts = log.since(seq)
+        if texts is None:
+            return None
+
+        # Events are already JSON, so join them instead of encoding again
+        return (
+            f'{{"type": "replay", "epoch": {json.dumps(log.epoch)}, "seq": {log.seq}, '
+            f'"events": [{", ".join(texts)}]}}'
+        )
+
+    def discard(self, room_code):
+        """
+        Drop a room's log, e.g. when its last connection closes.
+        """
+        self.logs.pop(room_code, None)
+
+
+# Shared event logs for all consumers in this process
+room_events = RoomEventRegistry()
+
+
+async def broadcast_to_room(room_code, frame, coalesce_key=None):
+    """
+    Send a frame to everyone in a room.
+    The frame gets its sequence number and is serialized once here; each
+    member forwards the same text (see ChatConsumer.broadcast).
+    Frames with the same coalesce_key replace each other in the queue of a
+    client that is falling behind (see rooms.outbound).
+    """
+    log = room_events.get_log(room_code)
+    text = log.record(frame)
+    await get_channel_layer().group_send(f'chat_{room_code}', {
+        'type': 'broadcast',
+        'text': text,
+        'seq': log.seq,
+        'coalesce_key': coalesce_key,
+    })
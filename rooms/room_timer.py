@@ -0,0 +1,203 @@
+"""
+Shared Pomodoro timer for rooms.
+Keeps one server-side timer per room. Only phase changes are broadcast;
+clients count down locally from the start time and duration they receive.
+"""
+import asyncio
+import time
+
+from .room_events import broadcast_to_room
+
+
+class RoomTimer:
+    """
+    Timer state machine for one room.
+
+    phase:  'focus' or 'break'
+    status: 'stopped' (not started), 'running' or 'paused'
+
+    While running, the time left is duration - (now - started_at).
+    While stopped or paused it is kept in `remaining`.
+    """
+
+    def __init__(self, focus_minutes=25, break_minutes=5):
+        self.focus_minutes = focus_minutes
+        self.break_minutes = break_minutes
+        self.phase = 'focus'
+        self.status = 'stopped'
+        self.started_at = None
+        self.duration = focus_minutes * 60
+        self.remaining = self.duration
+
+    def start(self, now, focus_minutes=None, break_minutes=None):
+        """
+        Start a new focus phase, optionally with new lengths.
+        """
+        if focus_minutes:
+            self.focus_minutes = focus_minutes
+        if break_minutes:
+            self.break_minutes = break_minutes
+        self._begin('focus', now)
+
+    def pause(self, now):
+        """
+        Pause a running phase, keeping the time left.
+        """
+        if self.status != 'running':
+            return False
+        self.remaining = self.seconds_left(now)
+        self.status = 'paused'
+        self.started_at = None
+        return True
+
+    def resume(self, now):
+        """
+        Continue a paused phase from where it stopped.
+        """
+        if self.status != 'paused':
+            return False
+        # Shift the start so duration - (now - started_at) == remaining
+        self.started_at = now - (self.duration - self.remaining)
+        self.status = 'running'
+        return True
+
+    def reset(self):
+        """
+        Stop the timer and go back to the start of a focus phase.
+        """
+        self.phase = 'focus'
+        self.status = 'stopped'
+        self.started_at = None
+        self.duration = self.focus_minutes * 60
+        self.remaining = self.duration
+
+    def advance(self, now):
+        """
+        Move to the next phase when the current one ends.
+        A finished focus phase starts the break straight away;
+        a finished break waits for someone to start the next focus phase.
+        """
+        if self.phase == 'focus':
+            self._begin('break', now)
+        else:
+            self.reset()
+
+    def seconds_left(self, now):
+        """
+        Returns the seconds left in the current phase.
+        """
+        if self.status == 'running':
+            return max(0, self.duration - (now - self.started_at))
+        return self.remaining
+
+    def snapshot(self, now):
+        """
+        Returns the timer state to send to clients.
+        Times are epoch milliseconds so browsers can use them directly.
+        """
+        return {
+            'phase': self.phase,
+            'status': self.status,
+            'duration': self.duration,
+            'remaining': round(self.seconds_left(now), 3),
+            'started_at': int(self.started_at * 1000) if self.started_at else None,
+            'server_time': int(now * 1000),
+            'focus_minutes': self.focus_minutes,
+            'break_minutes': self.break_minutes,
+        }
+
+    def _begin(self, phase, now):
+        minutes = self.focus_minutes if phase == 'focus' else self.break_minutes
+        self.phase = phase
+        self.status = 'running'
+        self.started_at = now
+        self.duration = minutes * 60
+        self.remaining = self.duration
+
+
+class RoomTimerRegistry:
+    """
+    Holds the timer of every room with open connections in this process,
+    and schedules the broadcast at the end of each running phase.
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.phase_end_handles = {}
+
+    def get_snapshot(self, room_code):
+        """
+        Returns the current timer state of a room (a stopped timer if none yet).
+        """
+        timer = self.timers.get(room_code) or RoomTimer()
+        return timer.snapshot(time.time())
+
+    def apply(self, room_code, action, focus_minutes=None, break_minutes=None):
+        """
+        Apply a client action ('start', 'pause', 'resume' or 'reset').
+        Returns the new state, or None if the action changed nothing.
+        """
+        timer = self.timers.setdefault(room_code, RoomTimer())
+        now = time.time()
+
+        if action == 'start':
+            timer.start(now, focus_minutes, break_minutes)
+        elif action == 'pause':
+            if not timer.pause(now):
+                return None
+        elif action == 'resume':
+            if not timer.resume(now):
+                return None
+        elif action == 'reset':
+            timer.reset()
+        else:
+            return None
+
+        self._schedule_phase_end(room_code, timer)
+        return timer.snapshot(now)
+
+    def discard(self, room_code):
+        """
+        Drop a room's timer, e.g. when its last connection closes.
+        """
+        self.timers.pop(room_code, None)
+        handle = self.phase_end_handles.pop(room_code, None)
+        if handle is not None:
+            handle.cancel()
+
+    def _schedule_phase_end(self, room_code, timer):
+        handle = self.phase_end_handles.pop(room_code, None)
+        if handle is not None:
+            handle.cancel()
+
+        if timer.status == 'running':
+            loop = asyncio.get_running_loop()
+            self.phase_end_handles[room_code] = loop.call_later(
+                timer.seconds_left(time.time()),
+                lambda: asyncio.ensure_future(self._end_phase(room_code))
+            )
+
+    async def _end_phase(self, room_code):
+        """
+        Advance a room's timer and tell everyone in the room.
+        """
+        self.phase_end_handles.pop(room_code, None)
+        timer = self.timers.get(room_code)
+        if timer is None:
+            return
+
+        now = time.time()
+        finished = timer.phase
+        timer.advance(now)
+        self._schedule_phase_end(room_code, timer)
+
+        await broadcast_to_room(room_code, {
+            'type': 'timer',
+            'action': 'phase',
+            'finished': finished,
+            **timer.snapshot(now),
+        })
+
+
+# Shared timers for all consumers in this process
+room_timers = RoomTimerRegistry()
@@ -1,6 +1,9 @@
 """
 Background scheduler for automatic room cleanup.
-Runs cleanup every 5 minutes to remove inactive rooms.
+Runs cleanup every 5 minutes to remove inactive rooms, purges deleted rooms
+and clears stale presence every minute, and runs the room expiry scheduler.
+Started only by `manage.py run_worker`, in the one worker that holds the
+leader lock (see rooms/leader.py), never in web processes.
 """
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
@@ -15,8 +18,8 @@ scheduler = None
 def start_scheduler():
     """
     Start the background scheduler for room cleanup.
-    Only starts in production or if DEBUG is True.
-    Prevents multiple schedulers from starting.
+    Called by run_worker once it holds the leader lock, so only one process
+    runs these jobs. Calling it again while running does nothing.
     """
     global scheduler
     
@@ -25,7 +28,6 @@ def start_scheduler():
         logger.info("Scheduler already running, skipping initialization")
         return
     
-    # Only run scheduler if not already running
     try:
         from rooms.cleanup import run_all_cleanup
         
@@ -41,20 +43,61 @@ def start_scheduler():
             max_instances=1  # Prevent overlapping executions
         )
         
+        # Purge job - removes deleted (tombstoned) rooms in small batches
+        from rooms.purge import purge_tombstoned_rooms
+        scheduler.add_job(
+            purge_tombstoned_rooms,
+            trigger=IntervalTrigger(minutes=1),
+            id='room_purge_job',
+            name='Purge deleted rooms',
+            replace_existing=True,
+            max_instances=1
+        )
+        
+        # Clear memberships left active by web processes that went away
+        from rooms.presence import clear_stale_presence
+        scheduler.add_job(
+            clear_stale_presence,
+            trigger=IntervalTrigger(minutes=1),
+            id='stale_presence_job',
+            name='Clear stale room presence',
+            replace_existing=True,
+            max_instances=1
+        )
+        
+        # Recount stored member counts, in case any drifted
+        from rooms.directory import recount_members
+        scheduler.add_job(
+            recount_members,
+            trigger=IntervalTrigger(hours=1),
+            id='room_member_recount_job',
+            name='Recount room members',
+            replace_existing=True,
+            max_instances=1
+        )
+        
         scheduler.start()
         logger.info("Room cleanup scheduler started (runs every 5 minutes)")
         
+        # Expired rooms are tombstoned right at their expires_at; the job
+        # above still catches anything another process left behind
+        from rooms.expiry import expiry_scheduler
+        expiry_scheduler.start()
+        
     except Exception as e:
         logger.error(f"Failed to start room cleanup scheduler: {str(e)}")
 
 
 def stop_scheduler():
     """
-    Stop the background scheduler.
+    Stop the background scheduler and the expiry scheduler.
     """
     global scheduler
     
     if scheduler is not None:
         scheduler.shutdown()
         scheduler = None
+
+        from rooms.expiry import expiry_scheduler
+        expiry_scheduler.stop()
         logger.info("Room cleanup scheduler stopped")
@@ -0,0 +1,128 @@
+"""
+Full-text room search.
+Rooms are indexed by name and description: in an FTS5 table on SQLite, and
+with a GIN index over a tsvector expression on PostgreSQL (both created by
+migration 0008). The SQLite index is kept in sync by triggers on the room
+table, so saves, deletes and bulk updates are all covered; PostgreSQL
+maintains its expression index itself.
+
+Every word of the query must match as a prefix ("mat stu" finds "Maths
+study group"), and matches in the name rank above matches in the
+description.
+"""
+import logging
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'rooms_room_fts'
+
+# The tsvector indexed on PostgreSQL; queries must use the same expression
+# for the GIN index to be used
+PG_DOCUMENT = (
+    "(setweight(to_tsvector('simple', coalesce(rooms_room.name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(rooms_room.description, '')), 'B'))"
+)
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Keep the SQLite index in sync with the room table. Migrations that change
+# the room table on SQLite rebuild it, which drops its triggers, so they are
+# re-created after every migrate (see ensure_sqlite_triggers)
+SQLITE_TRIGGERS = {
+    'rooms_room_fts_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS rooms_room_fts_insert AFTER INSERT ON rooms_room BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    """,
+    'rooms_room_fts_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS rooms_room_fts_delete AFTER DELETE ON rooms_room BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END
+    """,
+    'rooms_room_fts_update': f"""
+        CREATE TRIGGER IF NOT EXISTS rooms_room_fts_update AFTER UPDATE OF name, description ON rooms_room BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    """,
+}
+
+
+def query_words(text):
+    """
+    Split a search string into words, dropping punctuation and operators.
+    """
+    return WORD_RE.findall(text.lower())[:10]
+
+
+def fts5_query(words):
+    # "word"* is a prefix match on one quoted term; terms are ANDed
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def tsquery(words):
+    return ' & '.join(f'{word}:*' for word in words)
+
+
+def search_rooms(queryset, text):
+    """
+    Filter a Room queryset to rooms matching `text`, best match first.
+    Adds a `search_rank` annotation (higher is better).
+    """
+    words = query_words(text)
+    if not words:
+        # Nothing indexable (just punctuation): plain substring match
+        return queryset.filter(Q(name__icontains=text) | Q(description__icontains=text))
+
+    if connection.vendor == 'postgresql':
+        query = tsquery(words)
+        rank = RawSQL(
+            f"ts_rank({PG_DOCUMENT}, to_tsquery('simple', %s))", (query,), output_field=FloatField()
+        )
+        matches = RawSQL(
+            f"{PG_DOCUMENT} @@ to_tsquery('simple', %s)", (query,), output_field=BooleanField()
+        )
+        return queryset.filter(matches).annotate(search_rank=rank).order_by('-search_rank', '-created_at')
+
+    # Join the FTS table (rather than a subquery per room) so the match is
+    # evaluated once. Its rank column is bm25 with the name weighted 10x
+    # (set in the migration); lower is better, so negate it
+    query = fts5_query(words)
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = rooms_room.id', f'{FTS_TABLE} MATCH %s'],
+        params=[query],
+        select={'search_rank': f'-{FTS_TABLE}.rank'},
+    ).order_by('-search_rank', '-created_at')
+
+
+def ensure_sqlite_triggers(using='default', **kwargs):
+    """
+    post_migrate handler: re-create any missing sync triggers and, if some
+    were missing, rebuild the index (rooms may have changed without them).
+    """
+    from django.db import connections
+
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        tables = connection.introspection.table_names(cursor)
+        if FTS_TABLE not in tables:
+            return  # Search migration not applied (yet)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'rooms_room'")
+        existing = {row[0] for row in cursor.fetchall()}
+        missing = [name for name in SQLITE_TRIGGERS if name not in existing]
+        if not missing:
+            return
+        for name in missing:
+            cursor.execute(SQLITE_TRIGGERS[name])
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    logger.info(f"Re-created room search triggers: {', '.join(missing)}")
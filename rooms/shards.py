@@ -0,0 +1,101 @@
+"""
+GLOBAL room sharding.
+The global chat is split into tables of at most GLOBAL_SHARD_SIZE users, so
+every chat message and join/leave only goes to the users at one table.
+Table 1 is the GLOBAL room itself; once it is full, overflow tables
+(GLOBAL_2, GLOBAL_3, ...) open and new users go to the least busy one.
+Each table is a room of its own for presence, the event log, the
+channel group and chat history. Chat messages are all stored on the GLOBAL
+Room, with the table they were sent at in ChatMessage.shard.
+Only signed-in users connect, so every connection takes a seat.
+
+Announcements go to every table (see broadcast_to_all_shards). Tables are
+tracked in the process serving the global room's WebSockets, like presence.
+"""
+from django.conf import settings
+
+from .presence import presence
+from .room_events import broadcast_to_room
+
+GLOBAL_ROOM_CODE = 'GLOBAL'
+
+
+def shard_code(number):
+    """
+    Room code of a table: GLOBAL for table 1, GLOBAL_<n> after that.
+    """
+    return GLOBAL_ROOM_CODE if number == 1 else f'{GLOBAL_ROOM_CODE}_{number}'
+
+
+def message_shard(number):
+    """
+    ChatMessage.shard of messages sent at a table: None for table 1, the
+    GLOBAL room itself (so its history from before sharding stays there),
+    and for rooms that aren't sharded (number None).
+    """
+    return number if number is not None and number > 1 else None
+
+
+class ShardRouter:
+    """
+    Places users of the global room at tables.
+    """
+
+    def __init__(self):
+        self.open = {1}  # Table numbers with users (table 1 is always open)
+
+    @property
+    def shard_size(self):
+        return getattr(settings, 'GLOBAL_SHARD_SIZE', 50)
+
+    def shards(self):
+        """
+        Returns the numbers of the open tables, closing tables everyone left.
+        """
+        self.open = {n for n in self.open if n == 1 or presence.count(shard_code(n))}
+        return sorted(self.open)
+
+    def place(self, user_id=None):
+        """
+        Pick a table for a new connection; returns its number.
+        A user with another tab open stays at the same table. Otherwise the
+        least busy table with a free seat, or a new table if all are full.
+        The caller must join it (presence.connect) before awaiting anything,
+        or concurrent connections would all see the same free seat.
+        """
+        number = self.peek(user_id)
+        self.open.add(number)
+        return number
+
+    def peek(self, user_id=None):
+        """
+        The table place() would pick right now, without opening it if it is
+        a new one. For pages; only the WebSocket connect places users.
+        """
+        shards = self.shards()
+        if user_id is not None:
+            for number in shards:
+                if presence.is_present(shard_code(number), user_id):
+                    return number
+
+        loads = {number: presence.count(shard_code(number)) for number in shards}
+        free = [number for number in shards if loads[number] < self.shard_size]
+        if free:
+            return min(free, key=lambda number: (loads[number], number))
+        return next(n for n in range(1, len(shards) + 2) if n not in self.open)
+
+    def total_users(self):
+        return sum(presence.count(shard_code(number)) for number in self.shards())
+
+
+async def broadcast_to_all_shards(frame, coalesce_key=None):
+    """
+    Send a frame to every table of the global room. Each table sequences it
+    in its own event log, so reconnecting clients get it replayed as usual.
+    """
+    for number in shard_router.shards():
+        await broadcast_to_room(shard_code(number), frame, coalesce_key=coalesce_key)
+
+
+# Shared table placement for the global room in this process
+shard_router = ShardRouter()
@@ -2,29 +2,37 @@
 Signals for the rooms app.
 Handles automatic room expiration updates when members leave.
 """
+from django.db.models import QuerySet
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import RoomMembership
+from .activity import activity_tracker
+from .directory import adjust_member_count
+from .models import Room, RoomMembership
 
 
 @receiver(post_save, sender=RoomMembership)
 def update_room_on_membership_change(sender, instance, created, **kwargs):
     """
     Update room activity when membership is created or updated.
+    The write is batched by the activity tracker. A membership created
+    active adds to the room's member count.
     """
-    if instance.room:
-        instance.room.update_activity()
+    if created and instance.is_active:
+        adjust_member_count(instance.room_id, 1)
+    activity_tracker.touch(instance.room_id)
 
 
 @receiver(post_delete, sender=RoomMembership)
 def update_room_on_member_leave(sender, instance, **kwargs):
     """
     Update room activity when a member leaves (membership deleted).
-    Sets expiration if room becomes empty.
+    Sets expiration if room becomes empty. Skipped when the membership goes
+    because its room is being deleted (e.g. by the cleanup engine), so a
+    chunked delete doesn't set off activity writes for rooms that are gone.
     """
-    if instance.room:
-        try:
-            instance.room.update_activity()
-        except:
-            # Room might have been deleted
-            pass
+    origin = kwargs.get('origin')
+    if isinstance(origin, (Room, QuerySet)) and getattr(origin, 'model', type(origin)) is Room:
+        return
+    if instance.is_active:
+        adjust_member_count(instance.room_id, -1)
+    activity_tracker.touch(instance.room_id)
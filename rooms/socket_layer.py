@@ -0,0 +1,375 @@
+"""
+Channel layer for several worker processes on one machine, without Redis.
+A small broker process (python manage.py run_channel_broker) listens on a
+Unix domain socket and keeps group membership; every worker connects to it
+with SocketChannelLayer, so a group_send reaches consumers in all workers.
+
+Frames on the socket are a 4-byte big-endian length followed by JSON, so
+channel messages must be JSON-serializable (all of ours are).
+
+If the broker restarts, workers reconnect on their own and register their
+group memberships again.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import string
+import struct
+import time
+import uuid
+from collections import defaultdict, deque
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>I')
+
+
+async def read_frame(reader):
+    """
+    Read one length-prefixed JSON frame. Raises IncompleteReadError on EOF.
+    """
+    header = await reader.readexactly(HEADER.size)
+    (length,) = HEADER.unpack(header)
+    return json.loads(await reader.readexactly(length))
+
+
+def encode_frame(data):
+    body = json.dumps(data).encode()
+    return HEADER.pack(len(body)) + body
+
+
+def client_of(channel):
+    """
+    Returns the worker id owning a process-specific channel
+    ('specific.<client>!<suffix>'), or None for other channels.
+    """
+    local, bang, _ = channel.partition('!')
+    if not bang or not local.startswith('specific.'):
+        return None
+    return local[len('specific.'):]
+
+
+class SocketLayerBroker:
+    """
+    Routes messages between worker processes.
+
+    Each worker connection announces its id; channels are named after the
+    worker that owns them, so routing a message is a dict lookup. A group
+    send is written once per worker (with the list of that worker's member
+    channels), not once per channel.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.workers = {}  # worker id -> StreamWriter
+        self.groups = defaultdict(set)  # group -> channel names
+        self.handlers = set()  # One task per connected worker
+        self.server = None
+
+    async def start(self):
+        """
+        Start listening on the Unix socket (replacing a stale socket file).
+        """
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.handle_worker, path=self.path)
+        os.chmod(self.path, 0o600)  # Only this user's processes may connect
+        logger.info(f"Channel broker listening on {self.path}")
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        for task in list(self.handlers):
+            task.cancel()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+
+    async def handle_worker(self, reader, writer):
+        task = asyncio.current_task()
+        self.handlers.add(task)
+        worker_id = None
+        try:
+            hello = await read_frame(reader)
+            worker_id = hello['client']
+            self.workers[worker_id] = writer
+            writer.write(encode_frame({'op': 'welcome'}))  # Now routable
+            await writer.drain()
+
+            while True:
+                frame = await read_frame(reader)
+                op = frame['op']
+
+                if op == 'send':
+                    await self.deliver([frame['channel']], frame['message'])
+                elif op == 'group_add':
+                    self.groups[frame['group']].add(frame['channel'])
+                elif op == 'group_discard':
+                    members = self.groups.get(frame['group'])
+                    if members is not None:
+                        members.discard(frame['channel'])
+                        if not members:
+                            del self.groups[frame['group']]
+                elif op == 'group_send':
+                    members = self.groups.get(frame['group'])
+                    if members:
+                        await self.deliver(list(members), frame['message'])
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass  # Worker disconnected, or the broker is shutting down
+        finally:
+            # Unless the worker has already reconnected on a new connection
+            if worker_id is not None and self.workers.get(worker_id) is writer:
+                self.drop_worker(worker_id)
+            writer.close()
+            self.handlers.discard(task)
+
+    async def deliver(self, channels, message):
+        """
+        Forward a message to the workers owning the given channels,
+        one frame per worker. Waits for each worker's socket buffer to
+        drain, so a worker that falls behind slows down the senders (its
+        reads stop) instead of growing the broker's buffers.
+        """
+        by_worker = defaultdict(list)
+        for channel in channels:
+            by_worker[client_of(channel)].append(channel)
+
+        for worker_id, worker_channels in by_worker.items():
+            writer = self.workers.get(worker_id)
+            if writer is None:
+                continue  # Worker went away, or not a process-specific channel
+            writer.write(encode_frame({
+                'op': 'deliver',
+                'channels': worker_channels,
+                'message': message,
+            }))
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass  # Its own handler drops the worker
+
+    def drop_worker(self, worker_id):
+        """
+        Forget a disconnected worker and remove its channels from all groups,
+        so a crashed worker can't leave stale group members behind.
+        """
+        self.workers.pop(worker_id, None)
+        for group in list(self.groups):
+            members = self.groups[group]
+            members.difference_update([c for c in members if client_of(c) == worker_id])
+            if not members:
+                del self.groups[group]
+
+
+class LocalChannel:
+    """
+    Messages waiting for one of this worker's channels, oldest first,
+    each with the time it expires.
+    """
+
+    def __init__(self):
+        self.messages = deque()  # (expires, message)
+        self.receivers = 0  # receive() calls waiting on this channel
+        self.ready = asyncio.Event()
+
+    def put(self, expires, message):
+        self.messages.append((expires, message))
+        self.ready.set()
+
+    def drop_expired(self, now):
+        while self.messages and self.messages[0][0] < now:
+            self.messages.popleft()
+
+    async def get(self):
+        self.receivers += 1
+        try:
+            while not self.messages:
+                self.ready.clear()
+                await self.ready.wait()
+            return self.messages.popleft()[1]
+        finally:
+            self.receivers -= 1
+
+
+class SocketChannelLayer(BaseChannelLayer):
+    """
+    Channel layer client that talks to a SocketLayerBroker.
+
+    Messages for this worker's own channels are queued locally; everything
+    else (other workers' channels, group operations) goes through the broker.
+    Only process-specific channels are supported, which is what consumers use.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path, expiry=60, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.path = str(path)
+        self.client_id = uuid.uuid4().hex[:12]
+        self.channels = {}  # channel name -> LocalChannel
+        self.groups = defaultdict(set)  # group -> our channels in it, sent again on reconnect
+        self.writer = None
+        self.reader_task = None
+        self.loop = None
+        self.connect_lock = None
+
+    # Connection to the broker
+
+    async def get_writer(self):
+        """
+        Returns a connected StreamWriter, (re)connecting if needed.
+        A connection belongs to one event loop, so a new loop reconnects.
+        """
+        loop = asyncio.get_running_loop()
+        if self.writer is not None and self.loop is loop and not self.writer.is_closing():
+            return self.writer
+
+        if self.loop is not loop:
+            self.loop = loop
+            self.connect_lock = asyncio.Lock()
+
+        async with self.connect_lock:
+            if self.writer is None or self.writer.is_closing():
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                writer.write(encode_frame({'op': 'hello', 'client': self.client_id}))
+                # Wait until the broker has registered us, so messages other
+                # workers send to our channels from now on aren't dropped
+                await read_frame(reader)
+                # A broker that restarted, or dropped us, knows none of our groups
+                for group, channels in self.groups.items():
+                    for channel in channels:
+                        writer.write(encode_frame({'op': 'group_add', 'group': group, 'channel': channel}))
+                await writer.drain()
+                self.writer = writer
+                self.reader_task = asyncio.ensure_future(self.read_deliveries(reader))
+        return self.writer
+
+    async def send_to_broker(self, frame):
+        writer = await self.get_writer()
+        writer.write(encode_frame(frame))
+        await writer.drain()
+
+    async def read_deliveries(self, reader):
+        """
+        Put messages the broker delivers onto the local channel queues.
+        """
+        try:
+            while True:
+                frame = await read_frame(reader)
+                for channel in frame['channels']:
+                    try:
+                        self.put_local(channel, frame['message'])
+                    except ChannelFull:
+                        pass  # Same as InMemoryChannelLayer.group_send
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.warning("Lost connection to channel broker")
+            if self.writer is not None:
+                self.writer.close()
+            await self.reconnect()
+
+    async def reconnect(self):
+        """
+        Connect again right away, with growing pauses while the broker is
+        down: consumers waiting in receive() make no calls that would.
+        """
+        delay = 0.05
+        while True:
+            try:
+                await self.get_writer()
+                logger.info("Reconnected to channel broker")
+                return
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 2)
+
+    # Local queues
+
+    def put_local(self, channel, message):
+        local = self.channels.setdefault(channel, LocalChannel())
+        if len(local.messages) >= self.get_capacity(channel):
+            raise ChannelFull(channel)
+        local.put(time.time() + self.expiry, message)
+
+    def clean_expired(self):
+        """
+        Drop expired messages, e.g. for consumers that have gone away.
+        """
+        now = time.time()
+        for channel, local in list(self.channels.items()):
+            local.drop_expired(now)
+            # Keep channels a consumer is waiting on, or it would miss new messages
+            if not local.messages and not local.receivers:
+                del self.channels[channel]
+
+    # Channel layer API
+
+    async def new_channel(self, prefix='specific.'):
+        # Connect now, so the broker can route to this worker before the
+        # channel's first receive()
+        await self.get_writer()
+        suffix = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+        return f"specific.{self.client_id}!{suffix}"
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+
+        if client_of(channel) == self.client_id:
+            self.put_local(channel, message)  # Our own consumer: skip the broker
+        else:
+            await self.send_to_broker({'op': 'send', 'channel': channel, 'message': message})
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        self.clean_expired()
+
+        # Make sure the broker knows us before we wait for deliveries
+        await self.get_writer()
+
+        local = self.channels.setdefault(channel, LocalChannel())
+        try:
+            return await local.get()
+        finally:
+            if not local.messages and not local.receivers and self.channels.get(channel) is local:
+                del self.channels[channel]
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        self.groups[group].add(channel)
+        await self.send_to_broker({'op': 'group_add', 'group': group, 'channel': channel})
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        channels = self.groups.get(group)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del self.groups[group]
+        await self.send_to_broker({'op': 'group_discard', 'group': group, 'channel': channel})
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+        await self.send_to_broker({'op': 'group_send', 'group': group, 'message': message})
+
+    async def flush(self):
+        self.channels = {}
+        self.groups = defaultdict(set)
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            self.reader_task = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
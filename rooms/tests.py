@@ -1,3 +1,883 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import IntegrityError, OperationalError, connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from notifications.models import Notification
+from tracker.models import StudySession
+
+from .activity import activity_tracker
+from .admission import AdmissionControl
+from .chat_buffer import ChatWriteBuffer
+from .codes import ALPHABET, CODE_LENGTH, CODE_SPACE, CodePermutation, RoomCodeAllocator, encode
+from .cleanup import cleanup_expired_rooms, cleanup_inactive_rooms
+from .consumers import ChatConsumer, RoomSockets
+from .directory import adjust_member_count
+from .expiry import ExpiryScheduler
+from .leader import LeaderLock
+from .models import ChatMessage, PresenceWorker, Room, RoomCodeSequence, RoomMembership
+from .outbound import CLOSE_CODE_RESYNC, OutboundQueue
+from .peers import peer_registry
+from .purge import purge_room, purge_tombstoned_rooms
+from .presence import PresenceRegistry, clear_stale_presence, presence
+from .room_events import RoomEventRegistry
+from .search import FTS_TABLE, search_rooms
+from .shards import ShardRouter, message_shard, shard_code
+from .socket_layer import SocketChannelLayer, SocketLayerBroker
+
+
+class RoomJoinQueryTests(TestCase):
+    """
+    Pins the number of queries of opening a room page, so the join path
+    doesn't quietly grow again. Every request also loads the session and
+    the user, and base.html loads the viewer's profile for the header.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='pass')
+        self.visitor = User.objects.create_user(username='visitor', password='pass')
+        self.room = Room.objects.create(name='Study room', created_by=self.owner)
+        self.url = reverse('room_detail', args=[self.room.room_code])
+        self.client.force_login(self.visitor)
+
+    def tearDown(self):
+        # Write pending activity now instead of from the tracker's timer thread
+        activity_tracker.flush()
+
+    def test_first_visit(self):
+        # session, user, room, membership upsert, room owner,
+        # notification insert, member list, header profile
+        with self.assertNumQueries(8):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['members_count'], 1)
+        self.assertTrue(RoomMembership.objects.filter(user=self.visitor, room=self.room, is_active=False).exists())
+        self.assertEqual(Notification.objects.filter(recipient=self.owner).count(), 1)
+
+    def test_repeat_visit(self):
+        self.client.get(self.url)
+        # session, user, room, membership upsert (no-op), member list, header profile
+        with self.assertNumQueries(6):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(RoomMembership.objects.filter(user=self.visitor, room=self.room).count(), 1)
+        self.assertEqual(Notification.objects.filter(recipient=self.owner).count(), 1)
+
+    def test_owner_visit_sends_no_notification(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['is_owner'])
+        self.assertFalse(Notification.objects.exists())
+
+    def test_ensure_membership(self):
+        self.assertTrue(RoomMembership.objects.ensure(self.visitor, self.room))
+        self.assertFalse(RoomMembership.objects.ensure(self.visitor, self.room))
+        self.assertEqual(RoomMembership.objects.filter(room=self.room).count(), 1)
+
+
+# database_sync_to_async closes the connection around each call, which would
+# end the test's transaction; plain sync_to_async runs the same code inline
+inline_db = mock.patch('rooms.chat_buffer.database_sync_to_async', sync_to_async)
+
+
+class ChatBufferTests(TestCase):
+    """
+    The write-behind buffer flushes on size and on its timer, and a row
+    that breaks a constraint only costs its own room's messages.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='writer', password='pass')
+        self.room = Room.objects.create(name='Chat', created_by=self.user)
+
+    def message(self, text, room_id=None):
+        return ChatMessage(room_id=room_id or self.room.id, user_id=self.user.id, message=text)
+
+    @inline_db
+    async def test_flush_when_full(self):
+        buffer = ChatWriteBuffer(max_messages=2, interval_ms=60000)
+        await buffer.add(self.message('one'))
+        self.assertEqual(len(buffer.pending), 1)
+        await buffer.add(self.message('two'))
+        self.assertEqual(buffer.pending, [])
+        await asyncio.gather(*buffer._flush_tasks)
+        self.assertEqual(buffer.flush_count, 1)
+        self.assertEqual(await ChatMessage.objects.filter(room=self.room).acount(), 2)
+
+    @inline_db
+    async def test_flush_on_timer(self):
+        buffer = ChatWriteBuffer(max_messages=100, interval_ms=10)
+        await buffer.add(self.message('one'))
+        await asyncio.sleep(0.05)
+        await asyncio.gather(*buffer._flush_tasks)
+        self.assertEqual(buffer.flush_count, 1)
+        self.assertEqual(await ChatMessage.objects.filter(room=self.room).acount(), 1)
+
+    def test_failed_room_does_not_drop_other_rooms(self):
+        inserted = []
+
+        class FailingBuffer(ChatWriteBuffer):
+            @staticmethod
+            def _bulk_insert(batch):
+                if any(message.room_id == 999 for message in batch):
+                    raise IntegrityError('FOREIGN KEY constraint failed')
+                inserted.extend(message.message for message in batch)
+
+        with self.assertLogs('rooms.chat_buffer', 'WARNING'):
+            FailingBuffer._save([self.message('a'), self.message('gone', room_id=999), self.message('b')])
+        self.assertEqual(inserted, ['a', 'b'])
+
+
+class ChatHistoryTests(TestCase):
+    """
+    Keyset paging walks the whole history exactly once, even when many
+    messages share a created_at.
+    """
+
+    def test_pages_across_equal_timestamps(self):
+        user = User.objects.create_user(username='writer', password='pass')
+        room = Room.objects.create(name='Chat', created_by=user)
+        now = timezone.now()
+        ChatMessage.objects.bulk_create([
+            ChatMessage(room=room, user=user, message=str(n), created_at=now) for n in range(5)
+        ])
+        ChatMessage.objects.create(room=room, user=user, message='latest', created_at=now + timedelta(seconds=1))
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = ChatMessage.get_history(room.id, 2, before=cursor)
+            seen[:0] = [message.message for message in page]
+            if cursor is None:
+                break
+        self.assertEqual(seen, ['0', '1', '2', '3', '4', 'latest'])
+
+
+class RecordingLayer:
+    """
+    Channel layer stand-in that keeps what was sent to each channel.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, channel, message):
+        self.sent.append((channel, message))
+
+
+class SignalRelayTests(TestCase):
+    """
+    WebRTC signaling goes to the addressed peer only, and frames for a
+    peer that isn't in the room are dropped.
+    """
+
+    def setUp(self):
+        self.consumer = ChatConsumer()
+        self.consumer.scope = {'user': User(id=1, username='caller')}
+        self.consumer.room_code = 'PEERS01'
+        self.consumer.channel_name = 'caller'
+        self.consumer.channel_layer = RecordingLayer()
+        for channel in ('caller', 'callee', 'bystander'):
+            peer_registry.add('PEERS01', channel, channel)
+
+    def tearDown(self):
+        peer_registry.rooms.pop('PEERS01', None)
+
+    async def test_relays_to_target_only(self):
+        await self.consumer.relay_signal('webrtc_answer', {'answer': 'sdp', 'target': 'callee'})
+        self.assertEqual(self.consumer.channel_layer.sent, [('callee', {
+            'type': 'webrtc_signal',
+            'payload': {'type': 'webrtc_answer', 'answer': 'sdp', 'sender': 'caller', 'username': 'caller'},
+        })])
+
+    async def test_offer_without_target_goes_to_other_peers(self):
+        await self.consumer.relay_signal('webrtc_offer', {'offer': 'sdp'})
+        self.assertEqual(sorted(channel for channel, _ in self.consumer.channel_layer.sent), ['bystander', 'callee'])
+
+    async def test_unknown_target_is_dropped(self):
+        await self.consumer.relay_signal('webrtc_answer', {'answer': 'sdp', 'target': 'stranger'})
+        await self.consumer.relay_signal('webrtc_answer', {'answer': 'sdp', 'target': 'caller'})
+        self.assertEqual(self.consumer.channel_layer.sent, [])
+
+
+class RoomEventLogTests(TestCase):
+    """
+    A reconnecting client gets exactly the events it missed, and a full
+    snapshot when its epoch is old or the gap is no longer buffered.
+    """
+
+    def setUp(self):
+        self.registry = RoomEventRegistry()
+        self.log = self.registry.get_log('EVENTS1')
+        for n in range(5):
+            self.log.record({'type': 'chat', 'message': str(n)})
+
+    def test_replay_after_seq(self):
+        replay = json.loads(self.registry.get_replay('EVENTS1', self.log.epoch, 3))
+        self.assertEqual(replay['seq'], 5)
+        self.assertEqual([(event['seq'], event['message']) for event in replay['events']], [(4, '3'), (5, '4')])
+        self.assertEqual(json.loads(self.registry.get_replay('EVENTS1', self.log.epoch, 5))['events'], [])
+
+    def test_other_epoch_needs_snapshot(self):
+        self.assertIsNone(self.registry.get_replay('EVENTS1', 'stale', 3))
+        self.registry.discard('EVENTS1')
+        self.assertIsNone(self.registry.get_replay('EVENTS1', self.log.epoch, 3))
+
+    def test_gap_older_than_buffer_needs_snapshot(self):
+        self.log.events = deque(self.log.events, maxlen=2)
+        self.log.record({'type': 'chat', 'message': '5'})
+        self.assertIsNone(self.registry.get_replay('EVENTS1', self.log.epoch, 3))
+        self.assertIsNotNone(self.registry.get_replay('EVENTS1', self.log.epoch, 4))
+
+    def test_room_state_kept_while_any_socket_is_open(self):
+        sockets = RoomSockets()
+        sockets.open('EVENTS1', 'member')
+        sockets.open('EVENTS1', 'anonymous')
+        self.assertFalse(sockets.close('EVENTS1', 'member'))
+        self.assertTrue(sockets.close('EVENTS1', 'anonymous'))
+
+
+class BlockedWriter:
+    """
+    Socket write that never completes, like a client that stopped reading
+    on a server with flow control.
+    """
+
+    def __init__(self):
+        self.written = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, text):
+        self.written.append(text)
+        await self.release.wait()
+
+
+class OutboundQueueTests(TestCase):
+    """
+    A client that falls behind gets coalesced presence frames, some grace,
+    and then a resync close. Behind means frames queued or written but not
+    acknowledged.
+    """
+
+    async def start(self, write, **limits):
+        queue = OutboundQueue(write, **limits)
+        queue.start()
+        self.addCleanup(queue.stop)
+        return queue
+
+    async def test_coalesces_presence_frames(self):
+        queue = await self.start(BlockedWriter(), max_size=10)
+        queue.put('first')
+        await asyncio.sleep(0)  # Written; the write blocks
+        queue.put('join v1', coalesce_key='presence:ann', seq=2)
+        queue.put('chat', seq=3)
+        queue.put('join v2', coalesce_key='presence:ann', seq=4)
+        self.assertEqual([entry[0] for entry in queue.entries],
+                         ['{"type": "skip", "seq": 2}', 'chat', 'join v2'])
+
+    async def test_drops_after_grace(self):
+        queue = await self.start(BlockedWriter(), max_size=2, grace_ms=50)
+        queue.put('first')
+        await asyncio.sleep(0)
+        self.assertTrue(queue.put('a'))
+        self.assertTrue(queue.put('b'))
+        self.assertTrue(queue.put('c'))  # Over the limit: grace starts
+        await asyncio.sleep(0.06)
+        self.assertFalse(queue.put('d'))
+
+    async def test_drops_when_backlog_doubles(self):
+        queue = await self.start(BlockedWriter(), max_size=2, grace_ms=60000)
+        queue.put('first')
+        await asyncio.sleep(0)
+        self.assertEqual([queue.put(text) for text in 'abcde'], [True, True, True, True, False])
+
+    async def test_unacknowledged_frames_count_when_writes_never_block(self):
+        written = []
+
+        async def write(text):
+            written.append(text)  # Accepted at once, as under Daphne
+
+        queue = await self.start(write, max_size=3, grace_ms=60000)
+        queue.ack(0)
+        for seq in (1, 2, 3):
+            queue.put(f'event {seq}', seq=seq)
+        await asyncio.sleep(0.01)
+        self.assertEqual((len(written), queue.backlog), (3, 3))
+        self.assertTrue(queue.put('event 4', seq=4))
+        self.assertIsNotNone(queue.overflow_since)
+
+        queue.ack(3)
+        self.assertIsNone(queue.overflow_since)
+        await asyncio.sleep(0.01)
+        self.assertEqual(queue.backlog, 1)
+
+    async def test_slow_client_closed_for_resync(self):
+        consumer = ChatConsumer()
+        consumer.room_code = 'SLOW001'
+        consumer.outbound = await self.start(BlockedWriter(), max_size=1, grace_ms=60000)
+        consumer.close = mock.AsyncMock()
+        consumer.outbound.put('first')
+        await asyncio.sleep(0)
+        for n in range(3):
+            await consumer.enqueue(f'frame {n}')
+        consumer.close.assert_awaited_once_with(code=CLOSE_CODE_RESYNC)
+
+
+class SocketLayerTests(TestCase):
+    """
+    Two workers talking through a broker on a temporary Unix socket.
+    """
+
+    async def start_broker(self):
+        broker = SocketLayerBroker(self.path)
+        await broker.start()
+        return broker
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'broker.sock')
+
+    @asynccontextmanager
+    async def workers(self):
+        # Each async test runs in its own event loop, so connect inside it
+        self.broker = await self.start_broker()
+        self.first = SocketChannelLayer(self.path)
+        self.second = SocketChannelLayer(self.path)
+        try:
+            yield
+        finally:
+            await self.first.flush()
+            await self.second.flush()
+            await self.broker.close()
+
+    async def until(self, condition):
+        """
+        Wait for the broker to process frames sent on other connections.
+        """
+        for _ in range(100):
+            if condition():
+                return
+            await asyncio.sleep(0.02)
+        self.fail("Broker never got there")
+
+    async def receive(self, layer, channel):
+        return await asyncio.wait_for(layer.receive(channel), timeout=2)
+
+    async def test_send_to_other_worker(self):
+        async with self.workers():
+            channel = await self.second.new_channel()
+            await self.first.send(channel, {'type': 'chat.message', 'text': 'hi'})
+            self.assertEqual(await self.receive(self.second, channel), {'type': 'chat.message', 'text': 'hi'})
+
+    async def test_group_send_reaches_every_worker(self):
+        async with self.workers():
+            channels = [await self.first.new_channel(), await self.second.new_channel()]
+            await self.first.group_add('room_ABC', channels[0])
+            await self.second.group_add('room_ABC', channels[1])
+            await self.until(lambda: len(self.broker.groups.get('room_ABC', ())) == 2)
+            await self.first.group_send('room_ABC', {'type': 'presence'})
+            self.assertEqual(await self.receive(self.first, channels[0]), {'type': 'presence'})
+            self.assertEqual(await self.receive(self.second, channels[1]), {'type': 'presence'})
+            await self.second.group_discard('room_ABC', channels[1])
+            self.assertEqual(self.second.groups, {})  # Nothing to register again on reconnect
+
+    async def test_expired_messages_dropped(self):
+        async with self.workers():
+            self.first.expiry = 0.01
+            channel = await self.first.new_channel()
+            await self.first.send(channel, {'type': 'stale'})
+            await asyncio.sleep(0.02)
+            await self.first.send(channel, {'type': 'fresh'})
+            self.assertEqual(await self.receive(self.first, channel), {'type': 'fresh'})
+            self.assertEqual(self.first.channels, {})
+
+    async def test_groups_registered_again_after_broker_restart(self):
+        async with self.workers():
+            channel = await self.second.new_channel()
+            await self.first.get_writer()
+            await self.second.group_add('room_ABC', channel)
+            waiting = asyncio.ensure_future(self.second.receive(channel))
+
+            await self.broker.close()
+            self.broker = await self.start_broker()
+            # Both workers reconnect on their own
+            await self.until(lambda: len(self.broker.workers) == 2 and 'room_ABC' in self.broker.groups)
+
+            await self.first.group_send('room_ABC', {'type': 'after restart'})
+            self.assertEqual(await asyncio.wait_for(waiting, timeout=2), {'type': 'after restart'})
+
+
+class PresenceTests(TestCase):
+    """
+    Each process writes only the memberships it activated, and stale ones
+    are cleared by heartbeat, never by a process starting up.
+    """
+
+    def setUp(self):
+        self.ann = User.objects.create_user(username='ann', password='pass')
+        self.bob = User.objects.create_user(username='bob', password='pass')
+        self.room = Room.objects.create(name='Shared room', created_by=self.ann)
+        for user in (self.ann, self.bob):
+            RoomMembership.objects.ensure(user, self.room)
+
+    def tearDown(self):
+        activity_tracker.flush()
+
+    def active(self):
+        self.room.refresh_from_db()
+        usernames = RoomMembership.objects.filter(room=self.room, is_active=True).values_list(
+            'user__username', flat=True
+        )
+        return set(usernames), self.room.active_member_count
+
+    @mock.patch('rooms.presence.database_sync_to_async', sync_to_async)
+    async def test_two_registries_share_a_room(self):
+        first, second = PresenceRegistry(), PresenceRegistry()
+        code, room_id = self.room.room_code, self.room.id
+        first.connect(code, room_id, 'first!a', self.ann.id, 'ann')
+        second.connect(code, room_id, 'second!b', self.bob.id, 'bob')
+        await first.sweep()
+        await second.sweep()
+        self.assertEqual(await sync_to_async(self.active)(), ({'ann', 'bob'}, 2))
+
+        first.disconnect(code, 'first!a', self.ann.id)
+        await first.sweep()
+        self.assertEqual(await sync_to_async(self.active)(), ({'bob'}, 1))
+
+        # A process starting up leaves rooms it doesn't track alone
+        await PresenceRegistry().sweep()
+        self.assertEqual(await sync_to_async(self.active)(), ({'bob'}, 1))
+
+        for registry in (first, second):
+            registry.task.cancel()
+
+    def test_clear_stale_presence(self):
+        PresenceRegistry.reconcile('alive', {self.room.id: [self.ann.id]})
+        PresenceRegistry.reconcile('crashed', {self.room.id: [self.bob.id]})
+        PresenceWorker.objects.filter(worker_id='crashed').update(
+            last_seen=timezone.now() - timedelta(hours=1)
+        )
+
+        self.assertEqual(clear_stale_presence(), 1)
+        self.assertEqual(self.active(), ({'ann'}, 1))
+        self.assertFalse(PresenceWorker.objects.filter(worker_id='crashed').exists())
+        self.assertEqual(clear_stale_presence(), 0)
+
+
+class ExpirySchedulerTests(TestCase):
+    """
+    The schedule is reloaded from Room.expires_at, and due rooms are
+    tombstoned unless their expiry moved in the meantime.
+    """
+
+    def setUp(self):
+        owner = User.objects.create_user(username='owner', password='pass')
+        past = timezone.now() - timedelta(minutes=1)
+        self.due = Room.objects.create(name='Due', created_by=owner, expires_at=past)
+        self.moved = Room.objects.create(name='Moved', created_by=owner, expires_at=past)
+        self.later = Room.objects.create(name='Later', created_by=owner,
+                                         expires_at=timezone.now() + timedelta(minutes=10))
+        Room.objects.create(name='Open', created_by=owner)
+        Room.objects.create(name='Global', room_code='GLOBAL', created_by=owner, expires_at=past)
+        self.scheduler = ExpiryScheduler()
+
+    def test_load_replaces_schedule(self):
+        self.scheduler.deadlines = {0: 0.0}
+        self.scheduler.heap = [(0.0, 0)]
+        self.scheduler.load()
+        self.assertEqual(set(self.scheduler.deadlines), {self.due.id, self.moved.id, self.later.id})
+        self.assertEqual(sorted(self.scheduler.pop_due(timeout=1)), sorted([self.due.id, self.moved.id]))
+        self.assertEqual(set(self.scheduler.deadlines), {self.later.id})
+
+    def test_outdated_heap_entries_skipped(self):
+        self.scheduler.load()
+        self.scheduler.deadlines[self.moved.id] = self.later.expires_at.timestamp()  # As schedule() does
+        self.assertEqual(self.scheduler.pop_due(timeout=1), [self.due.id])
+
+    def test_expire_tombstones_rooms_still_expired(self):
+        self.scheduler.load()
+        due = self.scheduler.pop_due(timeout=1)
+        Room.objects.filter(id=self.moved.id).update(expires_at=None)  # Someone came back
+
+        self.assertEqual(self.scheduler.expire(due), 1)
+        self.assertFalse(Room.objects.filter(id=self.due.id).exists())
+        self.assertIsNotNone(Room.all_objects.get(id=self.due.id).deleted_at)
+        self.assertTrue(Room.objects.filter(id=self.moved.id).exists())
+
+
+class CleanupTests(TestCase):
+    """
+    Empty, idle rooms are tombstoned in chunks; occupied, recent and
+    GLOBAL rooms are kept.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='pass')
+        long_ago = timezone.now() - timedelta(hours=2)
+        self.idle = [Room.objects.create(name=f'Idle {n}', created_by=self.owner) for n in range(5)]
+        self.occupied = Room.objects.create(name='Occupied', created_by=self.owner)
+        RoomMembership.objects.create(user=self.owner, room=self.occupied, is_active=True)
+        self.global_room = Room.objects.create(name='Global', room_code='GLOBAL', created_by=self.owner)
+        Room.objects.update(created_at=long_ago, last_activity=long_ago)
+        self.recent = Room.objects.create(name='Recent', created_by=self.owner)
+
+    def test_inactive_rooms_tombstoned_in_chunks(self):
+        with self.assertNumQueries(1 + 3):  # Candidate ids, then one UPDATE per chunk of 2
+            stats = cleanup_inactive_rooms(chunk_size=2)
+        self.assertEqual(stats['rooms'], 5)
+        self.assertEqual(
+            set(Room.objects.values_list('id', flat=True)),
+            {self.occupied.id, self.global_room.id, self.recent.id},
+        )
+        self.assertEqual(Room.all_objects.filter(deleted_at__isnull=False).count(), 5)
+
+    def test_expired_rooms_tombstoned(self):
+        past = timezone.now() - timedelta(minutes=1)
+        Room.objects.filter(id__in=[self.recent.id, self.global_room.id]).update(expires_at=past)
+        self.assertEqual(cleanup_expired_rooms()['rooms'], 1)
+        self.assertFalse(Room.objects.filter(id=self.recent.id).exists())
+        self.assertTrue(Room.objects.filter(id=self.global_room.id).exists())
+
+
+class PurgeTests(TestCase):
+    """
+    A tombstoned room disappears from lookups at once; the purger then
+    removes its rows in batches and the room row last.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='pass')
+        self.room = Room.objects.create(name='Big room', created_by=self.owner)
+        members = [User.objects.create_user(username=f'member{n}', password='pass') for n in range(3)]
+        for user in members:
+            RoomMembership.objects.create(user=user, room=self.room, is_active=False)
+        ChatMessage.objects.bulk_create([
+            ChatMessage(room=self.room, user=self.owner, message=str(n)) for n in range(5)
+        ])
+        self.session = StudySession.objects.create(user=self.owner, room=self.room, minutes=25)
+
+    def test_tombstoned_room_hidden(self):
+        self.room.tombstone()
+        self.assertFalse(Room.objects.filter(id=self.room.id).exists())
+        self.assertTrue(Room.all_objects.filter(id=self.room.id).exists())
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('room_detail', args=[self.room.room_code]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_purge_in_batches(self):
+        self.room.tombstone()
+        metrics = purge_room(self.room.id, batch_size=2)
+        self.assertEqual(metrics['rows'], {
+            'sessions': 1, 'favorites': 0, 'memberships': 3, 'messages': 5, 'room': 1,
+        })
+        # 1 + 2 + 3 batches of at most 2 rows, and the room itself
+        self.assertEqual(metrics['batches'], 7)
+        self.assertFalse(Room.all_objects.filter(id=self.room.id).exists())
+        self.session.refresh_from_db()
+        self.assertIsNone(self.session.room_id)
+
+    def test_live_rooms_not_purged(self):
+        self.assertEqual(purge_tombstoned_rooms(), [])
+        self.assertEqual(ChatMessage.objects.filter(room=self.room).count(), 5)
+
+
+class LeaderLockTests(TestCase):
+    """
+    A database error while taking the advisory lock means "not leader yet".
+    """
+
+    @mock.patch.object(LeaderLock, 'uses_database', True)
+    @mock.patch('rooms.leader.connection')
+    def test_database_error_retried_on_fresh_connection(self, connection):
+        connection.cursor.side_effect = OperationalError('server closed the connection')
+        lock = LeaderLock()
+        self.assertFalse(lock.acquire())
+        self.assertFalse(lock.held)
+        connection.close.assert_called_once_with()
+
+
+class RoomCodeTests(TestCase):
+    """
+    Codes are a keyed permutation of a counter, so they never repeat, and
+    no counter values are cached from inside a transaction.
+    """
+
+    def test_permutation_one_to_one_and_invertible(self):
+        permutation = CodePermutation('test key')
+        values = list(range(5000)) + [CODE_SPACE - n for n in range(1, 1000)]
+        permuted = [permutation.permute(n) for n in values]
+        self.assertEqual(len(set(permuted)), len(values))
+        self.assertTrue(all(0 <= n < CODE_SPACE for n in permuted))
+        self.assertEqual([permutation.invert(n) for n in permuted], values)
+        other = CodePermutation('other key')
+        self.assertNotEqual(permuted[:100], [other.permute(n) for n in range(100)])
+
+    def test_codes_use_alphabet(self):
+        for n in (0, 1, CODE_SPACE - 1):
+            code = encode(CodePermutation('test key').permute(n))
+            self.assertEqual(len(code), CODE_LENGTH)
+            self.assertTrue(set(code) <= set(ALPHABET))
+
+    def test_nothing_cached_inside_transaction(self):
+        # TestCase wraps every test in a transaction
+        allocator = RoomCodeAllocator()
+        codes = [allocator.allocate() for _ in range(3)]
+        self.assertEqual(len(set(codes)), 3)
+        self.assertEqual((allocator.block_end, allocator.permutation), (0, None))
+        self.assertEqual(RoomCodeSequence.objects.get(id=1).next_value, 3)
+
+    @override_settings(ROOM_CODE_BLOCK_SIZE=10)
+    def test_blocks_reserved_outside_transaction(self):
+        allocator = RoomCodeAllocator()
+        with mock.patch('rooms.codes.connection', mock.Mock(in_atomic_block=False)):
+            codes = [allocator.allocate() for _ in range(3)]
+        self.assertEqual(RoomCodeSequence.objects.get(id=1).next_value, 10)
+        codes.append(allocator.allocate())  # Inside the test's transaction again
+        self.assertEqual(len(set(codes)), 4)
+        self.assertEqual(RoomCodeSequence.objects.get(id=1).next_value, 11)
+
+
+class RoomSearchTests(TestCase):
+    """
+    The search index follows renames, bulk updates and deletes, and
+    tombstoned rooms are never found.
+    """
+
+    def setUp(self):
+        owner = User.objects.create_user(username='owner', password='pass')
+        self.room = Room.objects.create(name='Maths study group', description='Calculus', created_by=owner)
+        self.other = Room.objects.create(name='Quiet room', description='Maths homework', created_by=owner)
+
+    def found(self, text):
+        return [room.name for room in search_rooms(Room.objects.all(), text)]
+
+    def test_prefix_words_and_name_ranked_first(self):
+        self.assertEqual(self.found('mat stu'), ['Maths study group'])
+        self.assertEqual(self.found('maths'), ['Maths study group', 'Quiet room'])
+
+    def test_index_follows_updates(self):
+        self.room.name = 'Physics lab'
+        self.room.save()
+        self.assertEqual(self.found('phys'), ['Physics lab'])
+        Room.objects.filter(id=self.other.id).update(description='Chemistry')
+        self.assertEqual(self.found('maths'), [])
+        self.assertEqual(self.found('chem'), ['Quiet room'])
+
+    def test_tombstoned_rooms_not_found(self):
+        self.room.tombstone()
+        self.assertEqual(self.found('maths'), ['Quiet room'])
+        purge_room(self.room.id)
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH 'maths'")
+                self.assertEqual(cursor.fetchall(), [(self.other.id,)])
+
+
+class RoomDirectoryTests(TestCase):
+    """
+    Directory pages follow each other by cursor without gaps or repeats,
+    and stored member counts never go negative.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='pass')
+        now = timezone.now()
+        self.rooms = []
+        for n, members in enumerate([3, 1, 3, 0, 2]):
+            room = Room.objects.create(name=f'Room {n}', created_by=self.owner)
+            Room.objects.filter(id=room.id).update(
+                active_member_count=members, last_activity=now - timedelta(minutes=n % 3)
+            )
+            self.rooms.append(room)
+        Room.objects.create(name='Private', created_by=self.owner, is_public=False)
+        Room.objects.create(name='Deleted', created_by=self.owner).tombstone()
+        self.client.force_login(self.owner)
+
+    def walk(self, sort):
+        names, cursor = [], None
+        while True:
+            params = {'sort': sort, 'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get(reverse('room_directory_api'), params).json()
+            names += [room['name'] for room in data['rooms']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                return names
+
+    def test_cursor_round_trip(self):
+        by_members = Room.objects.filter(is_public=True).order_by('-active_member_count', '-id')
+        by_activity = Room.objects.filter(is_public=True).order_by('-last_activity', '-id')
+        self.assertEqual(self.walk('members'), [room.name for room in by_members])
+        self.assertEqual(self.walk('activity'), [room.name for room in by_activity])
+        self.assertEqual(len(self.walk('members')), 5)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('room_directory_api'), {'cursor': 'not a cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_member_count_never_below_zero(self):
+        room = self.rooms[1]
+        adjust_member_count(room.id, -3)
+        room.refresh_from_db()
+        self.assertEqual(room.active_member_count, 0)
+
+        # An active membership deleted after the count was already reset
+        membership = RoomMembership.objects.create(user=self.owner, room=room, is_active=False)
+        RoomMembership.objects.filter(id=membership.id).update(is_active=True)
+        RoomMembership.objects.get(id=membership.id).delete()
+        room.refresh_from_db()
+        self.assertEqual(room.active_member_count, 0)
+
+    def test_creator_joins_inactive(self):
+        response = self.client.post(reverse('create_room'), {'name': 'New room', 'is_public': 'on'})
+        room = Room.objects.get(name='New room')
+        self.assertRedirects(response, reverse('room_detail', args=[room.room_code]), fetch_redirect_response=False)
+        self.assertFalse(RoomMembership.objects.get(room=room, user=self.owner).is_active)
+        self.assertEqual(room.active_member_count, 0)
+
+
+@mock.patch('rooms.admission.broadcast_to_room', mock.AsyncMock())
+@mock.patch('rooms.presence.broadcast_to_room', mock.AsyncMock())
+class AdmissionTests(TestCase):
+    """
+    Users beyond a room's capacity wait in order, and each freed seat lets
+    exactly one of them in.
+    """
+
+    room_code = 'CAPPED1'
+
+    def setUp(self):
+        self.layer = RecordingLayer()
+        self.presence = PresenceRegistry()
+        self.presence.start_sweeper = lambda: None  # Sweeps are run by hand
+        for target, value in (('rooms.admission.presence', self.presence),
+                              ('rooms.admission.get_channel_layer', lambda: self.layer),
+                              ('rooms.presence.get_channel_layer', lambda: self.layer)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.admission = AdmissionControl()
+
+    async def join(self, user_id, channel_name=None):
+        channel_name = channel_name or f'chan-{user_id}'
+        return await self.admission.join(self.room_code, None, 2, channel_name, user_id, f'user{user_id}')
+
+    def granted(self):
+        return [channel for channel, message in self.layer.sent if message['type'] == 'admission_granted']
+
+    async def test_queue_positions(self):
+        self.assertEqual([await self.join(user_id) for user_id in (1, 2, 3, 4)], [None, None, 1, 2])
+        self.assertEqual(self.admission.position(self.room_code, 4), 2)
+        self.assertIsNone(self.admission.position(self.room_code, 1))
+        # A second tab of a seated user goes straight in
+        self.assertIsNone(await self.join(1, 'chan-1b'))
+        # A second tab of a waiting user waits behind everyone
+        self.assertEqual(await self.join(3, 'chan-3b'), 3)
+        self.assertEqual(self.admission.position(self.room_code, 3), 1)
+
+        await self.admission.leave(self.room_code, 'chan-3')
+        self.assertEqual(self.admission.position(self.room_code, 4), 1)
+        self.assertEqual(self.layer.sent[-2:], [
+            ('chan-4', {'type': 'admission_position', 'position': 1}),
+            ('chan-3b', {'type': 'admission_position', 'position': 2}),
+        ])
+
+    async def test_freed_seat_admits_one(self):
+        for user_id in (1, 2, 3, 4):
+            await self.join(user_id)
+        self.presence.disconnect(self.room_code, 'chan-1', 1)
+        await self.admission.release(self.room_code)
+        await self.admission.release(self.room_code)  # Nothing more freed
+        self.assertEqual(self.granted(), ['chan-3'])
+        self.assertEqual(self.admission.position(self.room_code, 4), 1)
+
+    @override_settings(PRESENCE_TIMEOUT_SECONDS=-1)
+    @mock.patch('rooms.presence.database_sync_to_async', sync_to_async)
+    async def test_timed_out_users_release_once_per_room(self):
+        await self.join(1)
+        await self.join(1, 'chan-1b')
+        await self.join(2)
+        with mock.patch('rooms.admission.admission.release', mock.AsyncMock()) as release:
+            await self.presence.sweep()
+        release.assert_awaited_once_with(self.room_code)
+        self.assertEqual(self.presence.count(self.room_code), 0)
+
+
+@override_settings(GLOBAL_SHARD_SIZE=3)
+class GlobalShardTests(TestCase):
+    """
+    Global room users are seated at the least busy table with room, keep
+    their table across tabs, and see only their table's history, while
+    announcements reach every table.
+    """
+
+    def setUp(self):
+        self.presence = PresenceRegistry()
+        self.presence.start_sweeper = lambda: None
+        self.router = ShardRouter()
+        for target, value in (('rooms.shards.presence', self.presence),
+                              ('rooms.shards.shard_router', self.router),
+                              ('rooms.consumers.shard_router', self.router)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def seat(self, user_id, tab='a'):
+        number = self.router.place(user_id)
+        self.presence.connect(shard_code(number), None, f'{user_id}{tab}', user_id, f'user{user_id}')
+        return number
+
+    def test_placement_and_least_load(self):
+        self.assertEqual([self.seat(user_id) for user_id in range(1, 6)], [1, 1, 1, 2, 2])
+        self.assertEqual(self.seat(1, 'b'), 1)  # Full, but the user is already there
+        for user_id in (1, 2):
+            self.presence.disconnect('GLOBAL', f'{user_id}a', user_id)
+        self.presence.disconnect('GLOBAL', '1b', 1)
+        self.assertEqual(self.seat(6), 1)  # 1 user at table 1, 2 at table 2
+
+        self.assertEqual(self.seat(7), 1)
+        self.assertEqual(self.seat(8), 2)
+        self.assertEqual(self.router.peek(9), 3)
+        self.assertEqual(self.router.shards(), [1, 2])  # peek() opens nothing
+        self.assertEqual(self.seat(9), 3)
+        self.assertEqual(self.router.total_users(), 7)
+
+    def test_history_per_table(self):
+        owner = User.objects.create_user(username='owner', password='pass')
+        room = Room.objects.create(name='Global', room_code='GLOBAL', created_by=owner)
+        ChatMessage.objects.bulk_create([
+            ChatMessage(room=room, user=owner, message=f'table {number}', shard=message_shard(number))
+            for number in (1, 2, 2, 3)
+        ])
+        for number, expected in ((1, ['table 1']), (2, ['table 2', 'table 2']), (3, ['table 3'])):
+            page, _ = ChatMessage.get_history(room.id, 10, shard=message_shard(number))
+            self.assertEqual([message.message for message in page], expected)
+
+    @mock.patch('rooms.shards.broadcast_to_room', new_callable=mock.AsyncMock)
+    @mock.patch('rooms.consumers.chat_buffer.add', new_callable=mock.AsyncMock)
+    async def test_staff_announcement_to_every_table(self, add, broadcast):
+        for user_id in range(1, 8):
+            self.seat(user_id)
+        staff = mock.Mock(id=1, username='staff', is_authenticated=True, is_staff=True)
+        consumer = ChatConsumer()
+        consumer.room_id = 1
+        consumer.join_shard(2)
+
+        await consumer.announce(staff, 'Library closes at 10')
+        self.assertEqual([call.args[0].shard for call in add.await_args_list], [None, 2, 3])
+        self.assertEqual([call.args[0] for call in broadcast.await_args_list], ['GLOBAL', 'GLOBAL_2', 'GLOBAL_3'])
+        self.assertEqual(broadcast.await_args.args[1]['type'], 'announcement')
@@ -10,5 +10,6 @@ urlpatterns = [
     path('chat/', views.global_chat_view, name='global_chat'),
     path('rooms/create/', views.create_room_view, name='create_room'),
     path('rooms/join/', views.join_room_by_code_view, name='join_room_by_code'),
+    path('api/rooms/', views.room_directory_api, name='room_directory_api'),
     path('rooms/<str:room_code>/', views.room_detail_view, name='room_detail'),
 ]
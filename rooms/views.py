@@ -5,10 +5,19 @@ Handles room listing, creation, and detail pages.
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Count
+from django.conf import settings
+from django.db.models import Q, F
+from django.http import JsonResponse
+from django.urls import reverse
 from django.utils import timezone
 from datetime import timedelta
+from .activity import activity_tracker
+from .admission import admission
+from .directory import SORT_FIELDS, InvalidCursor, directory_page
 from .models import Room, RoomMembership
+from .presence import presence
+from .search import search_rooms
+from .shards import shard_code, shard_router
 import json
 
 
@@ -24,25 +33,34 @@ def landing_view(request):
     return render(request, 'landing.html')
 
 
+def get_active_members(room, user, include_viewer=True, room_code=None):
+    """
+    Returns the memberships of everyone connected to the room right now
+    (from rooms.presence), plus the viewer, whose WebSocket connects once
+    the page has loaded (unless they will have to wait for a seat).
+    `room_code` picks one table of the global room (see rooms.shards).
+    Users and profiles (for avatars) come in the same query.
+    """
+    member_ids = set(presence.members(room_code or room.room_code))
+    if include_viewer:
+        member_ids.add(user.id)
+    return list(
+        RoomMembership.objects.filter(room=room, user_id__in=member_ids).select_related('user__profile')
+    )
+
+
 @login_required
 def home_view(request):
     """
     Home dashboard showing rooms created by the current user.
     Users must be logged in to see this page.
     """
-    from tracker.models import StudySession
+    from tracker.models import DailyStudyRollup
+    from tracker.rollup import daily_totals
     from django.db.models import Sum
-    from datetime import datetime, timedelta
     from django.contrib.auth.models import User
     
-    # Clean up expired rooms (excluding the global room)
-    expired_rooms = Room.objects.filter(
-        expires_at__lte=timezone.now()
-    ).exclude(room_code='GLOBAL')
-    expired_count = expired_rooms.count()
-    if expired_count > 0:
-        expired_rooms.delete()
-        messages.info(request, f'{expired_count} empty room(s) expired and removed.')
+    # Expired rooms are deleted in the background (see rooms.expiry)
     
     # Get all active PUBLIC rooms created by the current user
     rooms = Room.objects.filter(
@@ -56,51 +74,45 @@ def home_view(request):
     
     # Apply search filter if provided
     if search_query:
-        # Search in room name and description
-        rooms = rooms.filter(
-            Q(name__icontains=search_query) |
-            Q(description__icontains=search_query)
-        )
+        # Full-text search in room name and description, best match first
+        rooms = search_rooms(rooms, search_query)
     
-    # Annotate with member count for display
-    rooms = rooms.annotate(
-        member_count=Count('memberships', filter=Q(memberships__is_active=True))
-    ).select_related('created_by')
+    # Member count for display (stored on the room, no join needed)
+    rooms = rooms.annotate(member_count=F('active_member_count')).select_related('created_by')
     
-    # Get rooms the current user is a member of
-    user_rooms = Room.objects.filter(memberships__user=request.user, memberships__is_active=True)
+    # Get rooms the current user is in, with live member counts from presence
+    user_rooms = list(Room.objects.filter(memberships__user=request.user, memberships__is_active=True))
+    for room in user_rooms:
+        room.member_count = presence.count(room.room_code)
     
-    # Get active study sessions (users who studied in the last 24 hours)
+    # Get active study sessions (users who studied today or yesterday),
+    # from the daily rollups
     today = timezone.now()
-    yesterday = today - timedelta(days=1)
+    yesterday = timezone.localdate() - timedelta(days=1)
     
-    # Get recent study sessions grouped by user
-    recent_sessions = StudySession.objects.filter(
-        created_at__gte=yesterday
-    ).select_related('user', 'user__profile').values('user').annotate(
-        total_minutes=Sum('minutes')
-    ).order_by('-total_minutes')[:4]  # Top 4 active users
+    recent_totals = DailyStudyRollup.objects.filter(
+        date__gte=yesterday
+    ).values('user').annotate(
+        total_minutes=Sum(F('focus_minutes') + F('break_minutes'))
+    ).filter(total_minutes__gt=0).order_by('-total_minutes')[:4]  # Top 4 active users
     
-    # Enrich with user details
+    # Enrich with user details (one query for all of them)
+    recent_totals = list(recent_totals)
+    users = User.objects.select_related('profile').in_bulk([row['user'] for row in recent_totals])
     active_sessions = []
-    for session in recent_sessions:
-        user = User.objects.select_related('profile').get(id=session['user'])
+    for row in recent_totals:
         active_sessions.append({
-            'user': user,
-            'minutes': session['total_minutes'],
-            'hours': session['total_minutes'] // 60,
-            'remaining_minutes': session['total_minutes'] % 60,
+            'user': users[row['user']],
+            'minutes': row['total_minutes'],
+            'hours': row['total_minutes'] // 60,
+            'remaining_minutes': row['total_minutes'] % 60,
         })
     
-    # Get current user's weekly statistics
-    week_ago = today - timedelta(days=7)
-    user_week_sessions = StudySession.objects.filter(
-        user=request.user,
-        created_at__gte=week_ago
-    )
+    # Get current user's statistics for the last 7 days
+    days = daily_totals(request.user, timezone.localdate() - timedelta(days=6))
     
     # Calculate weekly total
-    week_total = user_week_sessions.aggregate(total=Sum('minutes'))['total'] or 0
+    week_total = sum(row.total_minutes for row in days.values())
     
     # Calculate completion percentage (40 hours = 2400 minutes = 100%)
     weekly_goal = 2400  # 40 hours in minutes
@@ -109,15 +121,8 @@ def home_view(request):
     # Get daily breakdown for the last 7 days
     daily_stats = []
     for i in range(7):
-        day = today - timedelta(days=6-i)
-        day_start = day.replace(hour=0, minute=0, second=0, microsecond=0)
-        day_end = day_start + timedelta(days=1)
-        
-        day_sessions = user_week_sessions.filter(
-            created_at__gte=day_start,
-            created_at__lt=day_end
-        )
-        day_total = day_sessions.aggregate(total=Sum('minutes'))['total'] or 0
+        day = timezone.localdate() - timedelta(days=6-i)
+        day_total = days[day].total_minutes if day in days else 0
         
         daily_stats.append({
             'day': day.strftime('%a'),  # Mon, Tue, etc.
@@ -153,29 +158,44 @@ def create_room_view(request):
     GET: Display create room form
     POST: Create the room and redirect to room detail
     """
+    context = {'max_members_limit': getattr(settings, 'ROOM_MAX_MEMBERS_LIMIT', 50)}
+    
     if request.method == 'POST':
         name = request.POST.get('name')
         description = request.POST.get('description', '')
         is_public = request.POST.get('is_public') == 'on'  # Checkbox value
+        max_members = request.POST.get('max_members', '').strip() or None
         
         # Validate room name
         if not name or len(name.strip()) == 0:
             messages.error(request, 'Room name is required.')
-            return render(request, 'rooms/create_room.html')
+            return render(request, 'rooms/create_room.html', context)
+        
+        # Validate member limit (optional)
+        if max_members is not None:
+            try:
+                max_members = int(max_members)
+            except ValueError:
+                max_members = 0
+            if not 1 <= max_members <= context['max_members_limit']:
+                messages.error(request, f"Member limit must be between 1 and {context['max_members_limit']}.")
+                return render(request, 'rooms/create_room.html', context)
         
         # Create the room
         room = Room.objects.create(
             name=name,
             description=description,
             created_by=request.user,
-            is_public=is_public
+            is_public=is_public,
+            max_members=max_members,
         )
         
-        # Automatically add creator as a member
+        # Automatically add creator as a member; inactive until their
+        # socket connects, like every other member (presence sets is_active)
         RoomMembership.objects.create(
             user=request.user,
             room=room,
-            is_active=True
+            is_active=False
         )
         
         visibility = "public" if is_public else "private"
@@ -183,7 +203,7 @@ def create_room_view(request):
         return redirect('room_detail', room_code=room.room_code)
     
     # GET request - show form
-    return render(request, 'rooms/create_room.html')
+    return render(request, 'rooms/create_room.html', context)
 
 
 @login_required
@@ -199,40 +219,26 @@ def global_chat_view(request):
         messages.error(request, 'Global chat room has not been created yet. Please contact administrator.')
         return redirect('home')
     
-    # Check if user is already a member
-    existing_membership = RoomMembership.objects.filter(
-        user=request.user,
-        room=global_room
-    ).first()
-    
-    # If already a member, reactivate if needed
-    if existing_membership:
-        if not existing_membership.is_active:
-            existing_membership.is_active = True
-            existing_membership.save()
-    else:
-        # Create new membership
-        RoomMembership.objects.create(
-            user=request.user,
-            room=global_room,
-            is_active=True
-        )
+    # Make sure the user is a member (one upsert); is_active follows their
+    # live connections (see rooms.presence), so it isn't set here
+    RoomMembership.objects.ensure(request.user, global_room)
     
-    # Update room activity
-    global_room.update_activity()
+    # Update room activity (written in the next batched flush)
+    activity_tracker.touch(global_room.id, occupied=True)
     
-    # Get all active members in the room
-    active_members = RoomMembership.objects.filter(
-        room=global_room,
-        is_active=True
-    ).select_related('user')
+    # Show the table the user will most likely be placed at; the WebSocket
+    # picks the actual one when it connects (see rooms.shards)
+    table = shard_router.peek(request.user.id)
+    active_members = get_active_members(global_room, request.user, room_code=shard_code(table))
     
     context = {
         'room': global_room,
         'active_members': active_members,
-        'members_count': active_members.count(),
-        'is_owner': global_room.created_by == request.user,
+        'members_count': len(active_members),
+        'is_owner': global_room.created_by_id == request.user.id,
         'is_global': True,  # Flag to indicate this is the global room
+        'table': table,
+        'tables': len(shard_router.shards()),
     }
     return render(request, 'rooms/chat_room.html', context)
 
@@ -258,7 +264,7 @@ def join_room_by_code_view(request):
             
             # Check if room has expired
             if room.is_expired():
-                room.delete()
+                room.tombstone()
                 messages.error(request, 'This room has expired due to inactivity.')
                 return redirect('home')
             
@@ -286,51 +292,87 @@ def room_detail_view(request, room_code):
     
     # Check if room has expired
     if room.is_expired():
-        room.delete()
+        room.tombstone()
         messages.error(request, 'This room has expired due to inactivity.')
         return redirect('home')
     
-    # Check if user is already a member
-    existing_membership = RoomMembership.objects.filter(
-        user=request.user,
-        room=room
-    ).first()
-    
-    # If already a member, reactivate if needed
-    if existing_membership:
-        if not existing_membership.is_active:
-            existing_membership.is_active = True
-            existing_membership.save()
-    else:
-        # Create new membership
-        RoomMembership.objects.create(
-            user=request.user,
-            room=room,
-            is_active=True
+    # Make sure the user is a member (one upsert); is_active follows their
+    # live connections (see rooms.presence), so it isn't set here
+    created = RoomMembership.objects.ensure(request.user, room)
+    
+    # Create notification for room owner (if a new member, not the owner, joined)
+    if created and room.created_by_id != request.user.id:
+        from notifications.models import Notification
+        Notification.create_new_member_notification(
+            room_owner=room.created_by,
+            new_member=request.user,
+            room=room
         )
-        
-        # Create notification for room owner (if not the owner joining)
-        if room.created_by != request.user:
-            from notifications.models import Notification
-            Notification.create_new_member_notification(
-                room_owner=room.created_by,
-                new_member=request.user,
-                room=room
-            )
-    
-    # Update room activity (clears expiration since user just joined)
-    room.update_activity()
-    
-    # Get all active members in the room
-    active_members = RoomMembership.objects.filter(
-        room=room,
-        is_active=True
-    ).select_related('user')
+    
+    # Update room activity (clears expiration since user just joined;
+    # written in the next batched flush)
+    activity_tracker.touch(room.id, occupied=True)
+    
+    # A full room still opens, but the WebSocket puts the user in the
+    # waiting queue until a seat frees up (see rooms.admission). This is
+    # only what the page shows first; the WebSocket decides.
+    waiting = admission.is_full(room.room_code, request.user.id, room.max_members)
+    queue_position = None
+    if waiting:
+        # Already queued from another tab, or would join at the back
+        queue_position = (admission.position(room.room_code, request.user.id)
+                          or admission.queue_length(room.room_code) + 1)
+    
+    # One query for the member list; the count is its length
+    active_members = get_active_members(room, request.user, include_viewer=not waiting)
     
     context = {
         'room': room,
         'active_members': active_members,
-        'members_count': active_members.count(),
-        'is_owner': room.created_by == request.user,
+        'members_count': len(active_members),
+        'is_owner': room.created_by_id == request.user.id,
+        'waiting': waiting,
+        'queue_position': queue_position,
     }
     return render(request, 'rooms/room_detail.html', context)
+
+
+@login_required
+def room_directory_api(request):
+    """
+    JSON directory of public rooms, a page at a time.
+    Query parameters: sort ('activity' or 'members'), cursor (from the
+    previous page's next_cursor), limit.
+    """
+    sort = request.GET.get('sort', 'activity')
+    if sort not in SORT_FIELDS:
+        return JsonResponse({'success': False, 'error': f"sort must be one of: {', '.join(SORT_FIELDS)}"}, status=400)
+    
+    max_limit = getattr(settings, 'ROOM_DIRECTORY_MAX_PAGE_SIZE', 100)
+    try:
+        limit = int(request.GET.get('limit') or getattr(settings, 'ROOM_DIRECTORY_PAGE_SIZE', 20))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'limit must be a number'}, status=400)
+    limit = max(1, min(limit, max_limit))
+    
+    try:
+        rooms, next_cursor = directory_page(sort, request.GET.get('cursor'), limit)
+    except InvalidCursor as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'rooms': [
+            {
+                'room_code': room['room_code'],
+                'name': room['name'],
+                'description': room['description'],
+                'created_by': room['created_by__username'],
+                'member_count': room['active_member_count'],
+                'last_activity': room['last_activity'].isoformat(),
+                'url': reverse('room_detail', args=[room['room_code']]),
+            }
+            for room in rooms
+        ],
+        'next_cursor': next_cursor,
+    })
@@ -8,11 +8,13 @@ from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.utils import timezone
 from django.views.decorators.http import require_POST
-from django.db.models import Sum
+from django.contrib.auth.models import User
 from datetime import datetime, timedelta
 import json
 
 from tracker.models import Task, StudySession, Achievement, UserAchievement
+from tracker.rank_index import rank_index
+from tracker.rollup import totals
 from accounts.models import UserProfile, UserPreferences
 
 
@@ -30,12 +32,7 @@ def solo_study_room(request):
     active_tasks = Task.objects.filter(user=request.user, completed=False)
     
     # Get today's stats
-    today = timezone.now().date()
-    today_minutes = StudySession.objects.filter(
-        user=request.user,
-        created_at__date=today,
-        session_type='focus'
-    ).aggregate(Sum('minutes'))['minutes__sum'] or 0
+    today_minutes = totals(request.user, timezone.localdate())['focus_minutes']
     
     # Pack everything into context
     context = {
@@ -231,16 +228,8 @@ def get_study_stats(request):
         start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
         period_label = 'This month'
     
-    # Get study sessions in the period (only focus sessions)
-    sessions = StudySession.objects.filter(
-        user=user,
-        created_at__gte=start_date,
-        session_type='focus',
-        completed=True
-    )
-    
-    # Calculate total study time in minutes
-    total_minutes = sessions.aggregate(Sum('minutes'))['minutes__sum'] or 0
+    # Completed focus time in the period, from the daily rollups
+    total_minutes = totals(user, timezone.localdate(start_date))['completed_focus_minutes']
     study_hours = round(total_minutes / 60, 1)
     
     # Calculate level based on hours
@@ -270,27 +259,15 @@ def get_study_stats(request):
     open_goals = Task.objects.filter(user=user, completed=False).count()
     completed_goals = Task.objects.filter(user=user, completed=True).count()
     
-    # Get leaderboard rank (based on total study time)
-    user_total_minutes = StudySession.objects.filter(
-        user=user,
-        session_type='focus',
-        completed=True
-    ).aggregate(Sum('minutes'))['minutes__sum'] or 0
-    
-    # Count users with more study time
-    from django.contrib.auth.models import User
-    from django.db.models import Q
-    
-    users_with_more_time = User.objects.filter(
-        study_sessions__session_type='focus',
-        study_sessions__completed=True
-    ).annotate(
-        total_time=Sum('study_sessions__minutes')
-    ).filter(
-        total_time__gt=user_total_minutes
-    ).distinct().count()
-    
-    rank = users_with_more_time + 1
+    # Get leaderboard rank (all time) and who is just above and below,
+    # from the in-memory rank index instead of aggregating every user
+    rank, _, _ = rank_index.rank('alltime', user.id)
+    neighbours = rank_index.around('alltime', user.id)
+    usernames = dict(User.objects.filter(id__in=[other for _, other, _ in neighbours]).values_list('id', 'username'))
+    nearby = [
+        {'rank': place, 'username': usernames.get(other), 'hours': round(minutes / 60, 1), 'is_you': other == user.id}
+        for place, other, minutes in neighbours
+    ]
     
     return JsonResponse({
         'success': True,
@@ -304,4 +281,5 @@ def get_study_stats(request):
         'completed_goals': completed_goals,
         'total_goals': total_goals,
         'rank': rank,
+        'nearby': nearby,
     })
@@ -8,6 +8,16 @@
 // ===== GLOBAL VARIABLES =====
 
 let chatSocket = null;
+let historyCursor = null;      // Cursor for loading older chat messages
+let historyLoading = false;
+let lastSeq = 0;               // Sequence number of the last room event seen
+let roomEpoch = null;          // Event log the sequence numbers belong to
+let resuming = false;          // Waiting for missed events after a gap
+let heartbeatInterval = null;  // Keeps our presence alive while the tab is open
+const ACK_EVERY = 20;          // Room events handled between acks
+let unackedEvents = 0;
+let ackTimer = null;
+let membersVersion = -1;       // Version of the user list shown (see 'members')
 
 // ===== WEBSOCKET SETUP =====
 
@@ -16,13 +26,20 @@ let chatSocket = null;
  */
 function initWebSocket() {
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${protocol}//${window.location.host}/ws/rooms/${ROOM_CODE}/`;
+    let wsUrl = `${protocol}//${window.location.host}/ws/rooms/${ROOM_CODE}/`;
+    
+    // On reconnect, ask only for the events missed while disconnected
+    if (roomEpoch) {
+        wsUrl += `?epoch=${roomEpoch}&seq=${lastSeq}`;
+    }
     
     chatSocket = new WebSocket(wsUrl);
     
     chatSocket.onopen = function(e) {
         console.log('✅ Connected to chat');
         hideEmptyState();
+        clearInterval(heartbeatInterval);
+        heartbeatInterval = setInterval(sendHeartbeat, 25000);
     };
     
     chatSocket.onmessage = function(e) {
@@ -31,6 +48,11 @@ function initWebSocket() {
     };
     
     chatSocket.onclose = function(e) {
+        clearInterval(heartbeatInterval);
+        // 4000 = server dropped us for falling behind: do a full resync
+        if (e.code === 4000) {
+            roomEpoch = null;
+        }
         console.log('❌ Disconnected from chat');
         setTimeout(initWebSocket, 3000); // Auto-reconnect
     };
@@ -44,23 +66,83 @@ function initWebSocket() {
  * Handle incoming WebSocket messages
  */
 function handleWebSocketMessage(data) {
+    // Room events carry a sequence number: skip repeats, fill gaps
+    if (data.seq !== undefined && data.type !== 'history' && data.type !== 'replay') {
+        if (resuming || data.seq <= lastSeq) {
+            return;
+        }
+        if (data.seq > lastSeq + 1) {
+            requestMissedEvents();
+            return;
+        }
+        lastSeq = data.seq;
+        acknowledge();
+    }
+    
     switch(data.type) {
         case 'chat':
             displayChatMessage(data);
             break;
         
-        case 'join':
-            displaySystemMessage(`${data.username} joined the chat`);
-            updateMemberCount();
+        case 'history':
+            // Full snapshot: start counting events from its position
+            roomEpoch = data.epoch;
+            lastSeq = data.seq;
+            resuming = false;
+            displayChatHistory(data);
+            break;
+        
+        case 'replay':
+            // Events missed while disconnected, in order
+            resuming = false;
+            data.events.forEach(handleWebSocketMessage);
+            break;
+        
+        case 'history_before':
+            prependChatHistory(data);
+            break;
+        
+        case 'members':
+            // Full user list, sent on connect; only deltas follow
+            applyMemberSnapshot(data);
             break;
         
-        case 'leave':
+        case 'user_join':
+            if (data.username !== USERNAME) {
+                displaySystemMessage(`${data.username} joined the chat`);
+            }
+            applyMemberDelta(data);
+            break;
+        
+        case 'user_leave':
             displaySystemMessage(`${data.username} left the chat`);
-            updateMemberCount();
+            applyMemberDelta(data);
+            break;
+        
+        case 'shard':
+            // Busy global chat is split into tables; show which one we're at
+            showTable(data.table, data.tables);
+            break;
+        
+        case 'announcement':
+            // Sent to every table
+            displaySystemMessage(`📢 ${data.username}: ${data.message}`);
             break;
     }
 }
 
+/**
+ * Show the table label when the global chat has more than one table
+ */
+function showTable(table, tables) {
+    const label = document.getElementById('table-label');
+    if (!label) {
+        return;
+    }
+    label.textContent = `Table ${table}`;
+    label.style.display = (tables > 1 || table > 1) ? '' : 'none';
+}
+
 // ===== MESSAGE DISPLAY =====
 
 /**
@@ -68,6 +150,16 @@ function handleWebSocketMessage(data) {
  */
 function displayChatMessage(data) {
     const chatMessages = document.getElementById('chat-messages');
+    chatMessages.appendChild(createChatMessageElement(data));
+    
+    // Auto-scroll to bottom
+    scrollToBottom();
+}
+
+/**
+ * Build the bubble element for one chat message
+ */
+function createChatMessageElement(data) {
     const messageDiv = document.createElement('div');
     
     // Check if this is the current user's message
@@ -85,12 +177,79 @@ function displayChatMessage(data) {
         </div>
     `;
     
-    chatMessages.appendChild(messageDiv);
+    return messageDiv;
+}
+
+/**
+ * Show the latest chat history sent by the server on (re)connect.
+ * Replaces old bubbles so reconnects don't duplicate messages.
+ */
+function displayChatHistory(data) {
+    const chatMessages = document.getElementById('chat-messages');
+    chatMessages.querySelectorAll('.message-bubble, .system-message').forEach(el => el.remove());
     
-    // Auto-scroll to bottom
+    if (data.messages.length > 0) {
+        hideEmptyState();
+    }
+    data.messages.forEach(message => {
+        chatMessages.appendChild(createChatMessageElement(message));
+    });
+    
+    historyCursor = data.cursor;
     scrollToBottom();
 }
 
+/**
+ * Insert an older page of history above the current messages
+ */
+function prependChatHistory(data) {
+    const chatMessages = document.getElementById('chat-messages');
+    const previousHeight = chatMessages.scrollHeight;
+    const firstBubble = chatMessages.querySelector('.message-bubble, .system-message');
+    const fragment = document.createDocumentFragment();
+    
+    data.messages.forEach(message => {
+        fragment.appendChild(createChatMessageElement(message));
+    });
+    chatMessages.insertBefore(fragment, firstBubble);
+    
+    // Keep the view on the message the user was reading
+    chatMessages.scrollTop = chatMessages.scrollHeight - previousHeight;
+    
+    historyCursor = data.cursor;
+    historyLoading = false;
+}
+
+/**
+ * Ask the server for the room events after the last one we saw.
+ * It answers with a 'replay', or a full 'history' snapshot if they are too old.
+ */
+function requestMissedEvents() {
+    if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+        resuming = true;
+        chatSocket.send(JSON.stringify({
+            type: 'resume',
+            epoch: roomEpoch,
+            seq: lastSeq
+        }));
+    }
+}
+
+/**
+ * Ask the server for the page of messages before the oldest one shown
+ */
+function loadOlderMessages() {
+    if (!historyCursor || historyLoading) return;
+    
+    if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+        historyLoading = true;
+        chatSocket.send(JSON.stringify({
+            type: 'history_before',
+            cursor: historyCursor
+        }));
+    }
+}
+
 /**
  * Display system messages (join/leave notifications)
  */
@@ -125,6 +284,38 @@ function hideEmptyState() {
 
 // ===== MESSAGE SENDING =====
 
+/**
+ * Tell the server which room events we have handled, every ACK_EVERY events
+ * or after a second. It uses this to tell a slow reader from a fast one.
+ */
+function acknowledge() {
+    unackedEvents += 1;
+    if (unackedEvents >= ACK_EVERY) {
+        sendAck();
+    } else if (!ackTimer) {
+        ackTimer = setTimeout(sendAck, 1000);
+    }
+}
+
+function sendAck() {
+    clearTimeout(ackTimer);
+    ackTimer = null;
+    unackedEvents = 0;
+    if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+        chatSocket.send(JSON.stringify({ type: 'ack', seq: lastSeq }));
+    }
+}
+
+/**
+ * Tell the server this client is still here. Connections that stay silent
+ * for a minute are treated as gone and dropped from the room's members.
+ */
+function sendHeartbeat() {
+    if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+        chatSocket.send(JSON.stringify({ type: 'heartbeat' }));
+    }
+}
+
 /**
  * Send a chat message through WebSocket
  */
@@ -161,12 +352,58 @@ function escapeHtml(text) {
     return div.innerHTML;
 }
 
+// ===== USERS LIST =====
+
 /**
- * Update member count display
+ * Replace the users list with the server's snapshot
  */
-function updateMemberCount() {
-    // Member count will be updated via WebSocket if needed
-    // For now, we can leave it static as it's passed from the server
+function applyMemberSnapshot(data) {
+    membersVersion = data.version;
+    const usersList = document.querySelector('.users-list');
+    usersList.innerHTML = '';
+    data.members.forEach(member => usersList.appendChild(createMemberElement(member)));
+}
+
+/**
+ * Add or remove one user (user_join / user_leave frames).
+ * Deltas not newer than the list we have are already included in it.
+ */
+function applyMemberDelta(data) {
+    if (data.version === undefined || data.version <= membersVersion) {
+        return;
+    }
+    membersVersion = data.version;
+    
+    const usersList = document.querySelector('.users-list');
+    const existing = usersList.querySelector(`[data-user-id="${data.user_id}"]`);
+    if (data.type === 'user_join' && !existing) {
+        usersList.appendChild(createMemberElement(data));
+    } else if (data.type === 'user_leave' && existing) {
+        existing.remove();
+    }
+}
+
+/**
+ * Create a users list entry (same markup as the server-rendered list)
+ */
+function createMemberElement(member) {
+    const item = document.createElement('div');
+    item.className = 'user-item';
+    item.dataset.userId = member.user_id;
+    
+    const avatar = document.createElement('img');
+    avatar.src = member.avatar || `https://ui-avatars.com/api/?name=${encodeURIComponent(member.username)}`;
+    avatar.alt = member.username;
+    avatar.className = 'user-avatar';
+    
+    // Same as the template's truncatechars:10
+    const name = document.createElement('div');
+    name.className = 'user-name';
+    name.textContent = member.username.length > 10 ? member.username.slice(0, 9) + '…' : member.username;
+    
+    item.appendChild(avatar);
+    item.appendChild(name);
+    return item;
 }
 
 /**
@@ -209,6 +446,14 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
     
+    // Load older messages when scrolled to the top of the chat
+    const chatMessages = document.getElementById('chat-messages');
+    chatMessages.addEventListener('scroll', function() {
+        if (chatMessages.scrollTop === 0) {
+            loadOlderMessages();
+        }
+    });
+    
     // Auto-focus on input
     chatInput.focus();
     
@@ -11,18 +11,32 @@
 // ===== GLOBAL VARIABLES =====
 
 let chatSocket = null;
+let historyCursor = null;      // Cursor for loading older chat messages
+let historyLoading = false;
+let lastSeq = 0;               // Sequence number of the last room event seen
+let roomEpoch = null;          // Event log the sequence numbers belong to
+let resuming = false;          // Waiting for missed events after a gap
+let heartbeatInterval = null;  // Keeps our presence alive while the tab is open
+const ACK_EVERY = 20;          // Room events handled between acks
+let unackedEvents = 0;
+let ackTimer = null;
+let membersVersion = -1;       // Version of the member list shown (see 'members')
+let isWaiting = WAITING;       // In the queue for a seat in a full room
 let peerConnection = null;
+let remotePeer = null;         // Peer id of the other side of the call
+let pendingIceCandidates = []; // ICE candidates found before remotePeer is known
 let localStream = null;
 let remoteStream = null;
 let isCallActive = false;
 let isMicOn = true;
 let isCameraOn = true;
 
-// Timer variables
-let timerInterval = null;
-let timerMinutes = 25;
-let timerSeconds = 0;
-let timerRunning = false;
+// Timer variables (the timer itself runs on the server, shared by the room)
+let timerInterval = null;      // Local interval that only redraws the display
+let timerState = null;         // Last timer state received from the server
+let clockOffset = 0;           // Server clock minus local clock, in ms
+let selectedMinutes = 25;      // Focus length picked with the presets
+const pageOpenedAt = Date.now();
 
 // WebRTC configuration
 const rtcConfig = {
@@ -39,7 +53,12 @@ const rtcConfig = {
  */
 function initWebSocket() {
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${protocol}//${window.location.host}/ws/rooms/${ROOM_CODE}/`;
+    let wsUrl = `${protocol}//${window.location.host}/ws/rooms/${ROOM_CODE}/`;
+    
+    // On reconnect, ask only for the events missed while disconnected
+    if (roomEpoch) {
+        wsUrl += `?epoch=${roomEpoch}&seq=${lastSeq}`;
+    }
     
     chatSocket = new WebSocket(wsUrl);
     
@@ -47,6 +66,8 @@ function initWebSocket() {
     chatSocket.onopen = function(e) {
         console.log('WebSocket connected');
         updateVideoStatus('Connected - Ready for video call');
+        clearInterval(heartbeatInterval);
+        heartbeatInterval = setInterval(sendHeartbeat, 25000);
     };
     
     // When message received from server
@@ -57,6 +78,11 @@ function initWebSocket() {
     
     // When connection closes
     chatSocket.onclose = function(e) {
+        clearInterval(heartbeatInterval);
+        // 4000 = server dropped us for falling behind: do a full resync
+        if (e.code === 4000) {
+            roomEpoch = null;
+        }
         console.log('WebSocket disconnected');
         updateVideoStatus('Disconnected');
         setTimeout(initWebSocket, 3000); // Reconnect after 3 seconds
@@ -74,20 +100,64 @@ function initWebSocket() {
  */
 function handleWebSocketMessage(data) {
     const type = data.type;
+    // Room events carry a sequence number: skip repeats, fill gaps
+    if (data.seq !== undefined && data.type !== 'history' && data.type !== 'replay') {
+        if (resuming || data.seq <= lastSeq) {
+            return;
+        }
+        if (data.seq > lastSeq + 1) {
+            requestMissedEvents();
+            return;
+        }
+        lastSeq = data.seq;
+        acknowledge();
+    }
+    
     
     switch(type) {
         case 'chat':
             displayChatMessage(data);
             break;
         
-        case 'join':
-            displayNotification(`${data.username} joined the room`);
-            updateMembersList();
+        case 'history':
+            // Full snapshot: start counting events from its position
+            roomEpoch = data.epoch;
+            lastSeq = data.seq;
+            resuming = false;
+            displayChatHistory(data);
+            break;
+        
+        case 'replay':
+            // Events missed while disconnected, in order
+            resuming = false;
+            if (isWaiting) {
+                hideWaiting(); // Got a seat straight away on reconnect
+            }
+            data.events.forEach(handleWebSocketMessage);
             break;
         
-        case 'leave':
+        case 'history_before':
+            prependChatHistory(data);
+            break;
+        
+        case 'members':
+            // Full member list, sent on connect; only deltas follow
+            if (isWaiting) {
+                hideWaiting(); // Got a seat straight away on reconnect
+            }
+            applyMemberSnapshot(data);
+            break;
+        
+        case 'user_join':
+            if (data.username !== USERNAME) {
+                displayNotification(`${data.username} joined the room`);
+            }
+            applyMemberDelta(data);
+            break;
+        
+        case 'user_leave':
             displayNotification(`${data.username} left the room`);
-            updateMembersList();
+            applyMemberDelta(data);
             break;
         
         case 'webrtc_offer':
@@ -105,9 +175,37 @@ function handleWebSocketMessage(data) {
         case 'timer':
             handleTimerEvent(data);
             break;
+        
+        case 'waiting':
+            // Room is full: we get the room state once a seat frees up
+            showWaiting(data.position);
+            break;
+        
+        case 'admitted':
+            hideWaiting();
+            displayNotification('A seat freed up - you joined the room');
+            break;
     }
 }
 
+/**
+ * Show our place in the queue for a full room
+ */
+function showWaiting(position) {
+    isWaiting = true;
+    document.getElementById('waiting-position').textContent = position;
+    document.getElementById('waiting-banner').style.display = '';
+    document.getElementById('chat-input').disabled = true;
+    updateVideoStatus('Waiting for a seat in the room');
+}
+
+function hideWaiting() {
+    isWaiting = false;
+    document.getElementById('waiting-banner').style.display = 'none';
+    document.getElementById('chat-input').disabled = false;
+    updateVideoStatus('Connected - Ready for video call');
+}
+
 // ===== CHAT FUNCTIONALITY =====
 
 /**
@@ -115,6 +213,14 @@ function handleWebSocketMessage(data) {
  */
 function displayChatMessage(data) {
     const chatMessages = document.getElementById('chat-messages');
+    chatMessages.appendChild(createChatMessageElement(data));
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+}
+
+/**
+ * Build the element for one chat message
+ */
+function createChatMessageElement(data) {
     const messageDiv = document.createElement('div');
     messageDiv.className = 'chat-message';
     
@@ -132,10 +238,75 @@ function displayChatMessage(data) {
         <div class="message-time">${timestamp}</div>
     `;
     
-    chatMessages.appendChild(messageDiv);
+    return messageDiv;
+}
+
+/**
+ * Show the latest chat history sent by the server on (re)connect.
+ * Replaces the chat pane so reconnects don't duplicate messages.
+ */
+function displayChatHistory(data) {
+    const chatMessages = document.getElementById('chat-messages');
+    chatMessages.innerHTML = '';
+    
+    data.messages.forEach(message => {
+        chatMessages.appendChild(createChatMessageElement(message));
+    });
+    
+    historyCursor = data.cursor;
     chatMessages.scrollTop = chatMessages.scrollHeight;
 }
 
+/**
+ * Insert an older page of history above the current messages
+ */
+function prependChatHistory(data) {
+    const chatMessages = document.getElementById('chat-messages');
+    const previousHeight = chatMessages.scrollHeight;
+    const fragment = document.createDocumentFragment();
+    
+    data.messages.forEach(message => {
+        fragment.appendChild(createChatMessageElement(message));
+    });
+    chatMessages.insertBefore(fragment, chatMessages.firstChild);
+    
+    // Keep the view on the message the user was reading
+    chatMessages.scrollTop = chatMessages.scrollHeight - previousHeight;
+    
+    historyCursor = data.cursor;
+    historyLoading = false;
+}
+
+/**
+ * Ask the server for the room events after the last one we saw.
+ * It answers with a 'replay', or a full 'history' snapshot if they are too old.
+ */
+function requestMissedEvents() {
+    if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+        resuming = true;
+        chatSocket.send(JSON.stringify({
+            type: 'resume',
+            epoch: roomEpoch,
+            seq: lastSeq
+        }));
+    }
+}
+
+/**
+ * Ask the server for the page of messages before the oldest one shown
+ */
+function loadOlderMessages() {
+    if (!historyCursor || historyLoading) return;
+    
+    if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+        historyLoading = true;
+        chatSocket.send(JSON.stringify({
+            type: 'history_before',
+            cursor: historyCursor
+        }));
+    }
+}
+
 /**
  * Display a notification (join/leave) in the chat
  */
@@ -149,6 +320,38 @@ function displayNotification(message) {
     chatMessages.scrollTop = chatMessages.scrollHeight;
 }
 
+/**
+ * Tell the server which room events we have handled, every ACK_EVERY events
+ * or after a second. It uses this to tell a slow reader from a fast one.
+ */
+function acknowledge() {
+    unackedEvents += 1;
+    if (unackedEvents >= ACK_EVERY) {
+        sendAck();
+    } else if (!ackTimer) {
+        ackTimer = setTimeout(sendAck, 1000);
+    }
+}
+
+function sendAck() {
+    clearTimeout(ackTimer);
+    ackTimer = null;
+    unackedEvents = 0;
+    if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+        chatSocket.send(JSON.stringify({ type: 'ack', seq: lastSeq }));
+    }
+}
+
+/**
+ * Tell the server this client is still here. Connections that stay silent
+ * for a minute are treated as gone and dropped from the room's members.
+ */
+function sendHeartbeat() {
+    if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+        chatSocket.send(JSON.stringify({ type: 'heartbeat' }));
+    }
+}
+
 /**
  * Send a chat message through WebSocket
  */
@@ -161,12 +364,67 @@ function sendChatMessage(message) {
     }
 }
 
+// ===== MEMBERS LIST =====
+
+/**
+ * Replace the members list with the server's snapshot
+ */
+function applyMemberSnapshot(data) {
+    membersVersion = data.version;
+    const membersList = document.getElementById('members-list');
+    membersList.innerHTML = '';
+    data.members.forEach(member => membersList.appendChild(createMemberElement(member)));
+    updateMembersCount();
+}
+
+/**
+ * Add or remove one member (user_join / user_leave frames).
+ * Deltas not newer than the list we have are already included in it.
+ */
+function applyMemberDelta(data) {
+    if (data.version === undefined || data.version <= membersVersion) {
+        return;
+    }
+    membersVersion = data.version;
+    
+    const membersList = document.getElementById('members-list');
+    const existing = membersList.querySelector(`[data-user-id="${data.user_id}"]`);
+    if (data.type === 'user_join' && !existing) {
+        membersList.appendChild(createMemberElement(data));
+    } else if (data.type === 'user_leave' && existing) {
+        existing.remove();
+    }
+    updateMembersCount();
+}
+
+/**
+ * Create a members list entry (same markup as the server-rendered list)
+ */
+function createMemberElement(member) {
+    const item = document.createElement('li');
+    item.className = 'member-item';
+    item.dataset.userId = member.user_id;
+    
+    const avatar = document.createElement('img');
+    avatar.src = member.avatar || `https://ui-avatars.com/api/?name=${encodeURIComponent(member.username)}`;
+    avatar.alt = member.username;
+    avatar.className = 'member-avatar';
+    
+    const name = document.createElement('span');
+    name.className = 'member-name';
+    name.textContent = member.username;
+    
+    item.appendChild(avatar);
+    item.appendChild(name);
+    return item;
+}
+
 /**
- * Update members count (placeholder - in real app would fetch from server)
+ * Show the number of members in the list
  */
-function updateMembersList() {
-    // In a full implementation, you would request updated member list from server
-    // For now, just increment/decrement the count displayed
+function updateMembersCount() {
+    document.getElementById('members-count').textContent =
+        document.getElementById('members-list').children.length;
 }
 
 /**
@@ -185,6 +443,9 @@ function escapeHtml(text) {
  * Gets user media (camera + mic) and creates peer connection
  */
 async function startCall() {
+    if (isWaiting) {
+        return; // Not in the room yet
+    }
     try {
         // Get user's camera and microphone
         localStream = await navigator.mediaDevices.getUserMedia({
@@ -216,10 +477,7 @@ async function startCall() {
         peerConnection.onicecandidate = function(event) {
             if (event.candidate) {
                 // Send ICE candidate to other peer via WebSocket
-                chatSocket.send(JSON.stringify({
-                    type: 'webrtc_ice',
-                    candidate: event.candidate
-                }));
+                sendIceCandidate(event.candidate);
             }
         };
         
@@ -227,7 +485,7 @@ async function startCall() {
         const offer = await peerConnection.createOffer();
         await peerConnection.setLocalDescription(offer);
         
-        // Send offer through WebSocket
+        // Send offer through WebSocket (no target: every peer in the room gets it)
         chatSocket.send(JSON.stringify({
             type: 'webrtc_offer',
             offer: offer
@@ -253,6 +511,9 @@ async function handleWebRTCOffer(data) {
         return;
     }
     
+    // Reply only to the peer that sent the offer
+    remotePeer = data.sender;
+    
     try {
         // Get user media if not already have it
         if (!localStream) {
@@ -285,10 +546,7 @@ async function handleWebRTCOffer(data) {
             // Handle ICE candidates
             peerConnection.onicecandidate = function(event) {
                 if (event.candidate) {
-                    chatSocket.send(JSON.stringify({
-                        type: 'webrtc_ice',
-                        candidate: event.candidate
-                    }));
+                    sendIceCandidate(event.candidate);
                 }
             };
         }
@@ -303,8 +561,10 @@ async function handleWebRTCOffer(data) {
         // Send answer back
         chatSocket.send(JSON.stringify({
             type: 'webrtc_answer',
-            answer: answer
+            answer: answer,
+            target: remotePeer
         }));
+        flushPendingIceCandidates();
         
         isCallActive = true;
         updateCallButtons();
@@ -326,7 +586,9 @@ async function handleWebRTCAnswer(data) {
     }
     
     try {
+        remotePeer = data.sender;
         await peerConnection.setRemoteDescription(new RTCSessionDescription(data.answer));
+        flushPendingIceCandidates();
         updateVideoStatus('Call connected');
     } catch (error) {
         console.error('Error handling answer:', error);
@@ -344,13 +606,43 @@ async function handleWebRTCICE(data) {
     
     try {
         if (peerConnection) {
-            await peerConnection.addIceCandidate(new RTCIceCandidate(data.candidate));
+            // The server batches candidates; older frames carry just one
+            const candidates = data.candidates || [data.candidate];
+            for (const candidate of candidates) {
+                await peerConnection.addIceCandidate(new RTCIceCandidate(candidate));
+            }
         }
     } catch (error) {
         console.error('Error handling ICE candidate:', error);
     }
 }
 
+/**
+ * Send an ICE candidate to the peer we are calling.
+ * Candidates found before we know who answered are held until we do.
+ */
+function sendIceCandidate(candidate) {
+    if (!remotePeer) {
+        pendingIceCandidates.push(candidate);
+        return;
+    }
+    
+    chatSocket.send(JSON.stringify({
+        type: 'webrtc_ice',
+        candidate: candidate,
+        target: remotePeer
+    }));
+}
+
+/**
+ * Send ICE candidates held back while remotePeer was unknown
+ */
+function flushPendingIceCandidates() {
+    const candidates = pendingIceCandidates;
+    pendingIceCandidates = [];
+    candidates.forEach(sendIceCandidate);
+}
+
 /**
  * End the video call
  */
@@ -366,6 +658,8 @@ function endCall() {
         peerConnection.close();
         peerConnection = null;
     }
+    remotePeer = null;
+    pendingIceCandidates = [];
     
     // Clear video elements
     document.getElementById('local-video').srcObject = null;
@@ -446,78 +740,95 @@ function updateCallButtons() {
 
 // ===== POMODORO TIMER FUNCTIONALITY =====
 
+/**
+ * Seconds left in the current phase, computed locally from the server state.
+ * The server only sends phase changes, never per-second ticks.
+ */
+function getSecondsLeft() {
+    if (!timerState) {
+        return selectedMinutes * 60;
+    }
+    if (timerState.status === 'running') {
+        const elapsed = (Date.now() + clockOffset - timerState.started_at) / 1000;
+        return Math.max(0, timerState.duration - elapsed);
+    }
+    if (timerState.status === 'stopped') {
+        return selectedMinutes * 60;
+    }
+    return timerState.remaining;
+}
+
 /**
  * Update timer display
  */
 function updateTimerDisplay() {
     const display = document.getElementById('timer-display');
-    const mins = String(timerMinutes).padStart(2, '0');
-    const secs = String(timerSeconds).padStart(2, '0');
-    display.textContent = `${mins}:${secs}`;
+    const secondsLeft = Math.ceil(getSecondsLeft());
+    const mins = String(Math.floor(secondsLeft / 60)).padStart(2, '0');
+    const secs = String(secondsLeft % 60).padStart(2, '0');
+    const label = timerState && timerState.phase === 'break' ? 'Break ' : '';
+    display.textContent = `${label}${mins}:${secs}`;
 }
 
 /**
- * Start the Pomodoro timer
+ * Send a timer action to the server, which broadcasts the new state
+ */
+function sendTimerAction(action, extra = {}) {
+    if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+        chatSocket.send(JSON.stringify({
+            type: 'timer',
+            action: action,
+            ...extra
+        }));
+    }
+}
+
+/**
+ * Start the Pomodoro timer for the whole room (or resume it if paused)
  */
 function startTimer() {
-    if (timerRunning) return;
-    
-    timerRunning = true;
-    updateTimerButtons();
+    if (timerState && timerState.status === 'paused') {
+        sendTimerAction('resume');
+        return;
+    }
     
-    timerInterval = setInterval(() => {
-        if (timerSeconds === 0) {
-            if (timerMinutes === 0) {
-                // Timer complete!
-                completeTimer();
-                return;
-            }
-            timerMinutes--;
-            timerSeconds = 59;
-        } else {
-            timerSeconds--;
-        }
-        updateTimerDisplay();
-    }, 1000);
+    sendTimerAction('start', {
+        minutes: selectedMinutes,
+        break_minutes: Math.max(1, Math.round(selectedMinutes / 5))  // 25/5, 50/10
+    });
 }
 
 /**
  * Pause the timer
  */
 function pauseTimer() {
-    timerRunning = false;
-    clearInterval(timerInterval);
-    updateTimerButtons();
+    sendTimerAction('pause');
 }
 
 /**
  * Reset the timer
  */
 function resetTimer() {
-    pauseTimer();
-    timerMinutes = 25;
-    timerSeconds = 0;
-    updateTimerDisplay();
+    sendTimerAction('reset');
 }
 
 /**
- * Handle timer completion
- * Save study session to database
+ * Handle the end of a focus phase
+ * Save the part of the session this user was here for
  */
-function completeTimer() {
-    pauseTimer();
+function completeTimer(state) {
+    // state is already the break that follows, so use the focus length
+    const phaseStart = state.server_time - state.focus_minutes * 60000;
+    const presentSince = Math.max(phaseStart, pageOpenedAt + clockOffset);
+    const minutes = Math.round((state.server_time - presentSince) / 60000);
     
-    // Get the original minutes (before countdown)
-    const originalMinutes = parseInt(document.getElementById('timer-display').dataset.originalMinutes) || 25;
+    if (minutes < 1) return;
     
     // Show completion message
-    alert(`Congratulations! You completed ${originalMinutes} minutes of focused study!`);
+    alert(`Congratulations! You completed ${minutes} minutes of focused study!`);
     
     // Save session to database via POST request
-    saveStudySession(originalMinutes);
-    
-    // Reset timer
-    resetTimer();
+    saveStudySession(minutes);
 }
 
 /**
@@ -571,17 +882,12 @@ function getCookie(name) {
 }
 
 /**
- * Set timer to preset minutes
+ * Set timer to preset minutes (used for the next start)
  */
 function setTimerPreset(minutes) {
-    pauseTimer();
-    timerMinutes = minutes;
-    timerSeconds = 0;
+    selectedMinutes = minutes;
     updateTimerDisplay();
     
-    // Store original minutes for saving later
-    document.getElementById('timer-display').dataset.originalMinutes = minutes;
-    
     // Update preset button styling
     document.querySelectorAll('.preset-btn').forEach(btn => {
         btn.classList.remove('active');
@@ -594,8 +900,9 @@ function setTimerPreset(minutes) {
 function updateTimerButtons() {
     const startBtn = document.getElementById('start-timer-btn');
     const pauseBtn = document.getElementById('pause-timer-btn');
+    const running = timerState && timerState.status === 'running';
     
-    if (timerRunning) {
+    if (running) {
         startBtn.style.display = 'none';
         pauseBtn.style.display = 'inline-block';
     } else {
@@ -605,11 +912,29 @@ function updateTimerButtons() {
 }
 
 /**
- * Handle timer events from other users (optional)
+ * Handle timer state from the server.
+ * Sent on connect ('state'), on user actions and on phase changes ('phase').
  */
 function handleTimerEvent(data) {
-    // You can implement synchronized timer across users if needed
-    console.log('Timer event from', data.username, ':', data.action);
+    clockOffset = data.server_time - Date.now();
+    timerState = data;
+    
+    if (data.action === 'phase' && data.finished === 'focus') {
+        completeTimer(data);
+    } else if (data.username && data.username !== USERNAME) {
+        const verbs = { start: 'started', pause: 'paused', resume: 'resumed', reset: 'reset' };
+        displayNotification(`${data.username} ${verbs[data.action]} the timer`);
+    }
+    
+    // Redraw locally while running; no per-second messages from the server
+    clearInterval(timerInterval);
+    timerInterval = null;
+    if (data.status === 'running') {
+        timerInterval = setInterval(updateTimerDisplay, 250);
+    }
+    
+    updateTimerDisplay();
+    updateTimerButtons();
 }
 
 // ===== EVENT LISTENERS =====
@@ -632,6 +957,14 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
     
+    // Load older messages when scrolled to the top of the chat
+    const chatMessages = document.getElementById('chat-messages');
+    chatMessages.addEventListener('scroll', function() {
+        if (chatMessages.scrollTop === 0) {
+            loadOlderMessages();
+        }
+    });
+    
     // Video call buttons
     document.getElementById('start-call-btn').addEventListener('click', startCall);
     document.getElementById('end-call-btn').addEventListener('click', endCall);
@@ -661,9 +994,8 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
     
-    // Initialize timer display
+    // Initialize timer display (server state arrives on connect)
     updateTimerDisplay();
-    document.getElementById('timer-display').dataset.originalMinutes = 25;
 });
 
 // Clean up on page unload
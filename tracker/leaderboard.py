@@ -0,0 +1,162 @@
+"""
+Materialized study leaderboard.
+LeaderboardEntry holds every user's minutes per period bucket (the day,
+week and month a session falls in, and all time). Saving or deleting a
+study session adds or removes its minutes in place (see tracker.signals),
+so the leaderboard page reads the top users and the viewer's rank with a
+few indexed queries instead of summing every user's sessions.
+rebuild() regenerates the table from the sessions, e.g. after bulk changes
+that send no signals (QuerySet.update()).
+"""
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import CharField, DateField, Q, Sum, Value
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import LeaderboardEntry, StudySession
+
+PERIODS = ['day', 'week', 'month', 'alltime']
+
+ALLTIME_BUCKET = date(1970, 1, 1)
+
+# period -> function truncating a day to the period's bucket in the database
+TRUNCATE = {
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def bucket_start(period, day):
+    """
+    First day of the `period` bucket containing `day`.
+    """
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - timedelta(days=day.weekday())  # Monday
+    if period == 'month':
+        return day.replace(day=1)
+    return ALLTIME_BUCKET
+
+
+def session_buckets(when):
+    """
+    The (period, bucket) pairs a session created at `when` counts towards.
+    """
+    day = timezone.localdate(when)
+    return [(period, bucket_start(period, day)) for period in PERIODS]
+
+
+def current_entries(period):
+    """
+    Entries of active users in the current bucket of `period` with study time.
+    """
+    bucket = bucket_start(period, timezone.localdate())
+    return LeaderboardEntry.objects.filter(period=period, bucket=bucket, minutes__gt=0, user__is_active=True)
+
+
+def users_without_time(period):
+    """
+    Active users with no study time, listed on the all time board after
+    everyone else (the other boards only list users with study time).
+    """
+    if period != 'alltime':
+        return User.objects.none()
+    return User.objects.filter(is_active=True).exclude(id__in=current_entries(period).values('user_id'))
+
+
+def top_entries(period, limit=None):
+    """
+    The `limit` users with the most minutes in the current bucket, with
+    their profiles (for avatars and levels). On the all time board, active
+    users with no study time fill the remaining places, as unsaved entries
+    with 0 minutes.
+    """
+    limit = limit or getattr(settings, 'LEADERBOARD_SIZE', 50)
+    entries = list(
+        current_entries(period).select_related('user__profile').order_by('-minutes', 'user_id')[:limit]
+    )
+    if len(entries) < limit:
+        entries += [
+            LeaderboardEntry(user=user, period=period, bucket=ALLTIME_BUCKET, minutes=0)
+            for user in users_without_time(period).select_related('profile').order_by('id')[:limit - len(entries)]
+        ]
+    return entries
+
+
+def rank_of(period, user_id):
+    """
+    Returns (rank, minutes) of a user in the current bucket. Users with
+    equal minutes are ranked by id, as in top_entries(); users with no
+    study time rank after everyone who has some.
+    """
+    entries = current_entries(period)
+    minutes = entries.filter(user_id=user_id).values_list('minutes', flat=True).first() or 0
+    ahead = entries.filter(Q(minutes__gt=minutes) | Q(minutes=minutes, user_id__lt=user_id)).count()
+    if not minutes:
+        ahead += users_without_time(period).filter(id__lt=user_id).count()
+    return ahead + 1, minutes
+
+
+def board_size(period):
+    """
+    Number of users on the board of `period`.
+    """
+    return current_entries(period).count() + users_without_time(period).count()
+
+
+def record_minutes(user_id, when, minutes):
+    """
+    Add the minutes of a session created at `when` to its buckets
+    (negative minutes take a session out again).
+    """
+    if minutes and when is not None:
+        LeaderboardEntry.objects.add_minutes(user_id, session_buckets(when), minutes)
+
+
+def period_totals(period):
+    """
+    Minutes summed per user and bucket of `period`, as a values() queryset
+    with the columns of LeaderboardEntry. Days are summed from the sessions;
+    longer periods from the day entries, which are far fewer rows.
+    """
+    if period == 'day':
+        rows = StudySession.objects.annotate(entry_bucket=TruncDate('created_at'))
+    else:
+        rows = LeaderboardEntry.objects.filter(period='day')
+        if period in TRUNCATE:
+            rows = rows.annotate(entry_bucket=TRUNCATE[period]('bucket'))
+        else:
+            rows = rows.annotate(entry_bucket=Value(ALLTIME_BUCKET, output_field=DateField()))
+    return rows.order_by().annotate(
+        entry_period=Value(period, output_field=CharField()),
+    ).values('entry_period', 'entry_bucket', 'user_id').annotate(total=Sum('minutes')).filter(total__gt=0)
+
+
+def rebuild():
+    """
+    Regenerate every entry from the study sessions, in one transaction.
+    Each period is one INSERT ... SELECT (days first, the others are summed
+    from them), so the rows never leave the database.
+    Returns {'entries', 'seconds'}.
+    """
+    started = time.monotonic()
+    table = connection.ops.quote_name(LeaderboardEntry._meta.db_table)
+    count = 0
+    with transaction.atomic():
+        LeaderboardEntry.objects.all().delete()
+        with connection.cursor() as cursor:
+            for period in PERIODS:
+                sql, params = period_totals(period).query.sql_with_params()
+                cursor.execute(
+                    f"INSERT INTO {table} (period, bucket, user_id, minutes) "
+                    f"SELECT entry_period, entry_bucket, user_id, total FROM ({sql}) totals",
+                    params,
+                )
+                count += cursor.rowcount
+    return {'entries': count, 'seconds': time.monotonic() - started}
@@ -0,0 +1,28 @@
+"""
+Django management command to build the rank index from the daily
+rollups and publish it as a snapshot (to the cache, or to
+RANK_INDEX_SNAPSHOT_FILE), so web processes warm up from it instead of
+each reading the rollups. Run it at deploy time or from cron.
+Usage: python manage.py rank_index_snapshot
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from tracker.rank_index import RankIndex
+
+
+class Command(BaseCommand):
+    help = 'Build the in-memory rank index and publish it as a snapshot for other processes'
+
+    def handle(self, *args, **options):
+        index = RankIndex()
+        started = time.monotonic()
+        with index.lock:
+            index.load(use_snapshot=False)
+        seconds = time.monotonic() - started
+
+        for period, (bucket, tree) in index.trees.items():
+            self.stdout.write(f'  {period} ({bucket}): {tree.total} users')
+        target = index.snapshot_file or 'the cache'
+        self.stdout.write(self.style.SUCCESS(f'Published rank index snapshot to {target} in {seconds:.2f}s'))
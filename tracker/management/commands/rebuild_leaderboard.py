@@ -0,0 +1,18 @@
+"""
+Django management command to regenerate the materialized leaderboard
+from the study sessions.
+Usage: python manage.py rebuild_leaderboard
+"""
+from django.core.management.base import BaseCommand
+
+from tracker.leaderboard import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the leaderboard table from all study sessions'
+
+    def handle(self, *args, **options):
+        result = rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt leaderboard: {result['entries']} entries in {result['seconds']:.2f}s"
+        ))
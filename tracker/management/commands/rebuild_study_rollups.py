@@ -0,0 +1,18 @@
+"""
+Django management command to regenerate the daily study rollups
+from the study sessions.
+Usage: python manage.py rebuild_study_rollups
+"""
+from django.core.management.base import BaseCommand
+
+from tracker.rollup import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the daily study rollup table from all study sessions'
+
+    def handle(self, *args, **options):
+        result = rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt daily study rollups: {result['rows']} rows in {result['seconds']:.2f}s"
+        ))
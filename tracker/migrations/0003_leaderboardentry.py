@@ -0,0 +1,58 @@
+# Generated by Django 4.2.7 on 2026-10-17 16:02
+
+from datetime import date
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+import django.db.models.deletion
+
+
+def fill_leaderboard(apps, schema_editor):
+    StudySession = apps.get_model('tracker', 'StudySession')
+    LeaderboardEntry = apps.get_model('tracker', 'LeaderboardEntry')
+    for period, truncate in [('day', TruncDay), ('week', TruncWeek), ('month', TruncMonth), ('alltime', None)]:
+        sessions = StudySession.objects.order_by()
+        if truncate:
+            sessions = sessions.annotate(bucket=truncate('created_at')).values('bucket', 'user_id')
+        else:
+            sessions = sessions.values('user_id')
+        LeaderboardEntry.objects.bulk_create([
+            LeaderboardEntry(
+                period=period,
+                bucket=row['bucket'].date() if truncate else date(1970, 1, 1),
+                user_id=row['user_id'],
+                minutes=row['total'],
+            )
+            for row in sessions.annotate(total=Sum('minutes')).filter(total__gt=0)
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tracker', '0002_achievement_studysession_completed_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Today'), ('week', 'This Week'), ('month', 'This Month'), ('alltime', 'All Time')], max_length=10)),
+                ('bucket', models.DateField()),
+                ('minutes', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'bucket', '-minutes', 'user'], name='leaderboard_rank_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardentry',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'user'), name='leaderboard_entry_unique'),
+        ),
+        migrations.RunPython(fill_leaderboard, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-17 16:14
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def fill_rollups(apps, schema_editor):
+    StudySession = apps.get_model('tracker', 'StudySession')
+    DailyStudyRollup = apps.get_model('tracker', 'DailyStudyRollup')
+    days = StudySession.objects.order_by().annotate(day=TruncDate('created_at')).values('user_id', 'day').annotate(
+        focus=Sum('minutes', filter=Q(session_type='focus')),
+        rest=Sum('minutes', filter=~Q(session_type='focus')),
+        count=Count('id'),
+    )
+    DailyStudyRollup.objects.bulk_create([
+        DailyStudyRollup(user_id=row['user_id'], date=row['day'], focus_minutes=row['focus'] or 0,
+                         break_minutes=row['rest'] or 0, sessions=row['count'])
+        for row in days
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tracker', '0003_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStudyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('focus_minutes', models.IntegerField(default=0)),
+                ('break_minutes', models.IntegerField(default=0)),
+                ('sessions', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date'], name='daily_rollup_date_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailystudyrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'date'), name='daily_rollup_unique'),
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-17 18:02
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def fill_completed_focus(apps, schema_editor):
+    StudySession = apps.get_model('tracker', 'StudySession')
+    DailyStudyRollup = apps.get_model('tracker', 'DailyStudyRollup')
+    completed = StudySession.objects.order_by().annotate(day=TruncDate('created_at')).filter(
+        Q(session_type='focus', completed=True), user_id=OuterRef('user_id'), day=OuterRef('date'),
+    ).values('user_id', 'day').annotate(total=Sum('minutes')).values('total')
+    DailyStudyRollup.objects.update(
+        completed_focus_minutes=Coalesce(Subquery(completed, output_field=models.IntegerField()), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0004_dailystudyrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailystudyrollup',
+            name='completed_focus_minutes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_completed_focus, migrations.RunPython.noop),
+    ]
@@ -2,7 +2,7 @@
 Tracker app models.
 Defines StudySession model for tracking study time.
 """
-from django.db import models
+from django.db import connections, models
 from django.contrib.auth.models import User
 from rooms.models import Room
 
@@ -39,6 +39,13 @@ class StudySession(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.minutes} min on {self.created_at.date()}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Values as saved, so an edit can move the minutes on the leaderboard
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
     class Meta:
         ordering = ['-created_at']  # Newest sessions first
 
@@ -138,3 +145,130 @@ class UserAchievement(models.Model):
     def __str__(self):
         return f"{self.user.username} unlocked {self.achievement.name}"
 
+
+
+class LeaderboardEntryManager(models.Manager):
+    def add_minutes(self, user_id, buckets, minutes):
+        """
+        Add `minutes` (may be negative) to a user's entries in the given
+        (period, bucket) pairs with one INSERT ... ON CONFLICT DO UPDATE,
+        so concurrent sessions of a user can't lose an update.
+        """
+        connection = connections[self.db]
+        if not connection.features.supports_update_conflicts_with_target:
+            for period, bucket in buckets:
+                updated = self.filter(period=period, bucket=bucket, user_id=user_id).update(
+                    minutes=models.F('minutes') + minutes
+                )
+                if not updated:
+                    self.create(period=period, bucket=bucket, user_id=user_id, minutes=minutes)
+            return
+        
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        values, params = [], []
+        for period, bucket in buckets:
+            values.append('(%s, %s, %s, %s)')
+            params += [period, connection.ops.adapt_datefield_value(bucket), user_id, minutes]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (period, bucket, user_id, minutes) VALUES {', '.join(values)} "
+                f"ON CONFLICT (period, bucket, user_id) DO UPDATE SET minutes = {table}.minutes + excluded.minutes",
+                params,
+            )
+
+
+class LeaderboardEntry(models.Model):
+    """
+    A user's study minutes in one leaderboard period: a day, a week, a month
+    or all time. Updated as study sessions are saved (see tracker.leaderboard),
+    so the leaderboard is read from here instead of summing sessions.
+    """
+    period = models.CharField(max_length=10, choices=[
+        ('day', 'Today'),
+        ('week', 'This Week'),
+        ('month', 'This Month'),
+        ('alltime', 'All Time'),
+    ])
+    bucket = models.DateField()  # First day of the period (1970-01-01 for all time)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    minutes = models.IntegerField(default=0)
+    
+    objects = LeaderboardEntryManager()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket', 'user'], name='leaderboard_entry_unique'),
+        ]
+        indexes = [
+            # Top of a period and a user's rank are range scans of this index
+            models.Index(fields=['period', 'bucket', '-minutes', 'user'], name='leaderboard_rank_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.minutes} min ({self.period} {self.bucket})"
+
+
+class DailyStudyRollupManager(models.Manager):
+    def add(self, user_id, day, focus_minutes=0, break_minutes=0, sessions=0, completed_focus_minutes=0):
+        """
+        Add to a user's totals for `day` (values may be negative) with one
+        INSERT ... ON CONFLICT DO UPDATE.
+        """
+        connection = connections[self.db]
+        if not connection.features.supports_update_conflicts_with_target:
+            updated = self.filter(user_id=user_id, date=day).update(
+                focus_minutes=models.F('focus_minutes') + focus_minutes,
+                break_minutes=models.F('break_minutes') + break_minutes,
+                sessions=models.F('sessions') + sessions,
+                completed_focus_minutes=models.F('completed_focus_minutes') + completed_focus_minutes,
+            )
+            if not updated:
+                self.create(user_id=user_id, date=day, focus_minutes=focus_minutes,
+                            break_minutes=break_minutes, sessions=sessions,
+                            completed_focus_minutes=completed_focus_minutes)
+            return
+        
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (user_id, date, focus_minutes, break_minutes, sessions, completed_focus_minutes) "
+                f"VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (user_id, date) DO UPDATE SET "
+                f"focus_minutes = {table}.focus_minutes + excluded.focus_minutes, "
+                f"break_minutes = {table}.break_minutes + excluded.break_minutes, "
+                f"sessions = {table}.sessions + excluded.sessions, "
+                f"completed_focus_minutes = {table}.completed_focus_minutes + excluded.completed_focus_minutes",
+                [user_id, connection.ops.adapt_datefield_value(day), focus_minutes, break_minutes, sessions,
+                 completed_focus_minutes],
+            )
+
+
+class DailyStudyRollup(models.Model):
+    """
+    A user's study totals for one day, updated as study sessions are saved
+    (see tracker.rollup), so daily and weekly charts read a few rows
+    instead of aggregating sessions.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_rollups')
+    date = models.DateField()
+    focus_minutes = models.IntegerField(default=0)
+    break_minutes = models.IntegerField(default=0)
+    sessions = models.IntegerField(default=0)  # Number of sessions (focus and break)
+    completed_focus_minutes = models.IntegerField(default=0)  # Focus minutes of sessions not stopped early
+    
+    objects = DailyStudyRollupManager()
+    
+    class Meta:
+        constraints = [
+            # Also the index for reading a user's date range
+            models.UniqueConstraint(fields=['user', 'date'], name='daily_rollup_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='daily_rollup_date_idx'),
+        ]
+    
+    @property
+    def total_minutes(self):
+        return self.focus_minutes + self.break_minutes
+    
+    def __str__(self):
+        return f"{self.user_id} on {self.date}: {self.focus_minutes} min focus"
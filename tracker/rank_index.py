@@ -0,0 +1,308 @@
+"""
+In-memory rank index.
+Answers "what is user X's rank" and "who is ranked around X" for each
+leaderboard period in O(log n), without aggregating sessions. Users are
+ranked by the focus minutes of their completed sessions, as the study
+stats panel always has. Each process keeps a RankTree per period, loaded
+from the daily rollups (tracker.rollup) on first use and kept current by
+the session signals (tracker.signals).
+
+Sessions saved by other processes show up when the index is reloaded,
+every RANK_INDEX_REFRESH_SECONDS. To keep those reloads cheap, the process
+that loads from the database publishes a snapshot through the cache (or
+RANK_INDEX_SNAPSHOT_FILE) and the others load that while it is fresh.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+
+from .leaderboard import PERIODS, bucket_start
+from .models import DailyStudyRollup
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_CACHE_KEY = 'tracker:rank_index'
+
+
+class RankTree:
+    """
+    Order-statistic index of users by minutes.
+
+    A Fenwick tree counts users per minutes value, so the number of users
+    above a score and the score at a given position are O(log max_minutes).
+    Users with the same minutes are kept sorted by id; within a score, the
+    lower id is placed first (as on the leaderboard page).
+    """
+
+    def __init__(self, scores=None):
+        self.scores = {user_id: minutes for user_id, minutes in (scores or {}).items() if minutes > 0}
+        self.ties = {}  # minutes -> sorted user ids
+        for user_id, minutes in self.scores.items():
+            self.ties.setdefault(minutes, []).append(user_id)
+        for users in self.ties.values():
+            users.sort()
+        self.total = len(self.scores)
+        self.size = 1024  # Minutes values covered; doubled as needed
+        self._grow(max(self.ties, default=0))
+
+    def _update(self, minutes, change):
+        i = minutes + 1
+        while i <= self.size:
+            self.tree[i] += change
+            i += i & -i
+
+    def _count_upto(self, minutes):
+        # Users with at most `minutes`
+        i = min(minutes, self.size - 1) + 1
+        count = 0
+        while i > 0:
+            count += self.tree[i]
+            i -= i & -i
+        return count
+
+    def _grow(self, minutes):
+        """
+        (Re)build the tree large enough for `minutes`, in O(size).
+        """
+        while minutes >= self.size:
+            self.size *= 2
+        self.tree = [0] * (self.size + 1)
+        for score, users in self.ties.items():
+            self.tree[score + 1] = len(users)
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self.tree[parent] += self.tree[i]
+
+    def _insert(self, user_id, minutes):
+        if minutes >= self.size:
+            self._grow(minutes)
+        users = self.ties.setdefault(minutes, [])
+        users.insert(self._bisect(users, user_id), user_id)
+        self.scores[user_id] = minutes
+        self._update(minutes, 1)
+        self.total += 1
+
+    def _remove(self, user_id):
+        minutes = self.scores.pop(user_id)
+        users = self.ties[minutes]
+        users.pop(self._bisect(users, user_id))
+        if not users:
+            del self.ties[minutes]
+        self._update(minutes, -1)
+        self.total -= 1
+
+    @staticmethod
+    def _bisect(users, user_id):
+        low, high = 0, len(users)
+        while low < high:
+            middle = (low + high) // 2
+            if users[middle] < user_id:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def add(self, user_id, minutes):
+        """
+        Add minutes (may be negative) to a user's score.
+        """
+        score = self.scores.get(user_id, 0) + minutes
+        if user_id in self.scores:
+            self._remove(user_id)
+        if score > 0:
+            self._insert(user_id, score)
+
+    def rank(self, user_id):
+        """
+        Returns (rank, minutes): 1 + the number of users with more minutes.
+        Users without minutes rank after everyone who has some.
+        """
+        minutes = self.scores.get(user_id, 0)
+        return self.total - self._count_upto(minutes) + 1, minutes
+
+    def position(self, user_id):
+        """
+        1-based place in the ordered list (ties broken by user id), or None.
+        """
+        minutes = self.scores.get(user_id)
+        if minutes is None:
+            return None
+        users = self.ties[minutes]
+        return self.total - self._count_upto(minutes) + self._bisect(users, user_id) + 1
+
+    def at(self, position):
+        """
+        Returns (user_id, minutes) at a 1-based place in the ordered list.
+        """
+        # k-th smallest counting from the bottom, found by descending the tree
+        k = self.total - position + 1
+        index, step = 0, self.size
+        while step:
+            if index + step <= self.size and self.tree[index + step] < k:
+                index += step
+                k -= self.tree[index]
+            step //= 2
+        minutes = index  # tree slot index + 1 holds minutes == index
+        users = self.ties[minutes]
+        return users[len(users) - k], minutes
+
+    def around(self, user_id, count=2):
+        """
+        Returns [(rank, user_id, minutes)] for up to `count` places above
+        and below the user, in order. Empty if the user has no minutes.
+        """
+        position = self.position(user_id)
+        if position is None:
+            return []
+        neighbours = []
+        for place in range(max(1, position - count), min(self.total, position + count) + 1):
+            other, minutes = self.at(place)
+            neighbours.append((self.total - self._count_upto(minutes) + 1, other, minutes))
+        return neighbours
+
+
+class RankIndex:
+    """
+    RankTrees of the current bucket of every leaderboard period.
+
+    Changes recorded by this process are also kept for a while, so that
+    loading a snapshot taken before them doesn't lose them until the next
+    refresh.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.trees = {}  # period -> (bucket, RankTree)
+        self.loaded_at = None
+        self.recent = []  # (time recorded, user_id, buckets, minutes), oldest first
+
+    @property
+    def refresh_interval(self):
+        return getattr(settings, 'RANK_INDEX_REFRESH_SECONDS', 60)
+
+    @property
+    def snapshot_file(self):
+        return getattr(settings, 'RANK_INDEX_SNAPSHOT_FILE', None)
+
+    def tree(self, period):
+        """
+        The RankTree of a period's current bucket, loading or refreshing
+        the index first if needed.
+        """
+        bucket = bucket_start(period, timezone.localdate())
+        with self.lock:
+            loaded = self.trees.get(period)
+            stale = self.loaded_at is None or time.monotonic() - self.loaded_at > self.refresh_interval
+            if loaded is None or loaded[0] != bucket or stale:
+                self.load()
+            return self.trees[period][1]
+
+    def rank(self, period, user_id):
+        tree = self.tree(period)
+        with self.lock:
+            return tree.rank(user_id) + (tree.total,)
+
+    def around(self, period, user_id, count=2):
+        tree = self.tree(period)
+        with self.lock:
+            return tree.around(user_id, count)
+
+    def record(self, user_id, buckets, minutes):
+        """
+        Apply a saved (or removed) session's completed focus minutes to the
+        loaded trees it counts in.
+        """
+        with self.lock:
+            self.recent.append((time.time(), user_id, buckets, minutes))
+            self._apply(user_id, buckets, minutes)
+
+    def _apply(self, user_id, buckets, minutes):
+        for period, bucket in buckets:
+            loaded = self.trees.get(period)
+            if loaded is not None and loaded[0] == bucket:
+                loaded[1].add(user_id, minutes)
+
+    def load(self, use_snapshot=True):
+        """
+        Replace all trees from a fresh snapshot, or else from the database
+        (publishing a new snapshot), then re-apply this process's changes
+        made since the snapshot was taken. Called with the lock held.
+        """
+        today = timezone.localdate()
+        buckets = {period: bucket_start(period, today).isoformat() for period in PERIODS}
+        snapshot = self.read_snapshot() if use_snapshot else None
+        if (snapshot is None or snapshot.get('buckets') != buckets
+                or time.time() - snapshot.get('created', 0) > self.refresh_interval):
+            snapshot = self.build_snapshot(buckets)
+            self.write_snapshot(snapshot)
+
+        self.trees = {
+            period: (
+                bucket_start(period, today),
+                RankTree({int(user_id): minutes for user_id, minutes in snapshot['scores'][period]}),
+            )
+            for period in PERIODS
+        }
+        self.recent = [change for change in self.recent if change[0] >= snapshot['created']]
+        for _, user_id, change_buckets, minutes in self.recent:
+            self._apply(user_id, change_buckets, minutes)
+        self.loaded_at = time.monotonic()
+
+    @staticmethod
+    def build_snapshot(buckets):
+        """
+        Sum every period's completed focus minutes per user from the daily
+        rollups. `created` is taken before reading, so every change
+        recorded after it is re-applied on load.
+        """
+        created = time.time()
+        scores = {}
+        for period in PERIODS:
+            rows = DailyStudyRollup.objects.filter(completed_focus_minutes__gt=0)
+            if period != 'alltime':
+                rows = rows.filter(date__gte=date.fromisoformat(buckets[period]))
+            scores[period] = list(
+                rows.order_by().values('user_id').annotate(minutes=Sum('completed_focus_minutes'))
+                .values_list('user_id', 'minutes')
+            )
+        return {'created': created, 'buckets': buckets, 'scores': scores}
+
+    def read_snapshot(self):
+        try:
+            if self.snapshot_file:
+                with open(self.snapshot_file) as f:
+                    return json.load(f)
+            return cache.get(SNAPSHOT_CACHE_KEY)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error reading rank index snapshot: {str(e)}")
+            return None
+
+    def write_snapshot(self, snapshot):
+        try:
+            if self.snapshot_file:
+                # Write then rename, so readers never see a partial file
+                directory = os.path.dirname(os.path.abspath(self.snapshot_file))
+                with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as f:
+                    json.dump(snapshot, f)
+                os.replace(f.name, self.snapshot_file)
+            else:
+                cache.set(SNAPSHOT_CACHE_KEY, snapshot, timeout=self.refresh_interval)
+        except Exception as e:
+            logger.error(f"Error writing rank index snapshot: {str(e)}")
+
+
+# Shared rank index for this process
+rank_index = RankIndex()
@@ -0,0 +1,87 @@
+"""
+Daily study rollups.
+DailyStudyRollup holds each user's focus minutes, break minutes, number
+of sessions and focus minutes of completed sessions per day. Saving or deleting a study session adds or
+removes it in place (see tracker.signals), so a week or month of stats is
+one range read of a user's rows. rebuild() regenerates the table from the
+sessions.
+"""
+import time
+
+from django.db import connection, transaction
+from django.db.models import Count, IntegerField, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import DailyStudyRollup, StudySession
+
+
+def record_session(user_id, when, session_type, minutes, sessions=1, completed=True):
+    """
+    Add a session created at `when` to its day (pass negative minutes and
+    sessions=-1 to take it out again).
+    """
+    if when is None:
+        return
+    focus_minutes, break_minutes = (minutes, 0) if session_type == 'focus' else (0, minutes)
+    DailyStudyRollup.objects.add(
+        user_id, timezone.localdate(when), focus_minutes, break_minutes, sessions,
+        completed_focus_minutes=focus_minutes if completed else 0,
+    )
+
+
+def daily_totals(user, first_day, last_day=None):
+    """
+    Returns {date: DailyStudyRollup} for the days from `first_day` to
+    `last_day` (default today) that have sessions, in one query.
+    """
+    last_day = last_day or timezone.localdate()
+    rows = DailyStudyRollup.objects.filter(user=user, date__gte=first_day, date__lte=last_day)
+    return {row.date: row for row in rows}
+
+
+def totals(user, first_day=None):
+    """
+    Returns {'focus_minutes', 'break_minutes', 'sessions',
+    'completed_focus_minutes'} summed over a user's days from `first_day`
+    (default: all time).
+    """
+    rows = DailyStudyRollup.objects.filter(user=user)
+    if first_day is not None:
+        rows = rows.filter(date__gte=first_day)
+    return rows.aggregate(
+        focus_minutes=Coalesce(Sum('focus_minutes'), 0),
+        break_minutes=Coalesce(Sum('break_minutes'), 0),
+        sessions=Coalesce(Sum('sessions'), 0),
+        completed_focus_minutes=Coalesce(Sum('completed_focus_minutes'), 0),
+    )
+
+
+def rebuild():
+    """
+    Regenerate every rollup from the study sessions with one
+    INSERT ... SELECT, in one transaction. Returns {'rows', 'seconds'}.
+    """
+    started = time.monotonic()
+    days = StudySession.objects.order_by().annotate(
+        rollup_date=TruncDate('created_at'),
+    ).values('user_id', 'rollup_date').annotate(
+        rollup_focus=Coalesce(Sum('minutes', filter=Q(session_type='focus')), Value(0), output_field=IntegerField()),
+        rollup_break=Coalesce(Sum('minutes', filter=~Q(session_type='focus')), Value(0), output_field=IntegerField()),
+        rollup_sessions=Count('id'),
+        rollup_completed=Coalesce(Sum('minutes', filter=Q(session_type='focus', completed=True)), Value(0),
+                                  output_field=IntegerField()),
+    )
+    sql, params = days.query.sql_with_params()
+    table = connection.ops.quote_name(DailyStudyRollup._meta.db_table)
+    with transaction.atomic():
+        DailyStudyRollup.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (user_id, date, focus_minutes, break_minutes, sessions, completed_focus_minutes) "
+                f"SELECT user_id, rollup_date, rollup_focus, rollup_break, rollup_sessions, rollup_completed "
+                f"FROM ({sql}) days",
+                params,
+            )
+            rows = cursor.rowcount
+    return {'rows': rows, 'seconds': time.monotonic() - started}
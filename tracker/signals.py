@@ -0,0 +1,65 @@
+"""
+Signals for the tracker app.
+Keeps the daily rollups (tracker.rollup), the materialized leaderboard
+(tracker.leaderboard) and this process's rank index (tracker.rank_index)
+in step with study sessions as they are saved, edited and deleted.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .leaderboard import record_minutes, session_buckets
+from .models import StudySession
+from .rank_index import rank_index
+from .rollup import record_session
+
+# Session fields that decide which rollup and leaderboard entries it counts towards
+TRACKED_FIELDS = ('user_id', 'created_at', 'session_type', 'minutes', 'completed')
+
+
+def apply_session(values, sign):
+    """
+    Add a session (sign=1) to the rollups and the leaderboard, or take it
+    out (sign=-1); the rank index follows once the change is committed.
+    """
+    user_id, when = values['user_id'], values['created_at']
+    minutes = sign * (values['minutes'] or 0)
+    record_session(user_id, when, values['session_type'], minutes, sessions=sign, completed=values['completed'])
+    record_minutes(user_id, when, minutes)
+    # The rank index only counts completed focus sessions
+    focus = minutes if values['session_type'] == 'focus' and values['completed'] else 0
+    if focus and when is not None:
+        buckets = session_buckets(when)
+        transaction.on_commit(lambda: rank_index.record(user_id, buckets, focus))
+
+
+@receiver(post_save, sender=StudySession)
+def update_stats_on_session_save(sender, instance, created, **kwargs):
+    """
+    Count a new session in the study stats. An edited session is moved
+    from its old values to the new ones (if they changed).
+    """
+    current = {name: getattr(instance, name) for name in TRACKED_FIELDS}
+    previous = getattr(instance, '_loaded_values', {})
+    
+    if not created:
+        old = {name: previous.get(name) for name in TRACKED_FIELDS}
+        if old == current:
+            return
+        apply_session(old, -1)
+    
+    apply_session(current, 1)
+    instance._loaded_values = {**previous, **current}
+
+
+@receiver(post_delete, sender=StudySession)
+def update_stats_on_session_delete(sender, instance, **kwargs):
+    """
+    Take a deleted session out of the study stats. Skipped when the session
+    goes because its user is deleted; their rollups and entries go too.
+    """
+    origin = kwargs.get('origin')
+    if isinstance(origin, (User, QuerySet)) and getattr(origin, 'model', type(origin)) is User:
+        return
+    apply_session({name: getattr(instance, name) for name in TRACKED_FIELDS}, -1)
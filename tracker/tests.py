@@ -1,3 +1,258 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from .leaderboard import board_size, rank_of, rebuild, top_entries
+from . import rollup
+from .models import DailyStudyRollup, LeaderboardEntry, StudySession
+from .rank_index import RankTree, rank_index
+
+
+class LeaderboardTests(TestCase):
+    """
+    The materialized leaderboard follows session saves, edits and deletes,
+    and always matches a rebuild from the sessions.
+    """
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='pass')
+        self.bob = User.objects.create_user(username='bob', password='pass')
+        self.carol = User.objects.create_user(username='carol', password='pass')
+
+    def entries(self):
+        return sorted(LeaderboardEntry.objects.filter(minutes__gt=0).values_list(
+            'period', 'bucket', 'user_id', 'minutes'
+        ))
+
+    def assertMatchesRebuild(self):
+        incremental = self.entries()
+        rebuild()
+        self.assertEqual(incremental, self.entries())
+
+    def test_sessions_update_entries(self):
+        StudySession.objects.create(user=self.alice, minutes=25)
+        StudySession.objects.create(user=self.alice, minutes=50)
+        StudySession.objects.create(user=self.bob, minutes=30)
+
+        self.assertEqual([(entry.user, entry.minutes) for entry in top_entries('day')],
+                         [(self.alice, 75), (self.bob, 30)])
+        self.assertEqual(rank_of('week', self.bob.id), (2, 30))
+        self.assertEqual(rank_of('alltime', self.carol.id), (3, 0))
+        self.assertMatchesRebuild()
+
+    def test_old_sessions_only_count_in_their_buckets(self):
+        session = StudySession.objects.create(user=self.alice, minutes=40)
+        StudySession.objects.filter(id=session.id).update(created_at=timezone.now() - timedelta(days=40))
+        rebuild()
+
+        self.assertEqual(top_entries('day'), [])
+        self.assertEqual(rank_of('alltime', self.alice.id), (1, 40))
+
+    def test_edit_and_delete(self):
+        session = StudySession.objects.create(user=self.alice, minutes=25)
+        session = StudySession.objects.get(id=session.id)
+        session.minutes = 45
+        session.save()
+        self.assertEqual(rank_of('month', self.alice.id), (1, 45))
+
+        # Saving again without changes (e.g. linking a task) changes nothing
+        session.save()
+        self.assertEqual(rank_of('month', self.alice.id), (1, 45))
+
+        session.delete()
+        self.assertEqual(rank_of('month', self.alice.id), (1, 0))
+        self.assertMatchesRebuild()
+
+    def test_deleting_user_removes_entries(self):
+        StudySession.objects.create(user=self.bob, minutes=30)
+        self.bob.delete()
+        self.assertFalse(LeaderboardEntry.objects.exists())
+
+    def test_inactive_users_left_out(self):
+        StudySession.objects.create(user=self.alice, minutes=25)
+        StudySession.objects.create(user=self.bob, minutes=30)
+        User.objects.filter(id=self.bob.id).update(is_active=False)
+
+        self.assertEqual([entry.user for entry in top_entries('week')], [self.alice])
+        self.assertEqual(rank_of('week', self.alice.id), (1, 25))
+        self.assertEqual(board_size('week'), 1)
+
+    def test_alltime_lists_users_without_study_time(self):
+        StudySession.objects.create(user=self.bob, minutes=30)
+        idle = User.objects.create_user(username='idle', is_active=False)
+
+        self.assertEqual([(entry.user, entry.minutes) for entry in top_entries('alltime')],
+                         [(self.bob, 30), (self.alice, 0), (self.carol, 0)])
+        self.assertEqual(rank_of('alltime', self.carol.id), (3, 0))
+        self.assertEqual(board_size('alltime'), 3)
+        self.assertEqual(board_size('day'), 1)
+        self.assertNotIn(idle, [entry.user for entry in top_entries('alltime')])
+
+    def test_page_query_count_does_not_grow_with_users(self):
+        for user in (self.alice, self.bob, self.carol):
+            StudySession.objects.create(user=user, minutes=20)
+        self.client.force_login(self.carol)
+        url = reverse('leaderboard') + '?period=week'
+        # session, user, top entries with profiles, viewer's minutes, users
+        # ahead, total, achievements, header profile
+        with self.assertNumQueries(8):
+            response = self.client.get(url)
+        self.assertEqual(response.context['user_rank'], 3)
+        self.assertEqual(response.context['total_users'], 3)
+
+        more = [User.objects.create_user(username=f'user{i}') for i in range(10)]
+        for user in more:
+            StudySession.objects.create(user=user, minutes=10)
+        with self.assertNumQueries(8):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['leaderboard']), 13)
+
+
+class RankIndexTests(TestCase):
+    """
+    RankTree answers match a plain sort, and saved sessions reach the index.
+    """
+
+    def test_rank_tree_matches_sorting(self):
+        rng = random.Random(7)
+        tree = RankTree()
+        scores = {}
+        for _ in range(2000):
+            user_id, minutes = rng.randint(1, 200), rng.choice([-30, 10, 25, 50, 3000])
+            tree.add(user_id, minutes)
+            scores[user_id] = scores.get(user_id, 0) + minutes
+            if scores[user_id] <= 0:
+                del scores[user_id]
+
+        ordered = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        self.assertEqual(tree.total, len(ordered))
+        for place, (user_id, minutes) in enumerate(ordered, start=1):
+            rank = 1 + sum(1 for other in scores.values() if other > minutes)
+            self.assertEqual(tree.rank(user_id), (rank, minutes))
+            self.assertEqual(tree.position(user_id), place)
+            self.assertEqual(tree.at(place), (user_id, minutes))
+        self.assertEqual(tree.rank(999), (len(ordered) + 1, 0))
+
+        user_id = ordered[10][0]
+        self.assertEqual([other for _, other, _ in tree.around(user_id, 2)],
+                         [other for other, _ in ordered[8:13]])
+
+    def setUp(self):
+        # Start from an empty index and no shared snapshot
+        cache.clear()
+        rank_index.trees, rank_index.loaded_at, rank_index.recent = {}, None, []
+
+    def test_sessions_update_rank_index(self):
+        alice = User.objects.create_user(username='alice', password='pass')
+        bob = User.objects.create_user(username='bob', password='pass')
+        StudySession.objects.create(user=alice, minutes=30)
+        self.assertEqual(rank_index.rank('alltime', bob.id), (2, 0, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            StudySession.objects.create(user=bob, minutes=45)
+        with self.assertNumQueries(0):
+            self.assertEqual(rank_index.rank('week', bob.id), (1, 45, 2))
+            self.assertEqual([other for _, other, _ in rank_index.around('week', alice.id)], [bob.id, alice.id])
+
+    def test_rank_counts_completed_focus_only(self):
+        alice = User.objects.create_user(username='alice', password='pass')
+        bob = User.objects.create_user(username='bob', password='pass')
+        StudySession.objects.create(user=alice, minutes=30)
+        StudySession.objects.create(user=bob, minutes=40, completed=False)
+        StudySession.objects.create(user=bob, minutes=20, session_type='short_break')
+        self.assertEqual(rank_index.rank('alltime', bob.id), (2, 0, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            StudySession.objects.create(user=bob, minutes=10, completed=False)
+        self.assertEqual(rank_index.rank('alltime', bob.id), (2, 0, 1))
+
+    def test_older_snapshot_keeps_local_changes(self):
+        alice = User.objects.create_user(username='alice', password='pass')
+        bob = User.objects.create_user(username='bob', password='pass')
+        StudySession.objects.create(user=alice, minutes=30)
+        rank_index.rank('alltime', alice.id)  # Publishes a snapshot
+
+        with self.captureOnCommitCallbacks(execute=True):
+            StudySession.objects.create(user=bob, minutes=45)
+        # Reload from the snapshot, which was taken before bob's session
+        rank_index.loaded_at = None
+        with self.assertNumQueries(0):
+            self.assertEqual(rank_index.rank('alltime', bob.id), (1, 45, 2))
+
+
+class RollupTests(TestCase):
+    """
+    Daily rollups follow session saves, edits and deletes, match a rebuild,
+    and serve the progress page without per-day queries.
+    """
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='pass')
+
+    def rows(self):
+        return sorted(DailyStudyRollup.objects.exclude(sessions=0).values_list(
+            'user_id', 'date', 'focus_minutes', 'break_minutes', 'sessions', 'completed_focus_minutes'
+        ))
+
+    def assertMatchesRebuild(self):
+        incremental = self.rows()
+        rollup.rebuild()
+        self.assertEqual(incremental, self.rows())
+
+    def test_sessions_update_rollups(self):
+        StudySession.objects.create(user=self.alice, minutes=25)
+        StudySession.objects.create(user=self.alice, minutes=5, session_type='short_break')
+        old = StudySession.objects.create(user=self.alice, minutes=50)
+        StudySession.objects.filter(id=old.id).update(created_at=timezone.now() - timedelta(days=3))
+        rollup.rebuild()
+
+        today = timezone.localdate()
+        self.assertEqual(rollup.totals(self.alice),
+                         {'focus_minutes': 75, 'break_minutes': 5, 'sessions': 3, 'completed_focus_minutes': 75})
+        day = rollup.daily_totals(self.alice, today - timedelta(days=6))[today]
+        self.assertEqual((day.focus_minutes, day.break_minutes, day.sessions), (25, 5, 2))
+
+    def test_edit_and_delete(self):
+        session = StudySession.objects.create(user=self.alice, minutes=25)
+        session = StudySession.objects.get(id=session.id)
+        session.session_type = 'long_break'
+        session.minutes = 15
+        session.save()
+        self.assertEqual(rollup.totals(self.alice),
+                         {'focus_minutes': 0, 'break_minutes': 15, 'sessions': 1, 'completed_focus_minutes': 0})
+        self.assertMatchesRebuild()
+
+        session.delete()
+        self.assertEqual(rollup.totals(self.alice)['sessions'], 0)
+        self.assertMatchesRebuild()
+
+    def test_stopped_early_sessions(self):
+        session = StudySession.objects.create(user=self.alice, minutes=10, completed=False)
+        StudySession.objects.create(user=self.alice, minutes=25)
+        totals = rollup.totals(self.alice)
+        self.assertEqual((totals['focus_minutes'], totals['completed_focus_minutes']), (35, 25))
+        self.assertMatchesRebuild()
+
+        session = StudySession.objects.get(id=session.id)
+        session.completed = True
+        session.save()
+        self.assertEqual(rollup.totals(self.alice)['completed_focus_minutes'], 35)
+        self.assertMatchesRebuild()
+
+    def test_progress_page_query_count_does_not_grow_with_sessions(self):
+        self.client.force_login(self.alice)
+        url = reverse('progress')
+        # session, user, the week's rollups, achievements, header profile
+        with self.assertNumQueries(5):
+            self.client.get(url)
 
-# Create your tests here.
+        for minutes in (25, 25, 50):
+            StudySession.objects.create(user=self.alice, minutes=minutes)
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(response.context['today_total'], 100)
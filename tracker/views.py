@@ -5,12 +5,12 @@ Handles study progress tracking and saving study sessions.
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Sum, Count
 from django.utils import timezone
 from datetime import timedelta
+from .leaderboard import board_size, rank_of, top_entries
 from .models import StudySession, Achievement
+from .rollup import daily_totals
 from rooms.models import Room
-from django.contrib.auth.models import User
 
 
 @login_required
@@ -20,23 +20,17 @@ def progress_view(request):
     Shows today's total, this week's total, and last 7 days breakdown.
     """
     user = request.user
-    now = timezone.now()
-    today = now.date()
+    today = timezone.localdate()
+    week_start = today - timedelta(days=today.weekday())  # Monday of current week
+    
+    # One read of the daily rollups covers today, this week and the last 7 days
+    days = daily_totals(user, min(week_start, today - timedelta(days=6)), today)
     
     # Calculate today's total minutes
-    today_sessions = StudySession.objects.filter(
-        user=user,
-        created_at__date=today
-    )
-    today_total = today_sessions.aggregate(Sum('minutes'))['minutes__sum'] or 0
+    today_total = days[today].total_minutes if today in days else 0
     
     # Calculate this week's total minutes
-    week_start = today - timedelta(days=today.weekday())  # Monday of current week
-    week_sessions = StudySession.objects.filter(
-        user=user,
-        created_at__date__gte=week_start
-    )
-    week_total = week_sessions.aggregate(Sum('minutes'))['minutes__sum'] or 0
+    week_total = sum(row.total_minutes for day, row in days.items() if day >= week_start)
     
     # Get last 7 days data for charts
     last_7_days = []
@@ -44,11 +38,7 @@ def progress_view(request):
     
     for i in range(6, -1, -1):  # 6 days ago to today
         day = today - timedelta(days=i)
-        day_sessions = StudySession.objects.filter(
-            user=user,
-            created_at__date=day
-        )
-        day_total = day_sessions.aggregate(Sum('minutes'))['minutes__sum'] or 0
+        day_total = days[day].total_minutes if day in days else 0
         day_hours = round(day_total / 60, 1)
         
         # Calculate productivity percentage (normalized to 0-100)
@@ -170,57 +160,43 @@ def leaderboard_view(request):
     Display the leaderboard showing top users by study time.
     """
     period = request.GET.get('period', 'alltime')
-    now = timezone.now()
     
-    # Determine date filter based on period
+    # Leaderboard period for the period parameter
     if period == 'today':
-        start_date = now.date()
+        board = 'day'
         period_label = "Today"
     elif period == 'week':
-        start_date = now.date() - timedelta(days=now.weekday())
+        board = 'week'
         period_label = "This Week"
     elif period == 'month':
-        start_date = now.date().replace(day=1)
+        board = 'month'
         period_label = "This Month"
     else:  # alltime
-        start_date = None
+        board = 'alltime'
         period_label = "All Time"
     
-    # Get all users with their study time
-    users_query = User.objects.filter(is_active=True)
-    
-    leaderboard = []
-    for user in users_query:
-        # Calculate total study minutes for this period
-        sessions = StudySession.objects.filter(user=user)
-        if start_date:
-            sessions = sessions.filter(created_at__date__gte=start_date)
-        
-        total_minutes = sessions.aggregate(Sum('minutes'))['minutes__sum'] or 0
-        total_hours = round(total_minutes / 60, 1)
-        
-        if total_hours > 0 or period == 'alltime':  # Show users with study time
-            leaderboard.append({
-                'user': user,
-                'total_minutes': total_minutes,
-                'total_hours': total_hours,
-            })
-    
-    # Sort by total minutes descending
-    leaderboard.sort(key=lambda x: x['total_minutes'], reverse=True)
+    # Top users and the viewer's rank come from the materialized
+    # leaderboard (see tracker.leaderboard), not from summing sessions
+    leaderboard = [
+        {
+            'user': entry.user,
+            'total_minutes': entry.minutes,
+            'total_hours': round(entry.minutes / 60, 1),
+        }
+        for entry in top_entries(board)
+    ]
     
     # Get top 3 for podium
     top_users = leaderboard[:3]
     
     # Find current user's rank
-    user_rank = next((i + 1 for i, entry in enumerate(leaderboard) if entry['user'].id == request.user.id), len(leaderboard))
-    user_entry = next((entry for entry in leaderboard if entry['user'].id == request.user.id), {'total_hours': 0})
-    user_hours = user_entry['total_hours']
+    user_rank, user_minutes = rank_of(board, request.user.id)
+    user_hours = round(user_minutes / 60, 1)
     
     # Calculate stats
     top_hours = top_users[0]['total_hours'] if top_users else 0
     hours_to_top = max(0, top_hours - user_hours)
-    total_users = len(leaderboard)
+    total_users = max(board_size(board), user_rank)  # Counting the viewer
     
     # Get recent achievements for current user
     recent_achievements = []
@@ -113,6 +113,22 @@ CHANNEL_LAYERS = {
     }
 }
 
+# Several worker processes on one machine without Redis: run the broker with
+# "python manage.py run_channel_broker" and start the workers with
+# CHANNEL_LAYER=socket (see rooms/socket_layer.py). Room state such as timers
+# and event sequence numbers lives in the worker, so route each room's
+# WebSocket path to the same worker at the proxy.
+CHANNEL_BROKER_SOCKET = os.getenv('CHANNEL_BROKER_SOCKET', str(BASE_DIR / 'channel_broker.sock'))
+if os.getenv('CHANNEL_LAYER') == 'socket':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'rooms.socket_layer.SocketChannelLayer',
+            'CONFIG': {
+                'path': CHANNEL_BROKER_SOCKET,
+            },
+        },
+    }
+
 # For production with Redis, uncomment below and comment above:
 # CHANNEL_LAYERS = {
 #     'default': {
@@ -124,6 +140,85 @@ CHANNEL_LAYERS = {
 # }
 
 
+# Chat history write-behind buffer (see rooms/chat_buffer.py)
+# Messages are saved in one bulk insert every N messages or M milliseconds
+CHAT_WRITE_BUFFER_SIZE = int(os.getenv('CHAT_WRITE_BUFFER_SIZE', 100))
+CHAT_WRITE_BUFFER_INTERVAL_MS = int(os.getenv('CHAT_WRITE_BUFFER_INTERVAL_MS', 250))
+
+# Chat history sent on connect, and the largest page a client may request
+CHAT_HISTORY_PAGE_SIZE = 50
+CHAT_HISTORY_MAX_PAGE_SIZE = 100
+
+# Recent room events kept per room for clients resuming after a reconnect
+ROOM_EVENT_BUFFER_SIZE = 200
+
+# Per-client outbound queue: frames a client may be behind (queued, or sent
+# and not yet acknowledged) before it counts as slow, and how long it may
+# stay over that limit before it is disconnected (see rooms/outbound.py)
+OUTBOUND_QUEUE_SIZE = 100
+OUTBOUND_QUEUE_GRACE_MS = 2000
+
+# WebRTC ICE candidates to the same peer are sent together every N milliseconds
+WEBRTC_ICE_BATCH_MS = 50
+
+# Room presence (see rooms/presence.py): connections silent for this long are
+# dropped (clients send a heartbeat every 25s), and RoomMembership.is_active
+# is synced from presence every PRESENCE_SWEEP_SECONDS. Memberships of a
+# process that has not swept for 3 x PRESENCE_TIMEOUT_SECONDS are cleared
+# by run_worker
+PRESENCE_TIMEOUT_SECONDS = 60
+PRESENCE_SWEEP_SECONDS = 10
+
+# Room last_activity / expires_at are written for all active rooms in one
+# batched UPDATE every N seconds (see rooms/activity.py)
+ROOM_ACTIVITY_FLUSH_SECONDS = 5
+
+# Expired rooms are tombstoned at their expires_at by rooms/expiry.py,
+# at most this many per UPDATE; new expiries are read from the database
+# every ROOM_EXPIRY_RELOAD_SECONDS
+ROOM_EXPIRY_BATCH_SIZE = 500
+ROOM_EXPIRY_RELOAD_SECONDS = 30
+
+# Room cleanup tombstones at most this many rooms per UPDATE; rooms/purge.py
+# removes their data later in small batches (see rooms/cleanup.py)
+ROOM_CLEANUP_CHUNK_SIZE = 500
+
+# Deleted rooms are tombstoned, then their sessions, memberships and chat
+# history are removed this many rows per transaction (see rooms/purge.py)
+ROOM_PURGE_BATCH_SIZE = 1000
+
+# Room codes are allocated from a shared counter (see rooms/codes.py); each
+# process reserves this many at a time with one UPDATE
+ROOM_CODE_BLOCK_SIZE = 100
+
+# Public room directory API (/api/rooms/): default and largest page
+ROOM_DIRECTORY_PAGE_SIZE = 20
+ROOM_DIRECTORY_MAX_PAGE_SIZE = 100
+
+# Largest member limit a room can be created with; users beyond a room's
+# limit wait in a queue for a seat (see rooms/admission.py)
+ROOM_MAX_MEMBERS_LIMIT = 50
+
+# The global chat is split into tables of this many users once it is busy,
+# so each message only goes to one table (see rooms/shards.py)
+GLOBAL_SHARD_SIZE = 50
+
+# Users listed on the leaderboard page (the viewer's rank is shown anyway)
+LEADERBOARD_SIZE = 50
+
+# Each process keeps an in-memory rank index (tracker/rank_index.py) and
+# reloads it this often to pick up other processes' sessions. Reloads share
+# a snapshot through the cache (use a shared backend such as Redis or
+# Memcached when running several processes) or through this file if set
+RANK_INDEX_REFRESH_SECONDS = 60
+RANK_INDEX_SNAPSHOT_FILE = None
+
+# Background jobs (room cleanup and expiry) run in "python manage.py run_worker",
+# not in web processes. Only one worker runs them: on PostgreSQL it holds an
+# advisory lock, otherwise a lock on this file (workers must share the host)
+WORKER_LOCK_FILE = os.getenv('WORKER_LOCK_FILE', str(BASE_DIR / 'run_worker.lock'))
+
+
 # ========================================
 # DATABASE CONFIGURATION
 # ========================================